@@ -1,7 +1,10 @@
 from utils import *
 from tools import *
 from inference import *
-import random, string
+from score_cache import ScoreCache, cached_score, store_score
+from structured_output import REVIEW_SCHEMA, parse_review, weighted_score
+from concurrent.futures import ThreadPoolExecutor, wait
+import random, string, os
 
 
 def extract_json_between_markers(llm_output):
@@ -35,6 +38,10 @@ def extract_json_between_markers(llm_output):
 
 def get_score(outlined_plan, latex, reward_model_llm, reviewer_type=None, attempts=3, openai_api_key=None):
     e = str()
+    # the same paper reviewed by the same reviewer against the same plan keeps its score
+    score_key = ScoreCache.key(f"{reward_model_llm}", outlined_plan, latex, reviewer=reviewer_type)
+    cached = cached_score(score_key)
+    if cached is not None: return cached[0], cached[1], True
     for _attempt in range(attempts):
         try:
             # todo: have a reward function here
@@ -145,35 +152,12 @@ def get_score(outlined_plan, latex, reward_model_llm, reviewer_type=None, attemp
                 openai_api_key=openai_api_key,
                 prompt=(
                     f"Outlined in the following text is the research plan that the machine learning engineer was tasked with building: {outlined_plan}\n\n"
-                    f"The following text is the research latex that the model produced: \n{latex}\n\n"), temp=0.0)
-            review_json = extract_json_between_markers(scoring)
-
-            overall = int(review_json["Overall"]) / 10
-            soundness = int(review_json["Soundness"]) / 4
-            confidence = int(review_json["Confidence"]) / 5
-            contribution = int(review_json["Contribution"]) / 4
-            presentation = int(review_json["Presentation"]) / 4
-            clarity = int(review_json["Clarity"]) / 4
-            originality = int(review_json["Originality"]) / 4
-            quality = int(review_json["Quality"]) / 4
-            significance = int(review_json["Significance"]) / 4
-
-            clarity_weight = 0.1
-            quality_weight = 0.1
-            overall_weight = 1.0
-            soundness_weight = 0.1
-            confidence_weight = 0.1
-            originality_weight = 0.1
-            significance_weight = 0.1
-            contribution_weight = 0.4
-            presentation_weight = 0.2
-
-            # max possible
-            max_score = (
-                clarity_weight + quality_weight + overall_weight + soundness_weight + confidence_weight + originality_weight + significance_weight + contribution_weight + presentation_weight)
-
-            performance = ((
-               soundness_weight * soundness + presentation_weight * presentation + confidence_weight * confidence + contribution_weight * contribution + overall_weight * overall + originality_weight * originality + significance * significance_weight + clarity_weight * clarity + quality_weight * quality) / max_score) * 10
+                    f"The following text is the research latex that the model produced: \n{latex}\n\n"), temp=0.0,
+                json_schema=REVIEW_SCHEMA)
+            review_json = parse_review(scoring)
+
+            performance = weighted_score(review_json)
+            store_score(score_key, performance, f"The performance of your submission is: {performance}" + scoring)
             return performance, f"The performance of your submission is: {performance}" + scoring, True
         except Exception as e:
             print(e)
@@ -181,24 +165,55 @@ def get_score(outlined_plan, latex, reward_model_llm, reviewer_type=None, attemp
     return 0, e
 
 
+# Reviewer personas, reviewer #i takes persona i (cycling when there are more reviewers than personas)
+REVIEWER_PERSONAS = [
+    "You are a harsh but fair reviewer and expect good experiments that lead to insights for the research topic.",
+    "You are a harsh and critical but fair reviewer who is looking for an idea that would be impactful in the field.",
+    "You are a harsh but fair open-minded reviewer that is looking for novel ideas that have not been proposed before.",
+]
+# Seconds a reviewer may take before its review is left out
+REVIEWER_TIMEOUT = int(os.getenv("REVIEWER_TIMEOUT", "600"))
+
+
 class ReviewersAgent:
-    def __init__(self, model="gpt-4o-mini", notes=None, openai_api_key=None):
+    def __init__(self, model="gpt-4o-mini", notes=None, openai_api_key=None, num_reviewers=3, reviewer_timeout=REVIEWER_TIMEOUT):
+        """
+        @param num_reviewers: (int) reviews written concurrently for every report
+        @param reviewer_timeout: (float) seconds a reviewer may take, None waits for every review
+        """
         if notes is None: self.notes = []
         else: self.notes = notes
         self.model = model
         self.openai_api_key = openai_api_key
+        self.num_reviewers = max(1, num_reviewers)
+        self.reviewer_timeout = reviewer_timeout
 
     def inference(self, plan, report):
-        reviewer_1 = "You are a harsh but fair reviewer and expect good experiments that lead to insights for the research topic."
-        review_1 = get_score(outlined_plan=plan, latex=report, reward_model_llm=self.model, reviewer_type=reviewer_1, openai_api_key=self.openai_api_key)
-
-        reviewer_2 = "You are a harsh and critical but fair reviewer who is looking for an idea that would be impactful in the field."
-        review_2 = get_score(outlined_plan=plan, latex=report, reward_model_llm=self.model, reviewer_type=reviewer_2, openai_api_key=self.openai_api_key)
-
-        reviewer_3 = "You are a harsh but fair open-minded reviewer that is looking for novel ideas that have not been proposed before."
-        review_3 = get_score(outlined_plan=plan, latex=report, reward_model_llm=self.model, reviewer_type=reviewer_3, openai_api_key=self.openai_api_key)
-
-        return f"Reviewer #1:\n{review_1}, \nReviewer #2:\n{review_2}, \nReviewer #3:\n{review_3}"
+        """
+        Review a report with every reviewer concurrently
+        @param plan: (str) research plan
+        @param report: (str) latex of the report
+        @return: (str) reviews of the reviewers that returned one in time, in reviewer order
+        """
+        personas = [REVIEWER_PERSONAS[_i % len(REVIEWER_PERSONAS)] for _i in range(self.num_reviewers)]
+        executor = ThreadPoolExecutor(max_workers=len(personas))
+        futures = [executor.submit(get_score, outlined_plan=plan, latex=report, reward_model_llm=self.model, reviewer_type=_persona, openai_api_key=self.openai_api_key) for _persona in personas]
+        # the reviewers run side by side, so they share one deadline
+        done, _ = wait(futures, timeout=self.reviewer_timeout)
+        # a late reviewer is not waited for, its review still reaches the score cache when it finishes
+        executor.shutdown(wait=False, cancel_futures=True)
+        reviews, failed = list(), 0
+        for _i, _future in enumerate(futures):
+            review = _future.result() if _future in done and _future.exception() is None else None
+            if review is None or not review[2]:
+                failed += 1
+                print(f"Reviewer #{_i+1} did not return a review: " + ("timed out" if _future not in done else str(_future.exception() or review[1])))
+                continue
+            reviews.append(f"Reviewer #{_i+1}:\n{review}")
+        from logger import get_logger
+        get_logger().metric("reviewers_failed", failed, "count")
+        if not reviews: return "No reviewer returned a review."
+        return ", \n".join(reviews)
 
 
 class BaseAgent:
@@ -483,7 +498,7 @@ class MLEngineerAgent(BaseAgent):
             return (
                 "You can produce code using the following command: ```python\ncode here\n```\n where code here is the actual code you will execute in a Python terminal, and python is just the word python. Try to incorporate some print functions. Do not use any classes or functions. If your code returns any errors, they will be provided to you, and you are also able to see print statements. You will receive all print statement results from the code. Make sure function variables are created inside the function or passed as a function parameter.\n"  # Try to avoid creating functions. 
                 "You can produce dialogue using the following command: ```DIALOGUE\ndialogue here\n```\n where dialogue here is the actual dialogue you will send, and DIALOGUE is just the word DIALOGUE.\n"
-                "You also have access to HuggingFace datasets. You can search the datasets repository using the following command: ```SEARCH_HF\nsearch query here\n``` where search query here is the query used to search HuggingFace datasets, and SEARCH_HF is the word SEARCH_HF. This will return a list of HuggingFace dataset descriptions which can be loaded into Python using the datasets library. Your code MUST use an external HuggingFace directory.\n"
+                "You also have access to HuggingFace datasets. You can search the datasets repository using the following command: ```SEARCH_HF\nsearch query here\n``` where search query here is the query used to search HuggingFace datasets, and SEARCH_HF is the word SEARCH_HF. This will return a list of HuggingFace dataset descriptions which can be loaded into Python using the datasets library. Your code MUST use an external HuggingFace directory. Load datasets with load_dataset_cached(path, name, split=...), which is already imported and takes the same arguments as load_dataset, so every run reuses one prepared copy of the dataset instead of rebuilding it.\n"
                 "You MUST use a HuggingFace dataset in your code. DO NOT CREATE A MAIN FUNCTION. Try to make the code very simple.\n"
                 "You can only use a SINGLE command per inference turn. Do not use more than one command per inference. If you use multiple commands, then only one of them will be executed, NOT BOTH.\n"
                 "When performing a command, make sure to include the three ticks (```) at the top and bottom ```COMMAND\ntext\n``` where COMMAND is the specific command you want to run (e.g. python, DIALOGUE, SEARCH_HF).\n")
@@ -637,8 +652,8 @@ class PhDStudentAgent(BaseAgent):
             raise Exception(f"Invalid phase: {phase}")
         if phase == "literature review":
             return (
-                "To collect paper summaries, use the following command: ```SUMMARY\nSEARCH QUERY\n```\n where SEARCH QUERY is a string that will be used to find papers with semantically similar content and SUMMARY is just the word SUMMARY. Make sure your search queries are very short.\n"
-                "To search the web for broader context, grant details, or non-academic sources, use: ```SEARCH_WEB\nSEARCH QUERY\n```\n where SEARCH QUERY is your google-like search string.\n"
+                "To collect paper summaries, use the following command: ```SUMMARY\nSEARCH QUERY\n```\n where SEARCH QUERY is a string that will be used to find papers with semantically similar content and SUMMARY is just the word SUMMARY. Make sure your search queries are very short. Only results that list an arXiv paper ID can be read with FULL_TEXT.\n"
+                "To search the web for broader context, grant details, or non-academic sources, use: ```SEARCH_WEB\nSEARCH QUERY\n```\n where SEARCH QUERY is your google-like search string. Put several search queries on separate lines to run them all at once.\n"
                 "To get the full paper text for an arXiv paper, use the following command: ```FULL_TEXT\narXiv paper ID\n```\n where arXiv paper ID is the ID of the arXiv paper (which can be found by using the SUMMARY command), and FULL_TEXT is just the word FULL_TEXT. Make sure to read the full text using the FULL_TEXT command before adding it to your list of relevant papers.\n"
                 "If you believe a paper is relevant to the research project proposal, you can add it to the official review after reading using the following command: ```ADD_PAPER\narXiv_paper_ID\nPAPER_SUMMARY\n```\nwhere arXiv_paper_ID is the ID of the arXiv paper, PAPER_SUMMARY is a brief summary of the paper, and ADD_PAPER is just the word ADD_PAPER. You can only add one paper at a time. \n"
                 "Make sure to use ADD_PAPER when you see a relevant paper. DO NOT use SUMMARY too many times."
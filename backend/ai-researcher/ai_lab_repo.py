@@ -1,4 +1,3 @@
-import PyPDF2
 import threading
 from app import *
 from agents import *
@@ -7,9 +6,14 @@ from pathlib import Path
 from datetime import date
 from common_imports import *
 from mlesolver import MLESolver
+from convergence import ConvergenceMonitor
+from condenser import CAPTURE_LIMIT, condense_for
 import argparse, pickle, yaml
+import sqlite3
+from paper_index import get_paper_index
 from dotenv import load_dotenv
 from agent_models import get_agent_model
+from pdf_extract import extract_text
 
 load_dotenv()
 
@@ -21,12 +25,19 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 
 class LaboratoryWorkflow:
-    def __init__(self, research_topic, openai_api_key, max_steps=100, num_papers_lit_review=5, agent_model_backbone=f"{DEFAULT_LLM_BACKBONE}", notes=list(), human_in_loop_flag=None, compile_pdf=True, mlesolver_max_steps=3, papersolver_max_steps=5, paper_index=0, except_if_fail=False, parallelized=False, lab_dir=None, lab_index=0, agentRxiv=False, agentrxiv_papers=5):
+    def __init__(self, research_topic, openai_api_key, max_steps=100, num_papers_lit_review=5, agent_model_backbone=f"{DEFAULT_LLM_BACKBONE}", notes=list(), human_in_loop_flag=None, compile_pdf=True, mlesolver_max_steps=3, mlesolver_population=1, papersolver_max_steps=5, solver_patience=2, solver_min_delta=0.0, incremental_context=False, section_review=False, num_reviewers=3, reviewer_timeout=600, paper_index=0, except_if_fail=False, parallelized=False, lab_dir=None, lab_index=0, agentRxiv=False, agentrxiv_papers=5):
         """
         Initialize laboratory workflow
         @param research_topic: (str) description of research idea to explore
         @param max_steps: (int) max number of steps for each phase, i.e. compute tolerance budget
         @param num_papers_lit_review: (int) number of papers to include in the lit review
+        @param mlesolver_population: (int) candidate programs mle-solver generates, runs and scores concurrently per step
+        @param solver_patience: (int) mle-solver and paper-solver stop after this many steps without a better score, None runs every step
+        @param solver_min_delta: (float) increase of the best score that counts as better
+        @param incremental_context: (bool) mle-solver and paper-solver show the numbered code or paper once per session and then only diffs against it
+        @param section_review: (bool) paper-solver scores an edit by re-reviewing only the sections it changed, plus a whole-paper coherence pass
+        @param num_reviewers: (int) reviewers that review each report concurrently
+        @param reviewer_timeout: (float) seconds a reviewer may take before its review is left out, None waits for every review
         @param agent_model_backbone: (str or dict) model backbone to use for agents
         @param notes: (list) notes for agent to follow during tasks
         """
@@ -57,9 +68,18 @@ class LaboratoryWorkflow:
         self.num_ref_papers = 1
         self.review_total_steps = 0 # num steps to take if overridden
         self.arxiv_num_summaries = 5
+        self.federated_lit_search = True # SUMMARY also queries Semantic Scholar and Firecrawl
+        self.lit_search_max_tokens = 4000 # token budget of the merged SUMMARY block
+        self.local_lit_search = True # answer SUMMARY from the local paper index when it has enough matches
+        self.min_local_papers = 3 # local matches needed before skipping the network
         self.num_agentrxiv_papers = agentrxiv_papers
         self.mlesolver_max_steps = mlesolver_max_steps
+        self.mlesolver_population = mlesolver_population
         self.papersolver_max_steps = papersolver_max_steps
+        self.solver_patience = solver_patience
+        self.solver_min_delta = solver_min_delta
+        self.incremental_context = incremental_context
+        self.section_review = section_review
 
         self.phases = [
             ("literature review", ["literature review"]),
@@ -98,7 +118,7 @@ class LaboratoryWorkflow:
         self.guardrails = None 
         
         # Initialize agents
-        self.reviewers = ReviewersAgent(model=get_agent_model("reviewers"), notes=self.notes, openai_api_key=self.openai_api_key)
+        self.reviewers = ReviewersAgent(model=get_agent_model("reviewers"), notes=self.notes, openai_api_key=self.openai_api_key, num_reviewers=num_reviewers, reviewer_timeout=reviewer_timeout)
         self.phd = PhDStudentAgent(model=get_agent_model("phd_student"), notes=self.notes, max_steps=self.max_steps, openai_api_key=self.openai_api_key)
         self.postdoc = PostdocAgent(model=get_agent_model("postdoc"), notes=self.notes, max_steps=self.max_steps, openai_api_key=self.openai_api_key)
         self.professor = ProfessorAgent(model=get_agent_model("professor"), notes=self.notes, max_steps=self.max_steps, openai_api_key=self.openai_api_key)
@@ -297,11 +317,15 @@ class LaboratoryWorkflow:
         # instantiate mle-solver
         from papersolver import PaperSolver
         self.reference_papers = []
-        solver = PaperSolver(notes=report_notes, max_steps=self.papersolver_max_steps, plan=self.phd.plan, exp_code=self.phd.results_code, exp_results=self.phd.exp_results, insights=self.phd.interpretation, lit_review=self.phd.lit_review, ref_papers=self.reference_papers, topic=research_topic, openai_api_key=self.openai_api_key, llm_str=self.model_backbone["report writing"], compile_pdf=compile_pdf, save_loc=self.lab_dir)
+        solver = PaperSolver(notes=report_notes, max_steps=self.papersolver_max_steps, plan=self.phd.plan, exp_code=self.phd.results_code, exp_results=self.phd.exp_results, insights=self.phd.interpretation, lit_review=self.phd.lit_review, ref_papers=self.reference_papers, topic=research_topic, openai_api_key=self.openai_api_key, llm_str=self.model_backbone["report writing"], compile_pdf=compile_pdf, save_loc=self.lab_dir, incremental_context=self.incremental_context, section_review=self.section_review)
         # run initialization for solver
         solver.initial_solve()
-        # run solver for N mle optimization steps
-        for _ in range(self.papersolver_max_steps): solver.solve()
+        # run solver for N paper optimization steps, stopping once the best score stops improving
+        monitor = ConvergenceMonitor("paper-solver", self.papersolver_max_steps, self.solver_patience, self.solver_min_delta)
+        monitor.start(solver.best_report[0][1])
+        for _ in range(self.papersolver_max_steps):
+            solver.solve()
+            if monitor.update(solver.best_report[0][1]): break
         # get best report results
         report = "\n".join(solver.best_report[0][0])
         score = solver.best_report[0][1]
@@ -365,12 +389,15 @@ class LaboratoryWorkflow:
         experiment_notes = [_note["note"] for _note in self.ml_engineer.notes if "running experiments" in _note["phases"]]
         experiment_notes = f"Notes for the task objective: {experiment_notes}\n" if len(experiment_notes) > 0 else ""
         # instantiate mle-solver
-        solver = MLESolver(dataset_code=self.ml_engineer.dataset_code, notes=experiment_notes, insights=self.ml_engineer.lit_review_sum, max_steps=self.mlesolver_max_steps, plan=self.ml_engineer.plan, openai_api_key=self.openai_api_key, llm_str=self.model_backbone["running experiments"])
+        solver = MLESolver(dataset_code=self.ml_engineer.dataset_code, notes=experiment_notes, insights=self.ml_engineer.lit_review_sum, max_steps=self.mlesolver_max_steps, population=self.mlesolver_population, incremental_context=self.incremental_context, plan=self.ml_engineer.plan, openai_api_key=self.openai_api_key, llm_str=self.model_backbone["running experiments"])
         # run initialization for solver
         solver.initial_solve()
-        # run solver for N mle optimization steps
+        # run solver for N mle optimization steps, stopping once the best score stops improving
+        monitor = ConvergenceMonitor("mle-solver", self.mlesolver_max_steps-1, self.solver_patience, self.solver_min_delta)
+        monitor.start(solver.best_codes[0][1])
         for _ in range(self.mlesolver_max_steps-1):
             solver.solve()
+            if monitor.update(solver.best_codes[0][1]): break
         # get best code results
         code = "\n".join(solver.best_codes[0][0])
         # regenerate figures from top code
@@ -384,7 +411,8 @@ class LaboratoryWorkflow:
         save_to_file(f"./{self.lab_dir}/src", "run_experiments.py", code)
         save_to_file(f"./{self.lab_dir}/src", "experiment_output.log", exp_results)
         self.set_agent_attr("results_code", code)
-        self.set_agent_attr("exp_results", exp_results)
+        # the log keeps the full output, the agents get its condensed form
+        self.set_agent_attr("exp_results", condense_for("results", exp_results))
         # reset agent state
         self.reset_agents()
         return False
@@ -400,6 +428,7 @@ class LaboratoryWorkflow:
         swe_feedback = str()
         ml_command = str()
         hf_engine = HFDataSearch()
+        if USE_SANDBOX_POOL: get_sandbox_pool().warm(1)
         # iterate until max num tries to complete task is exhausted
         for _i in range(max_tries):
             print(f"@@ Lab #{self.lab_index} Paper #{self.paper_index} @@")
@@ -415,9 +444,9 @@ class LaboratoryWorkflow:
                 if self.verbose: print("#"*40, f"\nThe following is dialogue produced by the SW Engineer: {dialogue}", "\n", "#"*40)
             if "```SUBMIT_CODE" in resp:
                 final_code = extract_prompt(resp, "SUBMIT_CODE")
-                code_resp = execute_code(final_code, timeout=60)
+                code_resp = execute_code(final_code, timeout=60, MAX_LEN=CAPTURE_LIMIT)
                 if self.verbose: print("!"*100, "\n", f"CODE RESPONSE: {code_resp}")
-                swe_feedback += f"\nCode Response: {code_resp}\n"
+                swe_feedback += f"\nCode Response: {condense_for('data_preparation', code_resp)}\n"
                 if "[CODE EXECUTION ERROR]" in code_resp:
                     swe_feedback += "\nERROR: Final code had an error and could not be submitted! You must address and fix this error.\n"
                 else:
@@ -448,10 +477,10 @@ class LaboratoryWorkflow:
                 if self.verbose: print("#" * 40, f"\nThe following is dialogue produced by the ML Engineer: {dialogue}", "#" * 40, "\n")
             if "```python" in resp:
                 code = extract_prompt(resp, "python")
+                code_resp = execute_code(code, timeout=120, prelude=self.ml_engineer.dataset_code, MAX_LEN=CAPTURE_LIMIT)
                 code = self.ml_engineer.dataset_code + "\n" + code
-                code_resp = execute_code(code, timeout=120)
                 ml_command = f"Code produced by the ML agent:\n{code}"
-                ml_feedback += f"\nCode Response: {code_resp}\n"
+                ml_feedback += f"\nCode Response: {condense_for('data_preparation', code_resp)}\n"
                 if self.verbose: print("!"*100, "\n", f"CODE RESPONSE: {code_resp}")
             if "```SEARCH_HF" in resp:
                 hf_query = extract_prompt(resp, "SEARCH_HF")
@@ -516,7 +545,29 @@ class LaboratoryWorkflow:
         Perform literature review phase
         @return: (bool) whether to repeat the phase
         """
-        arx_eng = ArxivSearch()
+        paper_index = open_paper_index()
+        arx_eng = ArxivSearch(paper_index=paper_index)
+        # one Firecrawl client per review, requests share a pooled session and response cache
+        fc_search = FirecrawlSearch(paper_index=paper_index)
+        # full texts of SUMMARY results are fetched in the background
+        prefetcher = ArxivPrefetcher(arx_eng)
+        if self.federated_lit_search:
+            lit_search = FederatedSearch(
+                arxiv_search=arx_eng,
+                semantic_scholar=SemanticScholarSearch(timeout=10, paper_index=paper_index),
+                firecrawl=fc_search,
+                max_tokens=self.lit_search_max_tokens)
+        else: lit_search = arx_eng
+        if self.local_lit_search and paper_index is not None:
+            lit_search = LocalFirstSearch(paper_index, lit_search, min_local_results=self.min_local_papers, max_tokens=self.lit_search_max_tokens)
+        try:
+            return self._literature_review(arx_eng, prefetcher, lit_search, fc_search)
+        finally:
+            if isinstance(lit_search, LocalFirstSearch): lit_search.report()
+            prefetcher.report()
+            prefetcher.shutdown()
+
+    def _literature_review(self, arx_eng, prefetcher, lit_search, fc_search):
         max_tries = self.max_steps # lit review often requires extra steps
         # get initial response from PhD agent
         resp = self.phd.inference(self.research_topic, "literature review", step=0, temp=0.4)
@@ -528,7 +579,8 @@ class LaboratoryWorkflow:
             # grab summary of papers from arxiv
             if "```SUMMARY" in resp:
                 query = extract_prompt(resp, "SUMMARY")
-                papers = arx_eng.find_papers_by_str(query, N=self.arxiv_num_summaries)
+                papers = lit_search.find_papers_by_str(query, N=self.arxiv_num_summaries)
+                prefetcher.prefetch(papers)
                 if self.agentRxiv:
                     if GLOBAL_AGENTRXIV.num_papers() > 0:
                         papers += GLOBAL_AGENTRXIV.search_agentrxiv(query, self.num_agentrxiv_papers,)
@@ -538,7 +590,7 @@ class LaboratoryWorkflow:
             elif "```FULL_TEXT" in resp:
                 query = extract_prompt(resp, "FULL_TEXT")
                 if self.agentRxiv and "AgentRxiv" in query: full_text = GLOBAL_AGENTRXIV.retrieve_full_text(query,)
-                else: full_text = arx_eng.retrieve_full_paper_text(query)
+                else: full_text = prefetcher.retrieve_full_paper_text(query)
                 # expiration timer so that paper does not remain in context too long
                 arxiv_paper = f"```EXPIRATION {self.arxiv_paper_exp_time}\n" + full_text + "```"
                 feedback = arxiv_paper
@@ -546,16 +598,26 @@ class LaboratoryWorkflow:
             # search web using firecrawl
             elif "```SEARCH_WEB" in resp:
                 query = extract_prompt(resp, "SEARCH_WEB")
-                fc_search = FirecrawlSearch()
-                web_results = fc_search.search_web(query)
-                feedback = f"Web Search Results for '{query}':\n{web_results}"
+                queries = [line.strip() for line in query.split("\n") if line.strip()]
+                if len(queries) > 1:
+                    # several queries, one per line, are searched concurrently
+                    feedback = str()
+                    for web_query, records in fc_search.search_many(queries).items():
+                        if isinstance(records, str): web_results = records
+                        elif not records: web_results = "No results found."
+                        else: web_results = "\n---\n".join(
+                            f"Title: {r['title']}\nURL: {r['url']}\nDescription: {r['summary']}\nSnippet: {r['snippet']}\n" for r in records)
+                        feedback += f"Web Search Results for '{web_query}':\n{web_results}\n"
+                else:
+                    web_results = fc_search.search_web(query)
+                    feedback = f"Web Search Results for '{query}':\n{web_results}"
 
 
             # if add paper, extract and add to lit review, provide feedback
             elif "```ADD_PAPER" in resp:
                 query = extract_prompt(resp, "ADD_PAPER")
                 if self.agentRxiv and "AgentRxiv" in query: feedback, text = self.phd.add_review(query, arx_eng, agentrxiv=True, GLOBAL_AGENTRXIV=GLOBAL_AGENTRXIV)
-                else: feedback, text = self.phd.add_review(query, arx_eng)
+                else: feedback, text = self.phd.add_review(query, prefetcher)
                 if len(self.reference_papers) < self.num_ref_papers:
                     self.reference_papers.append(text)
 
@@ -630,6 +692,18 @@ class LaboratoryWorkflow:
             else: print("Invalid response, type Y or N")
         return False
 
+def open_paper_index():
+    """
+    Open the shared local paper index
+    @return: (PaperIndex) index, None if SQLite FTS5 is unavailable
+    """
+    try:
+        return get_paper_index()
+    except sqlite3.Error as e:
+        print(f"Local paper index disabled: {e}")
+        return None
+
+
 class AgentRxiv:
     def __init__(self, lab_index=0):
         self.lab_index = lab_index
@@ -652,6 +726,7 @@ class AgentRxiv:
         return len(os.listdir("uploads"))
 
     def retrieve_full_text(self, arxiv_id):
+        # AgentRxiv IDs are row IDs of this run's papers.db, so its papers are not kept in the cross-run paper index
         try:
             return self.pdf_text[arxiv_id]
         except Exception:
@@ -659,13 +734,7 @@ class AgentRxiv:
 
     @staticmethod
     def read_pdf_pypdf2(pdf_path):
-        with open(pdf_path, 'rb') as pdf_file:
-            reader = PyPDF2.PdfReader(pdf_file)
-            text = ''
-            for page_num in range(len(reader.pages)):
-                page = reader.pages[page_num]
-                text += page.extract_text()
-        return text
+        return extract_text(pdf_path, timeout=120)
 
     def search_agentrxiv(self, search_query, num_papers):
         # Use the dynamic port here as well
@@ -744,8 +813,22 @@ def parse_yaml(yaml_file_loc):
     else: parser.num_papers_lit_review = 5
     if 'mlesolver-max-steps' in agentlab_data: parser.mlesolver_max_steps = agentlab_data["mlesolver-max-steps"]
     else: parser.mlesolver_max_steps = 3
+    if 'mlesolver-population' in agentlab_data: parser.mlesolver_population = agentlab_data["mlesolver-population"]
+    else: parser.mlesolver_population = 1
     if 'papersolver-max-steps' in agentlab_data: parser.papersolver_max_steps = agentlab_data["papersolver-max-steps"]
     else: parser.papersolver_max_steps = 5
+    if 'solver-patience' in agentlab_data: parser.solver_patience = agentlab_data["solver-patience"]
+    else: parser.solver_patience = 2
+    if 'solver-min-delta' in agentlab_data: parser.solver_min_delta = agentlab_data["solver-min-delta"]
+    else: parser.solver_min_delta = 0.0
+    if 'incremental-context' in agentlab_data: parser.incremental_context = agentlab_data["incremental-context"]
+    else: parser.incremental_context = False
+    if 'section-review' in agentlab_data: parser.section_review = agentlab_data["section-review"]
+    else: parser.section_review = False
+    if 'num-reviewers' in agentlab_data: parser.num_reviewers = agentlab_data["num-reviewers"]
+    else: parser.num_reviewers = 3
+    if 'reviewer-timeout' in agentlab_data: parser.reviewer_timeout = agentlab_data["reviewer-timeout"]
+    else: parser.reviewer_timeout = 600
     if 'task-notes' in agentlab_data: parser.task_notes = agentlab_data["task-notes"]
     else: parser.task_notes = []
     if 'num-papers-to-write' in agentlab_data: parser.num_papers_to_write = agentlab_data["num-papers-to-write"]
@@ -791,6 +874,18 @@ if __name__ == "__main__":
     except Exception: raise Exception("args.papersolver_max_steps must be a valid integer!")
     try: mlesolver_max_steps = int(args.mlesolver_max_steps.lower()) if type(args.mlesolver_max_steps) == str else args.mlesolver_max_steps
     except Exception: raise Exception("args.mlesolver_max_steps must be a valid integer!")
+    try: mlesolver_population = int(args.mlesolver_population.lower()) if type(args.mlesolver_population) == str else args.mlesolver_population
+    except Exception: raise Exception("args.mlesolver_population must be a valid integer!")
+    try: solver_patience = None if args.solver_patience in (None, "None", "none") else int(args.solver_patience)
+    except Exception: raise Exception("args.solver_patience must be a valid integer or None!")
+    try: solver_min_delta = float(args.solver_min_delta)
+    except Exception: raise Exception("args.solver_min_delta must be a valid number!")
+    incremental_context = args.incremental_context.lower() == "true" if type(args.incremental_context) == str else args.incremental_context
+    section_review = args.section_review.lower() == "true" if type(args.section_review) == str else args.section_review
+    try: num_reviewers = int(args.num_reviewers)
+    except Exception: raise Exception("args.num_reviewers must be a valid integer!")
+    try: reviewer_timeout = None if args.reviewer_timeout in (None, "None", "none") else float(args.reviewer_timeout)
+    except Exception: raise Exception("args.reviewer_timeout must be a valid number or None!")
     if parallel_labs:
         num_parallel_labs = int(args.num_parallel_labs)
         print("="*20 , f"RUNNING {num_parallel_labs} LABS IN PARALLEL", "="*20)
@@ -863,6 +958,13 @@ if __name__ == "__main__":
                     num_papers_lit_review=num_papers_lit_review,
                     papersolver_max_steps=papersolver_max_steps,
                     mlesolver_max_steps=mlesolver_max_steps,
+                    mlesolver_population=mlesolver_population,
+                    solver_patience=solver_patience,
+                    solver_min_delta=solver_min_delta,
+                    incremental_context=incremental_context,
+                    section_review=section_review,
+                    num_reviewers=num_reviewers,
+                    reviewer_timeout=reviewer_timeout,
                     paper_index=_paper_index,
                     lab_index=parallel_lab_index,
                     except_if_fail=except_if_fail,
@@ -909,6 +1011,13 @@ if __name__ == "__main__":
                 num_papers_lit_review=num_papers_lit_review,
                 papersolver_max_steps=papersolver_max_steps,
                 mlesolver_max_steps=mlesolver_max_steps,
+                mlesolver_population=mlesolver_population,
+                solver_patience=solver_patience,
+                solver_min_delta=solver_min_delta,
+                incremental_context=incremental_context,
+                section_review=section_review,
+                num_reviewers=num_reviewers,
+                reviewer_timeout=reviewer_timeout,
                 paper_index=_paper_index,
                 except_if_fail=except_if_fail,
                 agentRxiv=False,
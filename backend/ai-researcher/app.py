@@ -3,7 +3,7 @@ import random, time
 from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify
 from werkzeug.utils import secure_filename
 import os
-from PyPDF2 import PdfReader
+from pdf_extract import extract_text
 from flask_sqlalchemy import SQLAlchemy
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
@@ -15,6 +15,8 @@ app.config['UPLOAD_FOLDER'] = 'uploads/'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///papers.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+PDF_EXTRACTION_TIMEOUT = 120
+
 db = SQLAlchemy(app)
 
 class Paper(db.Model):
@@ -34,13 +36,8 @@ def update_papers_from_uploads():
                     if not Paper.query.filter_by(filename=filename).first():
                         print("Processing file:", filename)
                         file_path = os.path.join(uploads_dir, filename)
-                        extracted_text = ""
                         try:
-                            reader = PdfReader(file_path)
-                            for page in reader.pages:
-                                text = page.extract_text()
-                                if text:
-                                    extracted_text += text
+                            extracted_text = extract_text(file_path, timeout=PDF_EXTRACTION_TIMEOUT)
                         except Exception as e:
                             flash(f'Error processing {filename}: {e}')
                             continue
@@ -88,11 +85,7 @@ def upload():
             file.save(file_path)
             extracted_text = ""
             try:
-                reader = PdfReader(file_path)
-                for page in reader.pages:
-                    text = page.extract_text()
-                    if text:
-                        extracted_text += text
+                extracted_text = extract_text(file_path, timeout=PDF_EXTRACTION_TIMEOUT)
             except Exception as e:
                 flash(f'Error processing PDF: {e}')
             new_paper = Paper(filename=filename, text=extracted_text)
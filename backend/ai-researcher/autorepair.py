@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Local Code Repair
+Deterministic fixes MLESolver tries before asking the repair model.
+
+Many failed programs differ from a working one by a trivial mistake: a
+missing import, a broken indentation, a misspelled name or an ``EDIT`` whose
+line range is off by one. Fixes for these are derived from the pre-flight
+check and from the error the run returned, tried in order of how likely they
+are to be right, and kept only if the program then passes the pre-flight
+check. Anything else is left to the repair model.
+"""
+import re
+import ast
+import difflib
+import textwrap
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from preflight import Issue, check_program, defined_names, find_issues
+
+# Fixes chained on one program before giving up
+MAX_FIXES = 5
+# Similarity a defined name needs to replace a misspelled one
+NAME_MATCH_CUTOFF = 0.8
+
+# Imports generated code commonly forgets, by the name it uses
+KNOWN_IMPORTS = {
+    "np": "import numpy as np",
+    "numpy": "import numpy",
+    "pd": "import pandas as pd",
+    "pandas": "import pandas",
+    "plt": "import matplotlib.pyplot as plt",
+    "matplotlib": "import matplotlib",
+    "sns": "import seaborn as sns",
+    "torch": "import torch",
+    "nn": "import torch.nn as nn",
+    "F": "import torch.nn.functional as F",
+    "optim": "import torch.optim as optim",
+    "DataLoader": "from torch.utils.data import DataLoader",
+    "TensorDataset": "from torch.utils.data import TensorDataset",
+    "Dataset": "from torch.utils.data import Dataset",
+    "sklearn": "import sklearn",
+    "train_test_split": "from sklearn.model_selection import train_test_split",
+    "cross_val_score": "from sklearn.model_selection import cross_val_score",
+    "accuracy_score": "from sklearn.metrics import accuracy_score",
+    "f1_score": "from sklearn.metrics import f1_score",
+    "precision_score": "from sklearn.metrics import precision_score",
+    "recall_score": "from sklearn.metrics import recall_score",
+    "confusion_matrix": "from sklearn.metrics import confusion_matrix",
+    "classification_report": "from sklearn.metrics import classification_report",
+    "LogisticRegression": "from sklearn.linear_model import LogisticRegression",
+    "RandomForestClassifier": "from sklearn.ensemble import RandomForestClassifier",
+    "TfidfVectorizer": "from sklearn.feature_extraction.text import TfidfVectorizer",
+    "CountVectorizer": "from sklearn.feature_extraction.text import CountVectorizer",
+    "StandardScaler": "from sklearn.preprocessing import StandardScaler",
+    "LabelEncoder": "from sklearn.preprocessing import LabelEncoder",
+    "load_dataset": "from datasets import load_dataset",
+    "tqdm": "from tqdm import tqdm",
+    "Counter": "from collections import Counter",
+    "defaultdict": "from collections import defaultdict",
+    "deepcopy": "from copy import deepcopy",
+    "os": "import os",
+    "sys": "import sys",
+    "re": "import re",
+    "math": "import math",
+    "json": "import json",
+    "time": "import time",
+    "random": "import random",
+    "copy": "import copy",
+    "string": "import string",
+    "itertools": "import itertools",
+    "collections": "import collections",
+}
+
+# Name errors reported by a run, as opposed to the pre-flight check
+_RUNTIME_NAME_ERROR = re.compile(r"name '(\w+)' is not defined")
+_EDIT_HEADER = re.compile(r"```EDIT\s+(-?\d+)\s+(-?\d+)[^\n]*\n(.*?)```", re.DOTALL)
+
+
+class Repair(NamedTuple):
+    """A repaired program and the fixes applied to it, in order."""
+    code: str
+    fixes: List[str]
+
+
+def _indent_of(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _reindent(lines: List[str], index: int, indent: str) -> str:
+    return "\n".join(lines[:index] + [indent + lines[index].lstrip()] + lines[index + 1:])
+
+
+def _indentation_fixes(code: str, issue: Issue) -> List[Tuple[str, str]]:
+    lines = code.split("\n")
+    index = issue.line - 1
+    fixes = []
+    if "\t" in code:
+        fixes.append(("tabs replaced by spaces", code.expandtabs(4)))
+    dedented = textwrap.dedent(code)
+    if dedented != code:
+        fixes.append(("common indentation removed", dedented))
+    if not 0 <= index < len(lines):
+        return fixes
+    previous = next((line for line in reversed(lines[:index])
+                     if line.strip() and not line.lstrip().startswith("#")), None)
+    previous_indent = "" if previous is None else _indent_of(previous)
+    opens_block = previous is not None and previous.rstrip().endswith(":")
+    if "unexpected indent" in issue.message:
+        indent = previous_indent + "    " if opens_block else previous_indent
+        fixes.append((f"line {issue.line} aligned with the line above", _reindent(lines, index, indent)))
+    elif "expected an indented block" in issue.message:
+        fixes.append((f"line {issue.line} indented under the line above", _reindent(lines, index, previous_indent + "    ")))
+    elif "unindent does not match" in issue.message:
+        current = len(_indent_of(lines[index]).expandtabs(4))
+        outer = sorted({_indent_of(line) for line in lines[:index]
+                        if line.strip() and len(_indent_of(line).expandtabs(4)) < current}, key=len)
+        if outer:
+            fixes.append((f"line {issue.line} aligned with an outer block", _reindent(lines, index, outer[-1])))
+    return fixes
+
+
+def _rename(code: str, old: str, new: str) -> str:
+    """Replace every read of the name ``old`` with ``new``."""
+    lines = code.split("\n")
+    nodes = [node for node in ast.walk(ast.parse(code))
+             if isinstance(node, ast.Name) and node.id == old and isinstance(node.ctx, ast.Load)]
+    for node in sorted(nodes, key=lambda node: (node.lineno, node.col_offset), reverse=True):
+        line = lines[node.lineno - 1]
+        # ast columns are UTF-8 byte offsets
+        encoded = line.encode()
+        lines[node.lineno - 1] = (encoded[:node.col_offset] + new.encode()
+                                  + encoded[node.col_offset + len(old.encode()):]).decode()
+    return "\n".join(lines)
+
+
+def _add_import(code: str, statement: str) -> str:
+    lines = code.split("\n")
+    # after a leading docstring or __future__ import, which must stay first
+    position = 0
+    try:
+        body = ast.parse(code).body
+    except SyntaxError:
+        body = []
+    for node in body:
+        is_docstring = isinstance(node, ast.Expr) and isinstance(getattr(node, "value", None), ast.Constant) \
+            and isinstance(node.value.value, str)
+        if is_docstring or (isinstance(node, ast.ImportFrom) and node.module == "__future__"):
+            position = node.end_lineno
+        else:
+            break
+    return "\n".join(lines[:position] + [statement] + lines[position:])
+
+
+def _name_fixes(code: str, name: str, prelude: Optional[str]) -> List[Tuple[str, str]]:
+    fixes = []
+    if name in KNOWN_IMPORTS:
+        fixes.append((f"added `{KNOWN_IMPORTS[name]}`", _add_import(code, KNOWN_IMPORTS[name])))
+    known = defined_names(code, prelude)
+    if known:
+        for match in difflib.get_close_matches(name, sorted(known), n=3, cutoff=NAME_MATCH_CUTOFF):
+            fixes.append((f"`{name}` replaced by `{match}`", _rename(code, name, match)))
+    return fixes
+
+
+def _forbidden_call_fixes(code: str, issue: Issue) -> List[Tuple[str, str]]:
+    lines = code.split("\n")
+    line = lines[issue.line - 1]
+    call = re.match(r"\s*[\w.]+\([^()]*\)\s*(#.*)?$", line)
+    if call is None:
+        return []
+    return [(f"call on line {issue.line} removed",
+             "\n".join(lines[:issue.line - 1] + [_indent_of(line) + "pass"] + lines[issue.line:]))]
+
+
+def _fixes_for(code: str, issue: Issue, prelude: Optional[str]) -> List[Tuple[str, str]]:
+    if issue.kind in ("IndentationError", "TabError") or "indent" in issue.message:
+        return _indentation_fixes(code, issue)
+    if issue.kind == "NameError":
+        return _name_fixes(code, issue.message.split("'")[1], prelude)
+    if issue.kind == "ForbiddenCall":
+        return _forbidden_call_fixes(code, issue)
+    return []
+
+
+def _resolved(issue: Issue, issues: Sequence[Issue]) -> bool:
+    """Whether a fix removed ``issue`` without a problem appearing before it."""
+    for other in issues:
+        if other.kind == "NameError" and other.message == issue.message:
+            return False
+        if other.line < issue.line or (other.line, other.kind, other.message) == (issue.line, issue.kind, issue.message):
+            return False
+    return True
+
+
+def repair_program(code: str, error: str = "", prelude: Optional[str] = None) -> Optional[Repair]:
+    """
+    Fix a program with deterministic rules.
+
+    Args:
+        code: Program text
+        error: Error the program's run returned, if it ran
+        prelude: Code that runs before ``code`` in the same namespace, as
+            for ``preflight.check_program``
+
+    Returns:
+        The repaired program, or None when no rule produced a program that
+        passes the pre-flight check
+    """
+    fixes = []
+    for _ in range(MAX_FIXES):
+        issues = find_issues(code, prelude)
+        if not issues:
+            break
+        for name, candidate in _fixes_for(code, issues[0], prelude):
+            if candidate != code and _resolved(issues[0], find_issues(candidate, prelude)):
+                code = candidate
+                fixes.append(name)
+                break
+        else:
+            return None
+    if not fixes:
+        # the program passed the pre-flight check, only a missing import its run reported is fixed here
+        match = _RUNTIME_NAME_ERROR.search(error)
+        if match is None or match.group(1) not in KNOWN_IMPORTS or match.group(1) in _imported(code):
+            return None
+        code = _add_import(code, KNOWN_IMPORTS[match.group(1)])
+        fixes.append(f"added `{KNOWN_IMPORTS[match.group(1)]}`")
+    if check_program(code, prelude) is not None:
+        return None
+    return Repair(code, fixes)
+
+
+def _imported(code: str) -> set:
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return set()
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update(alias.asname or alias.name.split(".")[0] for alias in node.names)
+    return names
+
+
+def _apply_edit(lines: List[str], first: int, last: int, new_lines: List[str]) -> Optional[str]:
+    if not 0 <= first <= last < len(lines):
+        return None
+    return "\n".join(lines[:first] + new_lines + lines[last + 1:])
+
+
+def repair_edit(command: str, code_lines: List[str], error: str = "",
+                prelude: Optional[str] = None) -> Optional[Tuple[str, List[str]]]:
+    """
+    Fix an ``EDIT N M`` command whose result does not run.
+
+    A range that is out of bounds, or off by one line so that the edited
+    program no longer parses, is moved to the nearest range that gives a
+    valid program. Otherwise the rules of ``repair_program`` are applied to
+    the edited program, which is then submitted as an edit of every line.
+
+    Args:
+        command: Model response holding the ``EDIT`` command
+        code_lines: Lines of the program being edited
+        error: Error the edited program's run returned, if it ran
+        prelude: Code that runs before the program
+
+    Returns:
+        (repaired command, fixes applied), or None
+    """
+    match = _EDIT_HEADER.search(command)
+    if match is None or not code_lines:
+        return None
+    first, last = int(match.group(1)), int(match.group(2))
+    new_lines = match.group(3).rstrip("\n").split("\n")
+    edited = _apply_edit(code_lines, first, last, new_lines)
+    if edited is None or any(issue.kind in ("SyntaxError", "IndentationError", "TabError")
+                             for issue in find_issues(edited, prelude)):
+        candidates = [(first + a, last + b) for a, b in ((0, 0), (-1, -1), (1, 1), (0, 1), (0, -1), (-1, 0), (1, 0))]
+        # an out-of-range end is most often the line count instead of the last index
+        candidates.insert(0, (max(0, min(first, len(code_lines) - 1)), max(0, min(last, len(code_lines) - 1))))
+        for start, end in candidates:
+            candidate = _apply_edit(code_lines, start, end, new_lines)
+            if (start, end) != (first, last) and candidate is not None and check_program(candidate, prelude) is None:
+                return (f"```EDIT {start} {end}\n" + "\n".join(new_lines) + "\n```",
+                        [f"edit range {first}-{last} moved to {start}-{end}"])
+    if edited is None:
+        return None
+    repair = repair_program(edited, error, prelude)
+    if repair is None:
+        return None
+    return f"```EDIT 0 {len(code_lines) - 1}\n{repair.code}\n```", repair.fixes
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the warm sandbox pool against the legacy process-per-call
+execute_code.
+
+Usage:
+    python benchmarks/bench_execute_code.py --runs 20
+
+Both paths execute the same short program that imports the libraries
+generated experiment code typically uses, so the numbers are dominated by
+process start-up and import cost rather than by the program itself.
+
+The second part runs candidates behind a dataset-loading prelude, once as a
+single concatenated program and once with the prelude held in a template.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+from sandbox import SandboxPool
+
+PROGRAM = (
+    "from utils import *\n"
+    "import numpy as np\n"
+    "from sklearn.linear_model import LogisticRegression\n"
+    "import datasets\n"
+    "try:\n"
+    "    import torch\n"
+    "except ImportError:\n"
+    "    pass\n"
+    "X = np.random.RandomState(0).rand(64, 4)\n"
+    "y = (X[:, 0] > 0.5).astype(int)\n"
+    "print(LogisticRegression().fit(X, y).score(X, y))\n"
+)
+
+
+DATASET_PRELUDE = (
+    "from utils import *\n"
+    "import numpy as np\n"
+    "rng = np.random.RandomState(0)\n"
+    "X = rng.rand(200000, 32)\n"
+    "y = (X[:, 0] + rng.rand(200000) * 0.1 > 0.55).astype(int)\n"
+    "X_train, X_test, y_train, y_test = X[:150000], X[150000:], y[:150000], y[150000:]\n"
+    "# stands in for tokenization and feature building in real dataset code\n"
+    "docs = [' '.join(f'tok{(i * 7 + j) % 5000}' for j in range(30)) for i in range(40000)]\n"
+    "vocab = {tok: n for n, tok in enumerate(sorted({t for d in docs for t in d.split()}))}\n"
+    "encoded = [[vocab[t] for t in d.split()] for d in docs]\n"
+)
+
+CANDIDATE = (
+    "from sklearn.linear_model import LogisticRegression\n"
+    "print(LogisticRegression(max_iter=50).fit(X_train[:5000], y_train[:5000]).score(X_test, y_test))\n"
+)
+
+
+def run(label, fn, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = fn()
+        durations.append(time.perf_counter() - start)
+        assert "[CODE EXECUTION ERROR]" not in output, output
+    p95 = sorted(durations)[max(0, int(len(durations) * 0.95) - 1)]
+    print(f"{label:<24} runs {runs:4d}  median {statistics.median(durations)*1000:9.1f}ms  "
+          f"p95 {p95*1000:9.1f}ms  total {sum(durations):7.2f}s")
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sandboxed code execution")
+    parser.add_argument("--runs", type=int, default=20, help="Executions per path")
+    parser.add_argument("--max-runs", type=int, default=25, help="Runs before a pool worker is recycled")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores")
+    legacy = run("legacy (new process)", lambda: tools._execute_code_process(PROGRAM, 600, 1000), args.runs)
+
+    pool = SandboxPool(size=1, max_runs=args.max_runs)
+    start = time.perf_counter()
+    pool.run("pass")
+    print(f"{'pool start-up (once)':<24} {(time.perf_counter() - start)*1000:9.1f}ms")
+    pooled = run("warm sandbox pool", lambda: pool.run(PROGRAM, 600), args.runs)
+    print(f"median per-execution speedup: {legacy/pooled:.1f}x, workers recycled {pool.stats['recycled']}")
+
+    full = run("prelude re-run per call", lambda: pool.run(DATASET_PRELUDE + CANDIDATE, 600), args.runs)
+    templated = run("prelude template", lambda: pool.run(CANDIDATE, 600, prelude=DATASET_PRELUDE), args.runs)
+    pool.shutdown()
+    print(f"median speedup with a dataset template: {full/templated:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
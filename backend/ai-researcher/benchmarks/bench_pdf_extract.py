@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark for pdf_extract against the legacy page-by-page extraction.
+
+Usage:
+    python benchmarks/bench_pdf_extract.py --corpus path/to/pdfs
+    python benchmarks/bench_pdf_extract.py --num-docs 120 --pages 40
+
+Without --corpus a synthetic corpus of text-only PDFs is generated in a
+temporary directory.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pypdf import PdfReader
+from pdf_extract import extract_text, shutdown_pool
+
+WORDS = ("model training dataset evaluation transformer attention gradient "
+         "benchmark baseline ablation accuracy optimizer regularization").split()
+
+
+def write_synthetic_pdf(path, num_pages, lines_per_page=45, seed=0):
+    """Write a minimal text-only PDF without third-party dependencies."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in range(num_pages):
+        lines = []
+        for line in range(lines_per_page):
+            words = [WORDS[(seed + page * 7 + line * 3 + k) % len(WORDS)] for k in range(12)]
+            lines.append(f"({' '.join(words)}) Tj T*")
+        stream = ("BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(lines) + " ET").encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    kids = " ".join(f"{_id} 0 R" for _id in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % num_pages
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for index, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % index + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+
+def legacy_extract(path, max_chars):
+    """The previous ArxivSearch behaviour: every page, then truncate."""
+    text = str()
+    reader = PdfReader(path)
+    for page_number, page in enumerate(reader.pages, start=1):
+        text += f"--- Page {page_number} ---" + page.extract_text() + "\n"
+    return text[:max_chars]
+
+
+def run(label, fn, paths):
+    durations = []
+    chars = 0
+    for path in paths:
+        start = time.perf_counter()
+        chars += len(fn(path))
+        durations.append(time.perf_counter() - start)
+    total = sum(durations)
+    p95 = sorted(durations)[int(len(durations) * 0.95) - 1] if len(durations) > 1 else durations[0]
+    print(f"{label:<28} total {total:8.2f}s  median {statistics.median(durations)*1000:8.1f}ms  "
+          f"p95 {p95*1000:8.1f}ms  chars {chars}")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF text extraction")
+    parser.add_argument("--corpus", type=str, default=None, help="Directory of PDFs to benchmark on")
+    parser.add_argument("--num-docs", type=int, default=120, help="Synthetic corpus size")
+    parser.add_argument("--pages", type=int, default=40, help="Pages per synthetic document")
+    parser.add_argument("--max-chars", type=int, default=50000, help="Character budget (arXiv MAX_LEN)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.corpus:
+            paths = sorted(os.path.join(args.corpus, f) for f in os.listdir(args.corpus) if f.lower().endswith(".pdf"))
+        else:
+            paths = []
+            for index in range(args.num_docs):
+                path = os.path.join(tmp, f"doc_{index}.pdf")
+                write_synthetic_pdf(path, args.pages, seed=index)
+                paths.append(path)
+        print(f"Corpus: {len(paths)} PDFs, budget {args.max_chars} chars, {os.cpu_count()} cores")
+        baseline = run("legacy (all pages)", lambda p: legacy_extract(p, args.max_chars), paths)
+        serial = run("budgeted serial", lambda p: extract_text(p, max_chars=args.max_chars, page_markers=True, parallel=False), paths)
+        pooled = run("budgeted + pool", lambda p: extract_text(p, max_chars=args.max_chars, page_markers=True), paths)
+        full = run("full text + pool", lambda p: extract_text(p, page_markers=True), paths)
+        shutdown_pool()
+        print(f"speedup vs legacy: budgeted serial {baseline/serial:.2f}x, budgeted pooled {baseline/pooled:.2f}x, "
+              f"full text pooled {baseline/full:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
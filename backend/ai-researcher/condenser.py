@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Execution Output Condenser
+Deterministic summaries of program output for solver and agent prompts.
+
+Experiment programs print training logs, progress bars and warnings, while a
+prompt needs the error that stopped the program, the final metrics and a
+glimpse of the rest. The solvers capture a generous amount of raw output and
+every consumer condenses it to its own token budget: progress bars and runs
+of lines that differ only in their numbers are collapsed to their first and
+last line, and when that is not enough, lines are kept in order of priority,
+the traceback tail, the last metric lines, the last lines and the first lines,
+with the omitted stretches marked. No model is called, the same output always
+condenses to the same text.
+"""
+import os
+import re
+from bisect import bisect_left
+from typing import Iterable, List, Optional
+
+# Characters of output the solvers capture before condensing it
+CAPTURE_LIMIT = int(os.getenv("SOLVER_OUTPUT_LIMIT", str(32 * 1024)))
+# Token budget of each consumer of program output
+OUTPUT_BUDGETS = {
+    # each MLESolver history entry
+    "history": 300,
+    # reflection prompts and repair messages
+    "feedback": 800,
+    # reward-model scoring prompts
+    "reward": 500,
+    # feedback of the data preparation phase
+    "data_preparation": 600,
+    # experiment results handed to the report writers
+    "results": 1200,
+}
+# Consecutive lines of the same shape kept whole before they are collapsed
+MIN_COLLAPSED_RUN = 3
+# Characters of a single line kept
+MAX_LINE_CHARS = 400
+# Lines kept from the end of a traceback, besides its first line
+TRACEBACK_LINES = 12
+# Metric lines kept, the last ones first
+MAX_METRIC_LINES = 20
+# Lines sampled from the start and from the end of the output
+SAMPLE_LINES = 10
+# Tokens assumed for an omission marker
+MARKER_TOKENS = 8
+
+ERROR_MARKER = "[CODE EXECUTION ERROR]"
+_TRACEBACK = "Traceback (most recent call last)"
+_PROGRESS = re.compile(r"\d+%\||\|\s*\d+/\d+\s*\[|\d+(\.\d+)?\s*(it/s|s/it)\b|\[[=#>.\- ]{8,}\]")
+_METRIC = re.compile(r"\b(acc(uracy)?|loss|f1|precision|recall|auc|roc|score|rmse|mse|mae|r2|perplexity|ppl|bleu|"
+                     r"rouge\w*|exact[ _]match|error rate|correct)\b\D{0,30}[-+]?\d*\.?\d+", re.IGNORECASE)
+_NUMBER = re.compile(r"[-+]?\d+(\.\d+)?(e[-+]?\d+)?", re.IGNORECASE)
+
+
+def _terminal_lines(text: str) -> List[str]:
+    """Lines as a terminal shows them, a carriage return overwrites the line."""
+    return [line.rstrip("\r").rsplit("\r", 1)[-1] for line in text.split("\n")]
+
+
+def _shape(line: str) -> str:
+    if _PROGRESS.search(line):
+        return "<progress>"
+    return _NUMBER.sub("#", line.strip())
+
+
+def collapse_repeats(lines: List[str], min_run: int = MIN_COLLAPSED_RUN) -> List[str]:
+    """
+    Replace runs of progress-bar lines, and of lines that differ only in
+    their numbers, by the first and last line of the run.
+    """
+    out, i = [], 0
+    while i < len(lines):
+        shape = _shape(lines[i])
+        j = i
+        while shape and j + 1 < len(lines) and _shape(lines[j + 1]) == shape:
+            j += 1
+        if j - i + 1 >= min_run:
+            out += [lines[i], f"[... {j - i - 1} similar lines ...]", lines[j]]
+        else:
+            out += lines[i:j + 1]
+        i = j + 1
+    return out
+
+
+def _clip(line: str) -> str:
+    if len(line) <= MAX_LINE_CHARS:
+        return line
+    return line[:MAX_LINE_CHARS // 2] + f" [... {len(line) - MAX_LINE_CHARS} characters ...] " + line[-MAX_LINE_CHARS // 2:]
+
+
+def _priorities(lines: List[str]) -> Iterable[int]:
+    """Line indices in the order they are kept."""
+    n = len(lines)
+    # the last traceback, or the last error report of a program that did not raise
+    error_start = max((i for i, line in enumerate(lines) if _TRACEBACK in line), default=None)
+    if error_start is None:
+        error_start = max((i for i, line in enumerate(lines) if ERROR_MARKER in line), default=None)
+    if error_start is not None:
+        # the sandbox writes its error report on the line before the traceback
+        if error_start > 0 and ERROR_MARKER in lines[error_start - 1]:
+            yield error_start - 1
+        yield error_start
+        yield from range(n - 1, max(error_start, n - 1 - TRACEBACK_LINES), -1)
+    metrics = [i for i, line in enumerate(lines) if _METRIC.search(line)]
+    yield from reversed(metrics[-MAX_METRIC_LINES:])
+    yield from range(n - 1, max(-1, n - 1 - SAMPLE_LINES), -1)
+    yield from range(min(n, SAMPLE_LINES))
+
+
+def _omitted_runs(kept: List[int], n: int) -> int:
+    bounds = [-1] + kept + [n]
+    return sum(b - a > 1 for a, b in zip(bounds, bounds[1:]))
+
+
+def condense_output(text: Optional[str], max_tokens: int) -> Optional[str]:
+    """
+    Condense program output to a token budget.
+
+    Args:
+        text: Output as returned by ``execute_code``
+        max_tokens: Token budget of the result
+
+    Returns:
+        The output itself when it fits, otherwise its most informative
+        lines in their original order with omission markers
+    """
+    if not text:
+        return text
+    from tools import count_tokens
+    lines = [_clip(line) for line in collapse_repeats(_terminal_lines(text))]
+    condensed = "\n".join(lines)
+    if count_tokens(condensed) <= max_tokens:
+        return condensed
+    costs = {}
+    kept: List[int] = []
+    used = 0
+    for index in _priorities(lines):
+        if index in costs:
+            continue
+        costs[index] = count_tokens(lines[index]) + 1
+        position = bisect_left(kept, index)
+        candidate = kept[:position] + [index] + kept[position:]
+        total = used + costs[index] + MARKER_TOKENS * _omitted_runs(candidate, len(lines))
+        if total > max_tokens:
+            continue
+        kept, used = candidate, used + costs[index]
+    if not kept:
+        return lines[-1][:max_tokens * 4]
+    out, previous = [], -1
+    for index in kept:
+        if index - previous > 1:
+            out.append(f"[... {index - previous - 1} lines omitted ...]")
+        out.append(lines[index])
+        previous = index
+    if previous < len(lines) - 1:
+        out.append(f"[... {len(lines) - 1 - previous} lines omitted ...]")
+    return "\n".join(out)
+
+
+def condense_for(consumer: str, text: Optional[str]) -> Optional[str]:
+    """
+    Condense program output to the budget of one of its consumers.
+
+    Args:
+        consumer: Key of ``OUTPUT_BUDGETS``, e.g. "history" or "reward"
+        text: Program output
+    """
+    return condense_output(text, OUTPUT_BUDGETS[consumer])
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Solver Convergence
+Early stopping for the MLESolver and PaperSolver optimization loops.
+
+Both loops run a fixed number of steps, each costing several LLM calls and,
+for MLESolver, sandbox runs. The monitor follows the best score after every
+step and reports convergence once it has not improved by more than a
+minimum delta for a number of consecutive steps, so the loop can stop with
+the rest of its budget unspent. The best result is kept by the solver, so
+stopping never loses a better earlier one.
+"""
+from typing import List, Optional
+
+# Consecutive steps without improvement before a loop stops
+DEFAULT_PATIENCE = 2
+# Improvement of the best score that counts as progress
+DEFAULT_MIN_DELTA = 0.0
+
+
+class ConvergenceMonitor:
+    """
+    Tracks a solver's best score and decides when further steps are unlikely
+    to pay off.
+
+    Args:
+        solver: Name reported in the ``solver_converged`` event
+        max_steps: Step budget of the loop, used to report the steps saved
+        patience: Consecutive steps without improvement before stopping,
+            None never stops early
+        min_delta: Amount the best score must grow by to count as an
+            improvement
+    """
+
+    def __init__(self, solver: str, max_steps: int, patience: Optional[int] = DEFAULT_PATIENCE,
+                 min_delta: float = DEFAULT_MIN_DELTA):
+        self.solver = solver
+        self.max_steps = max_steps
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_score: Optional[float] = None
+        self.history: List[float] = []
+        self.stale_steps = 0
+
+    @property
+    def steps_taken(self) -> int:
+        return len(self.history)
+
+    @property
+    def converged(self) -> bool:
+        return self.patience is not None and self.stale_steps >= self.patience
+
+    def start(self, score: Optional[float]):
+        """Record the score the solver starts from, before its first step."""
+        self.best_score = score
+
+    def update(self, score: Optional[float]) -> bool:
+        """
+        Record the best score after a step.
+
+        Args:
+            score: Solver's best score after the step
+
+        Returns:
+            True once the loop should stop, after the ``solver_converged``
+            event has been emitted
+        """
+        self.history.append(score)
+        if score is not None and (self.best_score is None or score > self.best_score + self.min_delta):
+            self.best_score = score
+            self.stale_steps = 0
+        else:
+            self.stale_steps += 1
+        if not self.converged:
+            return False
+        if self.steps_taken < self.max_steps:
+            from logger import get_logger
+            get_logger().solver_converged(self.solver, self.steps_taken, self.max_steps - self.steps_taken,
+                                          self.best_score)
+        return True
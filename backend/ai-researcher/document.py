@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Line Document
+Immutable, structurally shared line sequence for MLESolver's code_lines and
+PaperSolver's paper_lines.
+
+The solvers keep several versions of one program or paper alive (the kept
+best entries, every candidate of a step, the history), and each ``EDIT N M``
+replaces a small range of lines. A Document is a persistent rope: a
+height-balanced tree whose leaves hold runs of lines. Replacing a range
+rebuilds only the O(log n) nodes on the path to it and shares every other
+subtree with the previous version, so copying a version is free and editing
+one does not touch the others.
+
+A Document reads like the list of lines it replaces (``len``, indexing,
+slicing, iteration, ``"\\n".join``), caches its joined text and a digest of
+it, and computes the changed line ranges between two versions, skipping the
+subtrees they share.
+"""
+import difflib
+import hashlib
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Lines per leaf; runs this short are copied rather than split further
+LEAF_SIZE = 64
+
+
+class _Leaf:
+    __slots__ = ("lines", "size")
+    height = 0
+
+    def __init__(self, lines: Tuple[str, ...]):
+        self.lines = lines
+        self.size = len(lines)
+
+
+class _Node:
+    __slots__ = ("left", "right", "size", "height")
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.size = left.size + right.size
+        self.height = max(left.height, right.height) + 1
+
+
+def _make(left, right):
+    if left.size + right.size <= LEAF_SIZE and type(left) is _Leaf and type(right) is _Leaf:
+        return _Leaf(left.lines + right.lines)
+    return _Node(left, right)
+
+
+def _rotate_right(node):
+    pivot = node.left
+    return _make(pivot.left, _make(pivot.right, node.right))
+
+
+def _rotate_left(node):
+    pivot = node.right
+    return _make(_make(node.left, pivot.left), pivot.right)
+
+
+def _balance(node):
+    if type(node) is _Leaf:
+        return node
+    skew = node.left.height - node.right.height
+    if skew > 1:
+        if node.left.right.height > node.left.left.height:
+            node = _make(_rotate_left(node.left), node.right)
+        return _rotate_right(node)
+    if skew < -1:
+        if node.right.left.height > node.right.right.height:
+            node = _make(node.left, _rotate_right(node.right))
+        return _rotate_left(node)
+    return node
+
+
+def _join(left, right):
+    """Concatenate two trees, rebuilding only the spine where they meet."""
+    if left is None or left.size == 0:
+        return right
+    if right is None or right.size == 0:
+        return left
+    if left.height > right.height + 1:
+        return _balance(_make(left.left, _join(left.right, right)))
+    if right.height > left.height + 1:
+        return _balance(_make(_join(left, right.left), right.right))
+    return _make(left, right)
+
+
+def _split(node, index: int):
+    """Split a tree into its first ``index`` lines and the rest."""
+    if node is None or index <= 0:
+        return None, node
+    if index >= node.size:
+        return node, None
+    if type(node) is _Leaf:
+        return _Leaf(node.lines[:index]), _Leaf(node.lines[index:])
+    if index <= node.left.size:
+        head, tail = _split(node.left, index)
+        return head, _join(tail, node.right)
+    head, tail = _split(node.right, index - node.left.size)
+    return _join(node.left, head), tail
+
+
+def _build(lines: Sequence[str]):
+    if not lines:
+        return None
+    if len(lines) <= LEAF_SIZE:
+        return _Leaf(tuple(lines))
+    middle = len(lines) // 2
+    return _Node(_build(lines[:middle]), _build(lines[middle:]))
+
+
+def _leaves(node) -> Iterator[_Leaf]:
+    stack = [node] if node is not None else []
+    while stack:
+        node = stack.pop()
+        if type(node) is _Leaf:
+            yield node
+        else:
+            stack.append(node.right)
+            stack.append(node.left)
+
+
+def _common_prefix(a: List[_Leaf], b: List[_Leaf]) -> int:
+    """Lines at the start of two leaf runs that are equal, skipping shared leaves."""
+    count = i = j = 0
+    offset_a = offset_b = 0
+    while i < len(a) and j < len(b):
+        if a[i] is b[j] and offset_a == offset_b == 0:
+            count += a[i].size
+            i, j = i + 1, j + 1
+            continue
+        line_a, line_b = a[i].lines[offset_a], b[j].lines[offset_b]
+        if line_a != line_b:
+            break
+        count += 1
+        offset_a, offset_b = offset_a + 1, offset_b + 1
+        if offset_a == a[i].size:
+            i, offset_a = i + 1, 0
+        if offset_b == b[j].size:
+            j, offset_b = j + 1, 0
+    return count
+
+
+class Document:
+    """
+    Immutable sequence of lines.
+
+    Args:
+        lines: Initial lines
+    """
+
+    __slots__ = ("_root", "_text", "_digest")
+
+    def __init__(self, lines: Iterable[str] = ()):
+        self._root = _build(list(lines))
+        self._text: Optional[str] = None
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def _from_root(cls, root) -> "Document":
+        document = cls.__new__(cls)
+        document._root = root if root is not None and root.size else None
+        document._text = None
+        document._digest = None
+        return document
+
+    @classmethod
+    def from_text(cls, text: str) -> "Document":
+        document = cls(text.split("\n"))
+        document._text = text
+        return document
+
+    @classmethod
+    def coerce(cls, lines: Union["Document", Sequence[str], str, None]) -> "Document":
+        """A Document of ``lines``, which may already be one, a list of lines or a text."""
+        if isinstance(lines, Document):
+            return lines
+        if isinstance(lines, str):
+            return cls.from_text(lines) if lines else cls()
+        return cls(lines or ())
+
+    def __len__(self) -> int:
+        return 0 if self._root is None else self._root.size
+
+    def __iter__(self) -> Iterator[str]:
+        for leaf in _leaves(self._root):
+            yield from leaf.lines
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            _, rest = _split(self._root, start)
+            middle, _ = _split(rest, stop - start)
+            return [line for leaf in _leaves(middle) for line in leaf.lines]
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("Document index out of range")
+        node = self._root
+        while type(node) is not _Leaf:
+            if index < node.left.size:
+                node = node.left
+            else:
+                index -= node.left.size
+                node = node.right
+        return node.lines[index]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Document):
+            return self._root is other._root or (len(self) == len(other) and self.text == other.text)
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.digest)
+
+    def __copy__(self) -> "Document":
+        # immutable, a copy is the same document
+        return self
+
+    def __deepcopy__(self, memo) -> "Document":
+        return self
+
+    def __repr__(self) -> str:
+        # formats like the list of lines it replaces, which prompts embed
+        return repr(list(self))
+
+    @property
+    def text(self) -> str:
+        """The lines joined by newlines, computed once."""
+        if self._text is None:
+            self._text = "\n".join(self)
+        return self._text
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 of ``text``, computed once."""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.text.encode()).hexdigest()
+        return self._digest
+
+    def replace_range(self, start: int, end: int, lines: Sequence[str]) -> "Document":
+        """
+        A new version with lines ``start`` up to (not including) ``end``
+        replaced by ``lines``; this document is left unchanged.
+
+        Raises:
+            IndexError: If the range is outside the document
+        """
+        if not 0 <= start <= end <= len(self):
+            raise IndexError(f"Line range {start}:{end} is outside the document of {len(self)} lines")
+        head, rest = _split(self._root, start)
+        _, tail = _split(rest, end - start)
+        return Document._from_root(_join(_join(head, _build(list(lines))), tail))
+
+    def diff(self, other: "Document") -> List[Tuple[int, int, List[str]]]:
+        """
+        Changes that turn this document into ``other``.
+
+        Returns:
+            (start, end, lines) hunks in this document's line numbers, in
+            order: lines ``start`` up to ``end`` are replaced by ``lines``
+        """
+        other = Document.coerce(other)
+        if self._root is other._root:
+            return []
+        mine, theirs = list(_leaves(self._root)), list(_leaves(other._root))
+        prefix = _common_prefix(mine, theirs)
+        # shared leaves are compared by identity, so each is reversed once for both sides
+        reversed_leaf = {id(leaf): _Leaf(leaf.lines[::-1]) for leaf in mine}
+        reversed_mine = [reversed_leaf[id(leaf)] for leaf in reversed(mine)]
+        reversed_theirs = [reversed_leaf.get(id(leaf)) or _Leaf(leaf.lines[::-1]) for leaf in reversed(theirs)]
+        suffix = min(_common_prefix(reversed_mine, reversed_theirs), len(self) - prefix, len(other) - prefix)
+        old = self[prefix:len(self) - suffix]
+        new = other[prefix:len(other) - suffix]
+        matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+        return [(prefix + i1, prefix + i2, new[j1:j2])
+                for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
+
+    def apply(self, hunks: Sequence[Tuple[int, int, Sequence[str]]]) -> "Document":
+        """A new version with ``diff`` hunks applied."""
+        document = self
+        for start, end, lines in sorted(hunks, key=lambda hunk: hunk[0], reverse=True):
+            document = document.replace_range(start, end, lines)
+        return document
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Incremental Document Context
+Diff-based prompts for the MLESolver and PaperSolver refinement loops.
+
+Every solver turn used to place the whole current program or paper, with line
+numbers, in its prompt, although a turn only changes a few lines. In the
+incremental mode a solver session keeps a reference version of the document.
+Its numbered listing sits in the system prompt and stays byte-identical from
+turn to turn, so it is the same cached prefix for providers that cache
+prompts. The part of the prompt that changes carries only a unified diff from
+the reference to the version being edited, and an outline of that version
+with its line numbers.
+
+The listing is resent (the reference moves to the current version) at the
+first turn, after an edit fails, since its line numbers may have been read
+from the wrong version, and whenever the diff and outline would cost more
+than a fraction of the listing itself.
+
+The listing makes the system prompt longer (MLESolver did not send one
+before), so the mode pays off through prompt caching rather than through
+shorter prompts. The reported metrics are the listing tokens resent as an
+unchanged, cacheable prefix and the tokens history entries save by showing
+versions as diffs.
+"""
+import re
+from typing import List, Optional, Sequence, Tuple
+
+from document import Document
+
+# Diff plus outline larger than this share of the full listing resends the listing
+MAX_DIFF_RATIO = 0.5
+# Unchanged lines shown around each change
+DIFF_CONTEXT_LINES = 2
+# Outline entries shown, the rest are elided
+MAX_OUTLINE_LINES = 40
+
+# Lines worth naming in an outline
+CODE_OUTLINE = re.compile(r"^(def |class |async def |for |while |with |if |try:|# )")
+LATEX_OUTLINE = re.compile(r"^\s*\\(title|(sub)*section\*?|begin\{(abstract|figure|table|algorithm|equation)\*?\}|bibliography)")
+
+
+def number_lines(lines: Sequence[str], first: int = 0) -> str:
+    """Lines formatted as ``N |line``, like the solvers' listings."""
+    return "".join(f"{_index} |{_line}\n" for _index, _line in enumerate(lines, first))
+
+
+def unified_diff(old: Document, new: Document, context: int = DIFF_CONTEXT_LINES) -> List[str]:
+    """
+    Unified diff between two versions with 0-based line numbers.
+
+    Removed lines carry their number in ``old``, kept and added lines their
+    number in ``new``, so an ``EDIT N M`` can be written from the diff alone.
+    """
+    groups: List[List[Tuple[int, int, List[str]]]] = []
+    for hunk in old.diff(new):
+        if groups and hunk[0] - groups[-1][-1][1] <= 2 * context:
+            groups[-1].append(hunk)
+        else:
+            groups.append([hunk])
+    out, shift = [], 0
+    for group in groups:
+        first = max(0, group[0][0] - context)
+        last = min(len(old), group[-1][1] + context)
+        new_first = first + shift
+        body, position, new_position = [], first, new_first
+        for start, end, lines in group:
+            for _line in old[position:start]:
+                body.append(f" {new_position} |{_line}")
+                new_position += 1
+            body.extend(f"-{_index} |{_line}" for _index, _line in enumerate(old[start:end], start))
+            for _line in lines:
+                body.append(f"+{new_position} |{_line}")
+                new_position += 1
+            shift += len(lines) - (end - start)
+            position = end
+        for _line in old[position:last]:
+            body.append(f" {new_position} |{_line}")
+            new_position += 1
+        out.append(f"@@ -{first},{last - first} +{new_first},{new_position - new_first} @@")
+        out.extend(body)
+    return out
+
+
+def outline(document: Document, pattern: re.Pattern, limit: int = MAX_OUTLINE_LINES) -> List[str]:
+    """Numbered lines of ``document`` matching ``pattern``, at most ``limit`` of them."""
+    entries = [f"{_index} |{_line.strip()}" for _index, _line in enumerate(document) if pattern.match(_line)]
+    if len(entries) > limit:
+        entries = entries[:limit] + [f"... {len(entries) - limit} more"]
+    return entries
+
+
+class IncrementalContext:
+    """
+    What one solver session has shown the model of a document.
+
+    Args:
+        name: What the document is called in prompts, e.g. "code" or "paper"
+        pattern: Lines named in the outline
+        solver: Prefix of the reported metrics, e.g. "mlesolver"
+        max_diff_ratio: Diff and outline cost, as a share of the listing's,
+            above which the listing is resent
+    """
+
+    def __init__(self, name: str, pattern: re.Pattern, solver: str, max_diff_ratio: float = MAX_DIFF_RATIO):
+        self.name = name
+        self.pattern = pattern
+        self.max_diff_ratio = max_diff_ratio
+        self.solver = solver
+        self.reference: Optional[Document] = None
+        self.in_sync = False
+        self.full_sends = 0
+        self.diff_sends = 0
+        # listing tokens sent again unchanged, as a cacheable prefix
+        self.cached_prefix_tokens = 0
+        # tokens history entries saved by showing a diff instead of the version
+        self.history_tokens_saved = 0
+
+    def listing(self) -> str:
+        """Numbered listing of the reference version, for the system prompt."""
+        return number_lines(self.reference or ())
+
+    def resync(self):
+        """Resend the listing on the next turn, e.g. after an edit failed."""
+        self.in_sync = False
+
+    def render(self, lines) -> str:
+        """
+        Bring the session up to date with the version the next command edits.
+
+        Args:
+            lines: Version of the document the model will edit
+
+        Returns:
+            Text for the changing part of the prompt: the diff and outline,
+            or a note that the listing is current when it was just resent
+        """
+        from tools import count_tokens
+        document = Document.coerce(lines)
+        if self.in_sync and self.reference is not None:
+            if document == self.reference:
+                changes = f"Your {self.name} is exactly the listing in the system prompt."
+            else:
+                changes = (
+                    f"Your {self.name} is the listing in the system prompt with the following changes, as a unified diff "
+                    f"(0-based line numbers: removed lines (-) carry their number in the listing, kept and added lines "
+                    f"their number in your current {self.name}, which EDIT line numbers refer to):\n"
+                    + "\n".join(unified_diff(self.reference, document))
+                )
+            changes += (f"\nOutline of your current {self.name} ({len(document)} lines):\n"
+                        + "\n".join(outline(document, self.pattern)))
+            full_tokens = count_tokens(number_lines(document))
+            diff_tokens = count_tokens(changes)
+            if diff_tokens <= self.max_diff_ratio * full_tokens:
+                self.diff_sends += 1
+                self.cached_prefix_tokens += count_tokens(self.listing())
+                self._report()
+                return changes
+        self.reference, self.in_sync = document, True
+        self.full_sends += 1
+        self._report()
+        return f"Your {self.name} is exactly the listing in the system prompt."
+
+    def describe(self, lines) -> str:
+        """
+        A version of the document for a history entry, as a diff against the
+        reference when that is shorter than the version itself.
+        """
+        from tools import count_tokens
+        document = Document.coerce(lines)
+        full = repr(document)
+        if self.reference is None:
+            return full
+        if document == self.reference:
+            described = f"(identical to the {self.name} listing in the system prompt)"
+        else:
+            described = (f"(diff against the {self.name} listing in the system prompt)\n"
+                         + "\n".join(unified_diff(self.reference, document)))
+        saved = count_tokens(full) - count_tokens(described)
+        if saved <= 0:
+            return full
+        self.history_tokens_saved += saved
+        return described
+
+    def _report(self):
+        from logger import get_logger
+        logger = get_logger()
+        logger.metric(f"{self.solver}_prompt_cached_prefix_tokens", self.cached_prefix_tokens, "tokens")
+        logger.metric(f"{self.solver}_history_tokens_saved", self.history_tokens_saved, "tokens")
+        logger.metric(f"{self.solver}_prompt_full_resends", self.full_sends, "count")
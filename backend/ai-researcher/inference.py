@@ -76,7 +76,35 @@ def curr_cost_est():
     }
     return sum([costmap_in.get(_, 0)*TOKENS_IN[_] for _ in TOKENS_IN]) + sum([costmap_out.get(_, 0)*TOKENS_OUT[_] for _ in TOKENS_OUT])
 
-def query_openrouter(model_str, prompt, system_prompt, temp=None):
+def structured_kwargs(json_schema):
+    """
+    Request arguments of an OpenAI-compatible chat completion that constrain
+    the answer to a JSON schema, given as {"name": ..., "schema": ...}.
+    """
+    if json_schema is None:
+        return {}
+    return {"response_format": {"type": "json_schema", "json_schema": {
+        "name": json_schema["name"], "schema": json_schema["schema"], "strict": True}}}
+
+def gemini_generation_config(json_schema):
+    """Gemini JSON mode when a schema is requested; its schema dialect differs, so only the MIME type is set."""
+    if json_schema is None:
+        return None
+    return {"response_mime_type": "application/json"}
+
+def rejects_structured_output(error):
+    """
+    Whether a provider refused the structured output request itself, a 400 about response_format, tools or the
+    response schema, rather than failing in a way that is worth retrying with the same request.
+    """
+    # openai and anthropic errors carry status_code, google.api_core errors code
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if status != 400:
+        return False
+    message = str(error).lower()
+    return any(_term in message for _term in ("response_format", "json_schema", "tool", "response_mime_type", "schema"))
+
+def query_openrouter(model_str, prompt, system_prompt, temp=None, json_schema=None):
     """Query models via OpenRouter API for multi-provider support"""
     openrouter_key = os.getenv('OPENROUTER_API_KEY')
     if not openrouter_key:
@@ -94,14 +122,19 @@ def query_openrouter(model_str, prompt, system_prompt, temp=None):
         {"role": "user", "content": prompt}
     ]
     
-    kwargs = {"model": model_id, "messages": messages}
+    kwargs = {"model": model_id, "messages": messages, **structured_kwargs(json_schema)}
     if temp is not None:
         kwargs["temperature"] = temp
     
     completion = client.chat.completions.create(**kwargs)
     return completion.choices[0].message.content
 
-def query_model(model_str, prompt, system_prompt, openai_api_key=None, gemini_api_key=None,  anthropic_api_key=None, tries=5, timeout=5.0, temp=None, print_cost=True, version="1.5", agent_name=None):
+def query_model(model_str, prompt, system_prompt, openai_api_key=None, gemini_api_key=None,  anthropic_api_key=None, tries=5, timeout=5.0, temp=None, print_cost=True, version="1.5", agent_name=None, json_schema=None):
+    """
+    @param json_schema: (dict) {"name": ..., "schema": ...} the answer should follow. Providers with a structured
+                        output mode return the JSON object as the answer, the others get the prompt unchanged, and a
+                        provider that rejects the mode is asked again without it
+    """
     preloaded_api = os.getenv('OPENAI_API_KEY')
     if openai_api_key is None and preloaded_api is not None:
         openai_api_key = preloaded_api
@@ -116,9 +149,10 @@ def query_model(model_str, prompt, system_prompt, openai_api_key=None, gemini_ap
         os.environ["GEMINI_API_KEY"] = gemini_api_key
     for _ in range(tries):
         try:
+            structured = structured_kwargs(json_schema)
             # Route OpenRouter models first
             if model_str in OPENROUTER_MODELS:
-                answer = query_openrouter(model_str, prompt, system_prompt, temp)
+                answer = query_openrouter(model_str, prompt, system_prompt, temp, json_schema=json_schema)
             elif model_str == "gpt-4o-mini" or model_str == "gpt4omini" or model_str == "gpt-4omini" or model_str == "gpt4o-mini":
                 model_str = "gpt-4o-mini"
                 messages = [
@@ -139,19 +173,21 @@ def query_model(model_str, prompt, system_prompt, openai_api_key=None, gemini_ap
                     client = OpenAI()
                     if temp is None:
                         completion = client.chat.completions.create(
-                            model="gpt-4o-mini-2024-07-18", messages=messages, )
+                            model="gpt-4o-mini-2024-07-18", messages=messages, **structured)
                     else:
                         completion = client.chat.completions.create(
-                            model="gpt-4o-mini-2024-07-18", messages=messages, temperature=temp)
+                            model="gpt-4o-mini-2024-07-18", messages=messages, temperature=temp, **structured)
                 answer = completion.choices[0].message.content
 
             elif model_str == "gemini-2.0-pro":
                 genai.configure(api_key=gemini_api_key)
-                model = genai.GenerativeModel(model_name="gemini-2.0-pro-exp-02-05", system_instruction=system_prompt)
+                model = genai.GenerativeModel(model_name="gemini-2.0-pro-exp-02-05", system_instruction=system_prompt,
+                                              generation_config=gemini_generation_config(json_schema))
                 answer = model.generate_content(prompt).text
             elif model_str == "gemini-1.5-pro":
                 genai.configure(api_key=gemini_api_key)
-                model = genai.GenerativeModel(model_name="gemini-1.5-pro", system_instruction=system_prompt)
+                model = genai.GenerativeModel(model_name="gemini-1.5-pro", system_instruction=system_prompt,
+                                              generation_config=gemini_generation_config(json_schema))
                 answer = model.generate_content(prompt).text
             elif model_str == "o3-mini":
                 model_str = "o3-mini"
@@ -163,16 +199,22 @@ def query_model(model_str, prompt, system_prompt, openai_api_key=None, gemini_ap
                 else:
                     client = OpenAI()
                     completion = client.chat.completions.create(
-                        model="o3-mini-2025-01-31", messages=messages)
+                        model="o3-mini-2025-01-31", messages=messages, **structured)
                 answer = completion.choices[0].message.content
 
             elif model_str == "claude-3.5-sonnet":
                 client = anthropic.Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+                if json_schema is not None:
+                    # a forced tool call is Anthropic's structured output, its input is the JSON object
+                    structured = {"tools": [{"name": json_schema["name"], "description": "Record the answer.",
+                                             "input_schema": json_schema["schema"]}],
+                                  "tool_choice": {"type": "tool", "name": json_schema["name"]}}
                 message = client.messages.create(
                     model="claude-3-5-sonnet-latest",
                     system=system_prompt,
-                    messages=[{"role": "user", "content": prompt}])
-                answer = json.loads(message.to_json())["content"][0]["text"]
+                    messages=[{"role": "user", "content": prompt}], **structured)
+                content = json.loads(message.to_json())["content"][0]
+                answer = json.dumps(content["input"]) if content["type"] == "tool_use" else content["text"]
             elif model_str == "gpt4o" or model_str == "gpt-4o":
                 model_str = "gpt-4o"
                 messages = [
@@ -192,10 +234,10 @@ def query_model(model_str, prompt, system_prompt, openai_api_key=None, gemini_ap
                     client = OpenAI()
                     if temp is None:
                         completion = client.chat.completions.create(
-                            model="gpt-4o-2024-08-06", messages=messages, )
+                            model="gpt-4o-2024-08-06", messages=messages, **structured)
                     else:
                         completion = client.chat.completions.create(
-                            model="gpt-4o-2024-08-06", messages=messages, temperature=temp)
+                            model="gpt-4o-2024-08-06", messages=messages, temperature=temp, **structured)
                 answer = completion.choices[0].message.content
             elif model_str == "deepseek-chat":
                 model_str = "deepseek-chat"
@@ -209,15 +251,20 @@ def query_model(model_str, prompt, system_prompt, openai_api_key=None, gemini_ap
                         api_key=os.getenv('DEEPSEEK_API_KEY'),
                         base_url="https://api.deepseek.com/v1"
                     )
+                    # DeepSeek has JSON mode without schemas, and only for prompts that mention JSON
+                    if json_schema is not None and "json" in (system_prompt + prompt).lower():
+                        structured = {"response_format": {"type": "json_object"}}
+                    else:
+                        structured = {}
                     if temp is None:
                         completion = deepseek_client.chat.completions.create(
                             model="deepseek-chat",
-                            messages=messages)
+                            messages=messages, **structured)
                     else:
                         completion = deepseek_client.chat.completions.create(
                             model="deepseek-chat",
                             messages=messages,
-                            temperature=temp)
+                            temperature=temp, **structured)
                 answer = completion.choices[0].message.content
             elif model_str == "o1-mini":
                 model_str = "o1-mini"
@@ -243,7 +290,7 @@ def query_model(model_str, prompt, system_prompt, openai_api_key=None, gemini_ap
                 else:
                     client = OpenAI()
                     completion = client.chat.completions.create(
-                        model="o1-2024-12-17", messages=messages)
+                        model="o1-2024-12-17", messages=messages, **structured)
                 answer = completion.choices[0].message.content
             elif model_str == "o1-preview":
                 model_str = "o1-preview"
@@ -305,6 +352,9 @@ def query_model(model_str, prompt, system_prompt, openai_api_key=None, gemini_ap
             return answer
         except Exception as e:
             print("Inference Exception:", e)
+            if json_schema is not None and rejects_structured_output(e):
+                # the provider does not support the structured output mode, the answer is parsed either way
+                json_schema = None
             time.sleep(timeout)
             continue
     raise Exception("Max retries: timeout")
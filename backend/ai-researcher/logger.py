@@ -188,6 +188,26 @@ class AgentLogger:
         }
         self._emit(event)
     
+    def solver_converged(self, solver: str, steps_taken: int, steps_saved: int, best_score: float):
+        """
+        Log a solver loop that stopped early because its score stopped improving.
+
+        Args:
+            solver: Name of the solver, e.g. 'mle-solver'
+            steps_taken: Optimization steps that were run
+            steps_saved: Steps of the budget that were skipped
+            best_score: Best score reached
+        """
+        event = {
+            "type": "solver_converged",
+            "solver": solver,
+            "stepsTaken": steps_taken,
+            "stepsSaved": steps_saved,
+            "bestScore": best_score,
+            "timestamp": datetime.now().isoformat()
+        }
+        self._emit(event)
+
     def agent_action(self, action: str, details: Optional[Dict[str, Any]] = None):
         """
         Log an agent action.
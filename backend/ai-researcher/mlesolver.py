@@ -1,4 +1,10 @@
+import heapq
 import random
+import shutil
+import weakref
+import tempfile
+import hashlib
+import itertools
 from copy import copy
 from copy import deepcopy
 from common_imports import *
@@ -7,10 +13,19 @@ from abc import abstractmethod
 
 from tools import *
 from inference import *
+from score_cache import ScoreCache, cached_score, store_score
+from autorepair import repair_program, repair_edit
+from document import Document
+from incremental_context import CODE_OUTLINE, IncrementalContext
+from condenser import CAPTURE_LIMIT, condense_for
+from structured_output import SCORE_SCHEMA, parse_score
+from result_cache import directory_state
+from sandbox import working_directory
 from pathlib import Path
 
 
-from contextlib import contextmanager
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 import sys, os
 
 
@@ -23,11 +38,19 @@ logging.getLogger('sklearn.model_selection').setLevel(logging.WARNING)
 
 
 GLOBAL_REPAIR_ATTEMPTS = 2
+# deterministic repairs tried per command on top of the repair model attempts
+LOCAL_REPAIR_ATTEMPTS = 3
+# population candidates run in scratch directories below this one in the working directory
+CANDIDATE_DIRECTORY = ".mlesolver_candidates"
+# databases of the running lab are not program inputs and may be half-written
+_DATABASE_SUFFIXES = (".db", ".db-wal", ".db-shm", ".db-journal")
 
 
 class Command:
     def __init__(self):
         self.cmd_type = "OTHER"
+        # wraps every program run of the command, see CandidateRun
+        self.run_context = nullcontext()
 
     @abstractmethod
     def docstring(self) -> str:
@@ -76,10 +99,11 @@ class Replace(Command):
 
     def parse_command(self, *args) -> tuple:
         new_code = extract_prompt(args[0], "REPLACE")
-        code_exec = f"{args[1]}\n{new_code}"
-        code_ret = execute_code(code_exec)
-        if "[CODE EXECUTION ERROR]" in code_ret: return False, (None, code_ret,)
-        return True, (new_code.split("\n"), code_ret)
+        # the dataset code runs once, candidates start from a copy of its namespace
+        with self.run_context:
+            code_ret, run_stats = execute_code(new_code, prelude=args[1], incremental=True, return_stats=True, use_cache=True, MAX_LEN=CAPTURE_LIMIT)
+        if "[CODE EXECUTION ERROR]" in code_ret: return False, (None, code_ret, run_stats)
+        return True, (Document.from_text(new_code), code_ret, run_stats)
 
 
 
@@ -104,20 +128,16 @@ class Edit(Command):
         # args[4] -> new lines to replace
         try:
             args = args[0]
-            current_code = args[2]
-            lines_to_add = list(reversed(args[3]))
-            lines_to_replace = list(reversed(range(args[0], args[1]+1)))
-            for _ln in lines_to_replace:
-                current_code.pop(_ln)
-            for _line in lines_to_add:
-                current_code.insert(args[0], _line)
-            new_code = "\n".join(current_code)
-            code_exec = f"{args[4]}\n{new_code}"
-            code_ret = execute_code(code_exec)
-            if "CODE EXECUTION ERROR" in code_ret: return (False, None, code_ret)
-            return (True, current_code, code_ret)
+            # a new version sharing every untouched line with the old code
+            current_code = Document.coerce(args[2]).replace_range(args[0], args[1]+1, args[3])
+            new_code = current_code.text
+            # only the cells from the first edited one onwards are re-executed
+            with self.run_context:
+                code_ret, run_stats = execute_code(new_code, prelude=args[4], incremental=True, return_stats=True, use_cache=True, MAX_LEN=CAPTURE_LIMIT)
+            if "CODE EXECUTION ERROR" in code_ret: return (False, None, code_ret, run_stats)
+            return (True, current_code, code_ret, run_stats)
         except Exception as e:
-            return (False, None, str(e))
+            return (False, None, str(e), {})
 
     def matches_command(self, cmd_str) -> bool:
         if "```EDIT" in cmd_str: return True
@@ -138,14 +158,78 @@ class Edit(Command):
             return False, (None, None, None, None, None)
 
 
+class CandidateRun:
+    """
+    Program runs of one population candidate. Every candidate runs in its own scratch directory holding a copy of the
+    inputs in the working directory, so candidates run at the same time without seeing each other's files. The names of
+    the files its runs write are kept so the chosen candidate's files can be put into the working directory
+    """
+    def __init__(self, path):
+        self.path = path
+        self.files = set()
+
+    def __enter__(self):
+        self._directory = working_directory(self.path)
+        self._directory.__enter__()
+        self._before = directory_state(self.path)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.files.update(_name for _name, _state in directory_state(self.path).items() if self._before.get(_name) != _state)
+        finally:
+            self._directory.__exit__(*exc)
+        return False
+
+
+def sync_candidate_inputs(path):
+    """
+    Bring a candidate's scratch directory up to date with the working directory: files that changed are copied,
+    directories are linked
+    @param path: (str) scratch directory, created if missing
+    """
+    os.makedirs(path, exist_ok=True)
+    with os.scandir(".") as entries:
+        for entry in entries:
+            target = os.path.join(path, entry.name)
+            if entry.name == CANDIDATE_DIRECTORY or entry.name.endswith(_DATABASE_SUFFIXES):
+                continue
+            if entry.is_dir():
+                if not os.path.lexists(target): os.symlink(os.path.abspath(entry.path), target)
+            elif entry.is_file():
+                info = entry.stat()
+                try:
+                    copied = os.stat(target, follow_symlinks=False)
+                except OSError:
+                    copied = None
+                if copied is None or (copied.st_mtime_ns, copied.st_size) != (info.st_mtime_ns, info.st_size):
+                    shutil.copy2(entry.path, target)
+
+
+def keep_candidate_files(best):
+    """
+    Put the files the chosen candidate's runs wrote into the working directory
+    @param best: (dict) chosen candidate, as returned by evaluate_candidates
+    """
+    for name in best["run"].files:
+        try:
+            shutil.copy2(os.path.join(best["run"].path, name), name)
+        except OSError:
+            pass
+
+
 def get_score(outlined_plan, code, code_return, REWARD_MODEL_LLM, attempts=3, openai_api_key=None):
     e = str()
+    # an unchanged plan, code and output keeps the score it was given before
+    score_key = ScoreCache.key(f"{REWARD_MODEL_LLM}", outlined_plan, code, code_return)
+    cached = cached_score(score_key)
+    if cached is not None: return cached[0], cached[1], True
     for _attempt in range(attempts):
         try:
             # todo: have a reward function here
             sys = (
                 f"You are a professor agent who is serving as an expert reward model that can read a research plan, research code, and code output and are able to determine how well a model followed the plan, built the code, and got the proper output scored from 0 to 1 as a float.\n\n"
-                f"You must structure your score exactly in the following way: ```SCORE\n<score here>\n``` where SCORE is just the word score, <score here> is a floating point number between 0 and 1 representing how well the model followed the plan, built the code, and got the proper output."
+                f"You must respond with a JSON object exactly in the following way: {{\"score\": <float between 0 and 1>}} where <float between 0 and 1> is a floating point number between 0 and 1 representing how well the model followed the plan, built the code, and got the proper output. This JSON will be automatically parsed, so ensure the format is precise."
             )
             scoring = query_model(
                 model_str=f"{REWARD_MODEL_LLM}",
@@ -154,9 +238,10 @@ def get_score(outlined_plan, code, code_return, REWARD_MODEL_LLM, attempts=3, op
                 prompt=(
                     f"Outlined in the following text is the research plan that the machine learning engineer was tasked with building: {outlined_plan}\n\n"
                     f"The following text is the research code that the model produced: \n{code}\n\n"
-                    f"The following is the output from the model: {code_return}\n\n"), temp=0.6)
-            performance = extract_prompt(text=scoring, word="SCORE")
-            performance = float(performance)
+                    f"The following is the output from the model: {code_return}\n\n"), temp=0.6,
+                json_schema=SCORE_SCHEMA)
+            performance = parse_score(scoring)
+            store_score(score_key, performance, f"The performance of your submission is: {performance}")
             return performance, f"The performance of your submission is: {performance}", True
         except Exception as e:
             return None, str(e), False
@@ -169,6 +254,7 @@ def code_repair(code, error, ctype, REPAIR_LLM, openai_api_key=None):
             "You are an automated code repair tool.\n"
             "Your goal is to take in code and an error and repair the code to make sure the same error does not repeat itself, and also to remove any other potential errors from the code without affecting the code output.\n"
             "Your output should match the original code as closely as possible.\n"
+            "Errors of the form 'line N:C: Kind: message' come from a static check of the code and are followed by the offending line, with carets under the problem.\n"
             "You must wrap the code in the following ```python\n<code here>\n```\n"
             "Do not forget the opening ```python and the closing ```."
         )
@@ -183,6 +269,7 @@ def code_repair(code, error, ctype, REPAIR_LLM, openai_api_key=None):
             "You are an automated code repair tool.\n"
             "Your goal is to take in code and an error and repair the code to make sure the same error does not repeat itself, and also to remove any other potential errors from the code without affecting the code output.\n"
             "Your output should match the original code as closely as possible.\n"
+            "Errors of the form 'line N:C: Kind: message' come from a static check of the code and are followed by the offending line, with carets under the problem.\n"
             
             "============= CODE EDITING TOOL =============\n"
             "You have access to a code editing tool. \n"
@@ -201,7 +288,12 @@ def code_repair(code, error, ctype, REPAIR_LLM, openai_api_key=None):
 
 
 class MLESolver:
-    def __init__(self, dataset_code, openai_api_key=None, notes=None, max_steps=10, insights=None, plan=None, llm_str=None):
+    def __init__(self, dataset_code, openai_api_key=None, notes=None, max_steps=10, insights=None, plan=None, llm_str=None, population=1, incremental_context=False):
+        """
+        @param population: (int) candidates generated, executed and scored concurrently per step. With more than
+                           one candidate the best `population` distinct programs are kept instead of only the best one
+        @param incremental_context: (bool) show the numbered code once per session and then only diffs against it
+        """
         self.supress_print = False
         if notes is None: self.notes = []
         else: self.notes = notes
@@ -210,7 +302,15 @@ class MLESolver:
         else: self.plan = plan
         self.llm_str = llm_str
         self.verbose = False
-        self.max_codes = 1
+        self.population = max(1, population)
+        self.max_codes = self.population
+        # top max_codes programs as a min-heap of (score, insertion order, code hash, best_codes entry)
+        self._best_heap = list()
+        self._best_hashes = set()
+        self._best_order = itertools.count()
+        self.best_codes = list()
+        # figures are cleared once per step rather than by each concurrent candidate
+        self.clear_figures = True
         self.st_hist_len = 2
         self.min_gen_trials = 1
         self.code_lines = str()
@@ -219,8 +319,18 @@ class MLESolver:
         self.code_reflect = str()
         self.max_steps = max_steps
         self.prev_code_ret = str()
+        # resource usage of the last program that was run
+        self.prev_run_stats = dict()
         self.should_execute_code = True
         self.openai_api_key = openai_api_key
+        # failed commands fixed by local rules vs. by the repair model
+        self.repair_stats = {"local": 0, "llm": 0}
+        # scratch directories of the population candidates, created on first use
+        self.candidate_root = None
+        # what the model has been shown of the code, None re-sends the code in full
+        self.code_context = IncrementalContext("code", CODE_OUTLINE, "mlesolver") if incremental_context else None
+        # start a sandbox worker while the first program is being generated
+        if USE_SANDBOX_POOL: get_sandbox_pool().warm(self.population)
 
     def initial_solve(self):
         """
@@ -234,7 +344,7 @@ class MLESolver:
         self.commands = [Replace()]
         self.model = f"{self.llm_str}"
         init_code, init_return, self.best_score = self.gen_initial_code()
-        self.best_codes = [(copy(init_code), self.best_score, init_return) for _ in range(1)]
+        self.add_best_code(init_code, self.best_score, init_return)
 
         self.code_lines = init_code
         self.model = f"{self.llm_str}"
@@ -248,6 +358,7 @@ class MLESolver:
         return text
 
     def gen_initial_code(self):
+        if self.population > 1: return self.gen_initial_population()
         num_attempts = 0
         error_hist = list()
         while True:
@@ -267,13 +378,149 @@ class MLESolver:
                 prompt=f"{err_hist}\nYou should now use ```REPLACE to create initial code to solve the challenge. Now please enter the ```REPLACE command below:\n ", temp=1.0)
             model_resp = self.clean_text(model_resp)
             cmd_str, code_lines, prev_code_ret, should_execute_code, score = self.process_command(model_resp)
+            self.report_repair_stats()
             if not self.supress_print: print(f"@@@ INIT ATTEMPT: Command Exec // Attempt {num_attempts}: ", str(cmd_str).replace("\n", " | "))
             if not self.supress_print: print(f"$$$ Score: {score}")
             if score is not None: break
             num_attempts += 1
         return code_lines, prev_code_ret, score
 
+    def gen_initial_population(self):
+        """
+        Generate initial programs `population` at a time until at least one of them runs and is scored
+        @return: (tuple) code lines, code return and score of the best initial program
+        """
+        num_attempts = 0
+        error_hist = list()
+        while True:
+            err_hist = str()
+            if error_hist: err_hist = "The following is a history of your previous errors\n" + "\n".join(error_hist[-5:]) + "\nDO NOT REPEAT THESE."
+            candidates = self.evaluate_candidates(
+                f"{err_hist}\nYou should now use ```REPLACE to create initial code to solve the challenge. Now please enter the ```REPLACE command below:\n ",
+                [self.code_lines] * self.population)
+            scored = [_cand for _cand in candidates if _cand["score"] is not None]
+            for _cand in candidates:
+                if not self.supress_print: print(f"@@@ INIT ATTEMPT: Command Exec // Attempt {num_attempts}: ", str(_cand["cmd_str"]).replace("\n", " | "))
+                if _cand["score"] is None:
+                    error_hist.append(f"The following was the previous command generated: {_cand['model_resp']}. This was the error return {_cand['cmd_str']}. You should make sure not to repeat this error and to solve the presented problem.")
+            if scored: break
+            num_attempts += 1
+        for _cand in scored:
+            self.add_best_code(_cand["code_lines"], _cand["score"], _cand["prev_code_ret"])
+        best = max(scored, key=lambda _cand: _cand["score"])
+        keep_candidate_files(best)
+        if not self.supress_print: print(f"$$$ Score: {best['score']}")
+        return best["code_lines"], best["prev_code_ret"], best["score"]
+
+    def add_best_code(self, code_lines, score, code_return):
+        """
+        Keep a scored program if it is among the top max_codes, programs that are already kept are ignored
+        @param code_lines: (list) code lines of the program
+        @param score: (float) reward model score
+        @param code_return: (str) output of the program
+        @return: (bool) whether the program was kept
+        """
+        code_lines = Document.coerce(code_lines)
+        code_hash = code_lines.digest
+        if code_hash in self._best_hashes: return False
+        entry = (score, next(self._best_order), code_hash, (copy(code_lines), copy(score), code_return))
+        if len(self._best_heap) < self.max_codes:
+            heapq.heappush(self._best_heap, entry)
+        elif score > self._best_heap[0][0]:
+            self._best_hashes.discard(heapq.heapreplace(self._best_heap, entry)[2])
+        else:
+            return False
+        self._best_hashes.add(code_hash)
+        # highest score first, most recent first among equal scores
+        self.best_codes = [_entry[3] for _entry in sorted(self._best_heap, key=lambda _entry: _entry[:2], reverse=True)]
+        return True
+
+    def evaluate_candidates(self, prompt, base_codes):
+        """
+        Generate, execute and score one candidate per base program, all candidates concurrently. Every candidate runs
+        its programs in its own scratch directory, see CandidateRun, and works on its own copy of the solver state
+        @param prompt: (str) command prompt every candidate is generated from
+        @param base_codes: (list) code lines each candidate's command is applied to
+        @return: (list) per candidate a dict with model_resp, cmd_str, code_lines, prev_code_ret,
+                 should_execute_code, score, run_stats and run, the candidate's CandidateRun
+        """
+        if self.candidate_root is None:
+            os.makedirs(CANDIDATE_DIRECTORY, exist_ok=True)
+            self.candidate_root = os.path.abspath(tempfile.mkdtemp(dir=CANDIDATE_DIRECTORY))
+            weakref.finalize(self, shutil.rmtree, self.candidate_root, True)
+        remove_figures()
+        runs = [CandidateRun(os.path.join(self.candidate_root, f"candidate_{_i}")) for _i in range(len(base_codes))]
+        for run in runs: sync_candidate_inputs(run.path)
+        system_prompt = self.system_prompt()
+        solvers = list()
+        def _candidate(base_code, run):
+            try:
+                model_resp = self.clean_text(query_model(
+                    openai_api_key=self.openai_api_key,
+                    model_str=self.model,
+                    system_prompt=system_prompt,
+                    prompt=prompt, temp=1.0))
+                # every candidate runs on its own copy of the solver state, merged back once all of them finished
+                candidate = copy(self)
+                candidate.code_lines = copy(base_code)
+                candidate.clear_figures = False
+                candidate.repair_stats = {"local": 0, "llm": 0}
+                candidate.code_context = copy(self.code_context)
+                candidate.commands = [copy(_cmd) for _cmd in self.commands]
+                for _cmd in candidate.commands: _cmd.run_context = run
+                solvers.append(candidate)
+                cmd_str, code_lines, prev_code_ret, should_execute_code, score = candidate.process_command(model_resp)
+                run_stats = candidate.prev_run_stats
+            except Exception as e:
+                model_resp, cmd_str, code_lines, prev_code_ret, should_execute_code, score, run_stats = str(), f"Candidate FAILED due to the following error: {e}", None, None, None, None, dict()
+            return {"model_resp": model_resp, "cmd_str": cmd_str, "code_lines": code_lines, "prev_code_ret": prev_code_ret,
+                    "should_execute_code": should_execute_code, "score": score, "run_stats": run_stats, "run": run}
+        with ThreadPoolExecutor(max_workers=len(base_codes)) as executor:
+            candidates = list(executor.map(_candidate, base_codes, runs))
+        for candidate in solvers:
+            for kind, count in candidate.repair_stats.items(): self.repair_stats[kind] += count
+            # a failed edit has the listing resent
+            if self.code_context is not None and not candidate.code_context.in_sync: self.code_context.resync()
+        self.report_repair_stats()
+        return candidates
+
+    def solve_population(self):
+        """
+        One optimization step in population mode: `population` candidates, each editing a randomly chosen kept program,
+        are generated, executed and scored concurrently, and every distinct scored candidate competes for the kept programs
+        @return: (tuple) model response and command return of the best candidate
+        """
+        from logger import get_logger
+        self.prev_code_ret = None
+        self.should_execute_code = False
+        if len(self.commands) == 2: cmd_app_str = "You must output either the ```EDIT or ```REPLACE command immediately. "
+        else: cmd_app_str = ""
+        prompt = f"The following is your history:{self.history_str()}\n\n{cmd_app_str}Now please enter a command: "
+        start, num_candidates = time.monotonic(), 0
+        while True:
+            candidates = self.evaluate_candidates(prompt, [copy(random.choice(self.best_codes)[0]) for _ in range(self.population)])
+            num_candidates += len(candidates)
+            scored = [_cand for _cand in candidates if _cand["score"] is not None]
+            if scored: break
+            if not self.supress_print: print("$$$ No candidate was scored, generating a new population")
+        get_logger().metric("mlesolver_candidates_per_minute", num_candidates / max(time.monotonic() - start, 1e-6) * 60, "candidates/min")
+        best = max(scored, key=lambda _cand: _cand["score"])
+        keep_candidate_files(best)
+        for _cand in candidates:
+            if not self.supress_print: print("@@@ Command Exec: ", str(_cand["cmd_str"]).replace("\n", " | "), f"$$$ Score: {_cand['score']}")
+        # the history shows the best candidate and the failures of the others
+        for _cand in [_cand for _cand in candidates if _cand["score"] is None][:self.st_hist_len - 1] + [best]:
+            self.st_history.append([_cand["model_resp"], condense_for("history", _cand["prev_code_ret"]), _cand["code_lines"], _cand["cmd_str"]])
+            if len(self.st_history) > self.st_hist_len: self.st_history.pop(0)
+        self.code_lines, self.prev_code_ret, self.should_execute_code = copy(best["code_lines"]), copy(best["prev_code_ret"]), copy(best["should_execute_code"])
+        self.prev_run_stats = best["run_stats"]
+        replaced = len(self.best_codes) >= self.max_codes
+        kept = [self.add_best_code(_cand["code_lines"], _cand["score"], _cand["prev_code_ret"]) for _cand in sorted(scored, key=lambda _cand: _cand["score"], reverse=True)]
+        if replaced and any(kept): self.code_reflect = self.reflect_code()
+        return best["model_resp"], best["cmd_str"]
+
     def solve(self):
+        if self.population > 1: return self.solve_population()
         num_attempts = 0
         best_pkg = None
         top_score = None
@@ -282,15 +529,21 @@ class MLESolver:
         while True:
             if len(self.commands) == 2: cmd_app_str = "You must output either the ```EDIT or ```REPLACE command immediately. "
             else: cmd_app_str = ""
+            code_changes = str()
+            if self.code_context is not None:
+                # the model is shown the version its command will be applied to
+                self.code_lines = copy(random.choice(self.best_codes)[0])
+                code_changes = self.code_context.render(self.code_lines) + "\n"
             model_resp = query_model(
                 openai_api_key=self.openai_api_key,
                 model_str=self.model,
                 system_prompt=self.system_prompt(),
-                prompt=f"The following is your history:{self.history_str()}\n\n{cmd_app_str}Now please enter a command: ", temp=1.0)
+                prompt=f"The following is your history:{self.history_str()}\n\n{code_changes}{cmd_app_str}Now please enter a command: ", temp=1.0)
             model_resp = self.clean_text(model_resp)
-            self.code_lines = copy(random.choice(self.best_codes)[0])
+            if self.code_context is None: self.code_lines = copy(random.choice(self.best_codes)[0])
             cmd_str, code_lines, prev_code_ret, should_execute_code, score = self.process_command(model_resp)
-            self.st_history.append([model_resp, prev_code_ret, code_lines, cmd_str])
+            self.report_repair_stats()
+            self.st_history.append([model_resp, condense_for("history", prev_code_ret), code_lines, cmd_str])
             if len(self.st_history) > self.st_hist_len: self.st_history.pop(0)
             if score is not None:
                 if top_score is None:
@@ -308,12 +561,9 @@ class MLESolver:
         # add top scoring code that was successful to the best codes
         if top_score > self.best_codes[-1][1]:
             # replace the lowest scoring one
-            if len(self.best_codes) >= self.max_codes:
-                self.best_codes.pop(-1)
+            replaced = len(self.best_codes) >= self.max_codes
+            if self.add_best_code(self.code_lines, top_score, self.prev_code_ret) and replaced:
                 self.code_reflect = self.reflect_code()
-            self.best_codes.append((copy(self.code_lines), copy(top_score), self.prev_code_ret))
-            # sort by score, to make sure lowest are removed in future
-            self.best_codes.sort(key=lambda x: x[1], reverse=True)
         return model_resp, cmd_str
 
     def reflect_code(self):
@@ -340,7 +590,7 @@ class MLESolver:
         prev_code_ret = self.prev_code_ret
         should_execute_code = self.should_execute_code
         code_lines = copy(self.code_lines)
-        remove_figures()
+        if self.clear_figures: remove_figures()
         for cmd in self.commands:
             if cmd.matches_command(model_resp):
                 # attempt to execute the code edit command
@@ -348,26 +598,38 @@ class MLESolver:
                     score = None
                     failed = True
                     code_err = str()
-                    for _tries in range(GLOBAL_REPAIR_ATTEMPTS):
+                    _tries, local_repairs = 0, 0
+                    while _tries < GLOBAL_REPAIR_ATTEMPTS:
                         success, args = cmd.parse_command(model_resp, copy(self.code_lines), self.dataset_code)
                         if success:
                             cmd_return = cmd.execute_command(args)
-                            code_err = f"Return from executing code: {cmd_return[2]}"
+                            self.prev_run_stats = cmd_return[3]
+                            code_err = f"Return from executing code: {condense_for('feedback', cmd_return[2])}{self.run_stats_str()}"
                             if cmd_return[0]:  # if success
                                 code_lines = copy(cmd_return[1])
-                                score, cmd_str, is_valid = get_score(self.plan, "\n".join(code_lines), cmd_return[2], openai_api_key=self.openai_api_key, REWARD_MODEL_LLM=self.llm_str)
+                                score, cmd_str, is_valid = get_score(self.plan, code_lines.text, condense_for("reward", cmd_return[2]), openai_api_key=self.openai_api_key, REWARD_MODEL_LLM=self.llm_str)
                                 if is_valid:
                                     failed = False
                                     break
                                 code_err += f"\nReturn from executing code on real test set {cmd_str}"
+                            # the edited program failed, try the local rules before the repair model
+                            elif local_repairs < LOCAL_REPAIR_ATTEMPTS:
+                                repaired = self.local_repair(model_resp, code_err, ctype="edit")
+                                if repaired is not None:
+                                    model_resp, local_repairs = repaired, local_repairs + 1
+                                    continue
                         repaired_code = code_repair(model_resp, code_err, REPAIR_LLM=self.llm_str, ctype="edit", openai_api_key=self.openai_api_key)
                         model_resp = repaired_code
+                        self.repair_stats["llm"] += 1
                         if not self.supress_print: print(f"     * Attempting repair // try {_tries}*")
+                        _tries += 1
                     if failed:
                         cmd_str = f"Code editing FAILED due to the following error: {code_err}. Code was reverted back to original state before edits."
+                        # the line numbers may have been read from the wrong version
+                        if self.code_context is not None: self.code_context.resync()
                         if not self.supress_print: print("$$$$ CODE EDIT (failed)")
                     else:
-                        cmd_str = "Code was successfully edited."
+                        cmd_str = f"Code was successfully edited.{self.run_stats_str()}"
                         prev_code_ret = copy(cmd_return[2])
                         if not self.supress_print: print("$$$$ CODE EDIT (success)")
                         should_execute_code = True
@@ -377,25 +639,34 @@ class MLESolver:
                     score = None
                     failed = True
                     code_err = str()
-                    for _tries in range(GLOBAL_REPAIR_ATTEMPTS):
+                    _tries, local_repairs = 0, 0
+                    while _tries < GLOBAL_REPAIR_ATTEMPTS:
                         success, args = cmd.parse_command(model_resp, self.dataset_code)
-                        code_err = f"Return from executing code: {args[1]}"
+                        self.prev_run_stats = args[2]
+                        code_err = f"Return from executing code: {condense_for('feedback', args[1])}{self.run_stats_str()}"
                         if success:
                             code_lines = copy(args[0])
-                            score, cmd_str, is_valid = get_score(self.plan, "\n".join(code_lines), args[1], openai_api_key=self.openai_api_key, REWARD_MODEL_LLM=self.llm_str)
+                            score, cmd_str, is_valid = get_score(self.plan, code_lines.text, condense_for("reward", args[1]), openai_api_key=self.openai_api_key, REWARD_MODEL_LLM=self.llm_str)
                             if is_valid:
                                 failed = False
                                 break
                             code_err += f"\nReturn from executing code on real test set {cmd_str}"
+                        elif local_repairs < LOCAL_REPAIR_ATTEMPTS:
+                            repaired = self.local_repair(model_resp, code_err, ctype="replace")
+                            if repaired is not None:
+                                model_resp, local_repairs = repaired, local_repairs + 1
+                                continue
                         repaired_code = code_repair(extract_prompt(model_resp, "REPLACE", ), code_err, ctype="replace", openai_api_key=self.openai_api_key, REPAIR_LLM=self.llm_str)
                         repaired_code = f"```REPLACE\n{repaired_code}\n```"
                         model_resp = repaired_code
+                        self.repair_stats["llm"] += 1
                         if not self.supress_print: print(f"     * Attempting repair // try {_tries}*")
+                        _tries += 1
                     if failed:
                         cmd_str = f"Code replacement FAILED due to the following error: {code_err}.  Code was reverted back to original state before edits."
                         if not self.supress_print: print("$$$$ CODE REPLACE (failed)")
                     else:
-                        cmd_str = "Code was successfully replaced."
+                        cmd_str = f"Code was successfully replaced.{self.run_stats_str()}"
                         code_lines = copy(args[0])
                         prev_code_ret = copy(args[1])
                         if not self.supress_print: print("$$$$ CODE REPLACE (success)")
@@ -404,6 +675,37 @@ class MLESolver:
         if not self.supress_print: print("$$$$ INVALID COMMAND (failed)")
         return "Command not supported, choose from existing commands", None, None, None, None
 
+    def local_repair(self, model_resp, code_err, ctype):
+        """
+        Fix a failed command with deterministic rules (missing imports, indentation, misspelled names,
+        off-by-one edit ranges) before the repair model is asked; a fix is only kept if it passes the pre-flight check
+        @param model_resp: (str) command that failed
+        @param code_err: (str) error it returned
+        @param ctype: (str) "edit" or "replace"
+        @return: (str) repaired command, or None if no rule applies
+        """
+        prelude = "from utils import *\n" + self.dataset_code
+        if ctype == "edit":
+            repair = repair_edit(model_resp, copy(self.code_lines), code_err, prelude)
+            if repair is None: return None
+            command, fixes = repair
+        else:
+            repair = repair_program(extract_prompt(model_resp, "REPLACE"), code_err, prelude)
+            if repair is None: return None
+            command, fixes = f"```REPLACE\n{repair.code}\n```", repair.fixes
+        self.repair_stats["local"] += 1
+        if not self.supress_print: print(f"     * Repaired locally: {', '.join(fixes)}*")
+        return command
+
+    def report_repair_stats(self):
+        """
+        Report how many failed commands were fixed by the local rules so far, once the step's commands finished
+        """
+        if not self.repair_stats["local"]: return
+        from logger import get_logger
+        get_logger().metric("code_repair_local_fixes", self.repair_stats["local"], "repairs")
+        get_logger().metric("code_repair_local_rate", self.repair_stats["local"] / (self.repair_stats["local"] + self.repair_stats["llm"]), "ratio")
+
     def history_str(self):
         """
         Well-formatted history string
@@ -414,7 +716,9 @@ class MLESolver:
             hist_str += f"-------- History ({len(self.st_history)-_hist} steps ago) -----\n"
             hist_str += f"Because of the following response: {self.st_history[_hist][0]}\n" if len(self.st_history[_hist][0]) > 0 else ""
             hist_str += f"and the following COMMAND response output: {self.st_history[_hist][3]}\n"
-            hist_str += f"With the following code used: {'#'*20}\n{self.st_history[_hist][2]}\n{'#'*20}\n\n"
+            hist_code = self.st_history[_hist][2]
+            if self.code_context is not None and hist_code is not None: hist_code = self.code_context.describe(hist_code)
+            hist_str += f"With the following code used: {'#'*20}\n{hist_code}\n{'#'*20}\n\n"
             hist_str += f"The environment feedback and reflection was as follows: {self.st_history[_hist][1]}\n"
             hist_str += f"-------- End of history ({len(self.st_history)-_hist} steps ago) -------\n"
         return hist_str
@@ -448,6 +752,10 @@ class MLESolver:
             f"Before each experiment please include a print statement explaining exactly what the results are meant to show in great detail before printing the results out.\n"
             # COMMAND SET
             f"The following are commands you have access to: {self.command_descriptions()}\n. You should try to have a diversity of command responses if appropriate. Do not repeat the same commend too many times. Please consider looking through your history and not repeating commands too many times." if commands else ""
+        ) + (
+            # CODE LISTING, unchanged until it is re-sent
+            f"\nThe following is the listing of your code with line numbers:\n{self.code_context.listing()}"
+            if commands and self.code_context is not None and self.code_context.reference is not None else ""
         )
 
     def generate_code_lines(self, code):
@@ -457,8 +765,8 @@ class MLESolver:
         @return: (str) code lines formatted with line numbers
         """
         codestr = str()
-        for _index in range(len(code)):
-            codestr += f"{_index} |{code[_index]}\n"
+        for _index, _line in enumerate(code):
+            codestr += f"{_index} |{_line}\n"
         return codestr
 
     def feedback(self, code_return):
@@ -467,6 +775,7 @@ class MLESolver:
         @param code_return: (str) return from code execution
         @return: (str) feedback string
         """
+        code_return = condense_for("feedback", code_return)
         if code_return is not None:
             code_str = self.generate_code_lines(self.code_lines)
             if "[CODE EXECUTION ERROR]" in code_return:
@@ -489,7 +798,15 @@ class MLESolver:
             code_return = "No changes were made to the code."
             reflect_prompt = "Reflect on your future plans and next steps to improve the code."
         reflection = self.reflection(reflect_prompt, code_str, code_return)
-        return f"Code return: {code_return}\n\nReflection: {reflection}"
+        return f"Code return: {code_return}{self.run_stats_str()}\n\nReflection: {reflection}"
+
+    def run_stats_str(self):
+        """
+        Resource usage of the last program that was run, so runaway experiments can be spotted
+        @return: (str) resource usage sentence, empty if nothing was measured
+        """
+        stats = format_run_stats(self.prev_run_stats or {})
+        return f" Resource usage: {stats}." if stats else ""
 
     def reflection(self, reflect_prompt, code_str, code_return):
         """
@@ -558,7 +875,7 @@ class MLESolver:
         if self.prev_code_ret is not None:
             return self.prev_code_ret
         elif self.should_execute_code:
-            return execute_code("\n".join(self.code_lines))
+            return execute_code("\n".join(self.code_lines), MAX_LEN=CAPTURE_LIMIT)
         return "Changes have not yet been made to the code."
 
 
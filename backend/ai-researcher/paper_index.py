@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Local Paper Index
+Persistent SQLite FTS5 corpus of every paper the lab has fetched.
+
+Abstracts and full texts passing through ArxivSearch, Semantic Scholar and
+Firecrawl are stored once and ranked with BM25, so literature searches on
+topics covered by earlier runs can be answered without going to the network.
+AgentRxiv papers are not stored: their IDs are only unique within a run.
+"""
+import os
+import re
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+# Default location of the index, shared by every run started from this directory
+DEFAULT_INDEX_PATH = os.getenv("PAPER_INDEX_PATH", "paper_index.db")
+
+# BM25 column weights for (title, summary, full_text)
+BM25_WEIGHTS = (10.0, 4.0, 1.0)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    id INTEGER PRIMARY KEY,
+    title TEXT,
+    norm_title TEXT,
+    summary TEXT,
+    full_text TEXT,
+    full_text_budget INTEGER,
+    published TEXT,
+    arxiv_id TEXT,
+    norm_arxiv_id TEXT,
+    doi TEXT,
+    url TEXT,
+    venue TEXT,
+    citations INTEGER,
+    sources TEXT,
+    added REAL
+);
+CREATE INDEX IF NOT EXISTS papers_norm_title ON papers(norm_title);
+CREATE INDEX IF NOT EXISTS papers_norm_arxiv_id ON papers(norm_arxiv_id);
+CREATE INDEX IF NOT EXISTS papers_doi ON papers(lower(doi));
+CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(
+    title, summary, full_text, content='papers', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS papers_ai AFTER INSERT ON papers BEGIN
+    INSERT INTO papers_fts(rowid, title, summary, full_text)
+    VALUES (new.id, new.title, new.summary, new.full_text);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_ad AFTER DELETE ON papers BEGIN
+    INSERT INTO papers_fts(papers_fts, rowid, title, summary, full_text)
+    VALUES ('delete', old.id, old.title, old.summary, old.full_text);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_au AFTER UPDATE ON papers BEGIN
+    INSERT INTO papers_fts(papers_fts, rowid, title, summary, full_text)
+    VALUES ('delete', old.id, old.title, old.summary, old.full_text);
+    INSERT INTO papers_fts(rowid, title, summary, full_text)
+    VALUES (new.id, new.title, new.summary, new.full_text);
+END;
+"""
+
+_RECORD_FIELDS = ("title", "summary", "published", "arxiv_id", "doi", "url", "venue", "citations")
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def normalize_title(title: Optional[str]) -> str:
+    """Lowercase a title and collapse everything but letters and digits."""
+    return re.sub(r"[^a-z0-9]+", " ", (title or "").lower()).strip()
+
+
+def normalize_arxiv_id(arxiv_id: Optional[str]) -> str:
+    """Lowercase an arXiv ID and strip its version suffix."""
+    return re.sub(r"v\d+$", "", (arxiv_id or "").lower().strip())
+
+
+def record_keys(record: Dict[str, Any]) -> List[str]:
+    """
+    Identity keys of a paper record, strongest first.
+
+    Args:
+        record: Paper record with optional doi, arxiv_id and title
+
+    Returns:
+        Keys of the form ``doi:...``, ``arxiv:...`` and ``title:...``
+    """
+    keys = []
+    if record.get("doi"):
+        keys.append("doi:" + record["doi"].lower().strip())
+    if record.get("arxiv_id"):
+        keys.append("arxiv:" + normalize_arxiv_id(record["arxiv_id"]))
+    title = normalize_title(record.get("title"))
+    if title:
+        keys.append("title:" + title)
+    return keys
+
+
+def _match_expression(query: str, require_all: bool) -> Optional[str]:
+    terms = [term for term in re.findall(r"\w+", query.lower()) if len(term) > 1]
+    if not terms:
+        return None
+    # quoting keeps FTS5 operators in user queries from being interpreted
+    return (" AND " if require_all else " OR ").join(f'"{term}"' for term in dict.fromkeys(terms))
+
+
+class PaperIndex:
+    """
+    SQLite FTS5 index of paper abstracts and full texts.
+    Safe to share between threads; records are merged by DOI, arXiv ID or
+    normalized title so a paper seen through several sources is stored once.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            # parallel labs share the file
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+    def _find(self, record: Dict[str, Any]) -> Optional[sqlite3.Row]:
+        for key in record_keys(record):
+            kind, value = key.split(":", 1)
+            column = {"doi": "lower(doi)", "arxiv": "norm_arxiv_id", "title": "norm_title"}[kind]
+            row = self._conn.execute(f"SELECT * FROM papers WHERE {column} = ? LIMIT 1", (value,)).fetchone()
+            if row is not None:
+                return row
+        return None
+
+    def _upsert(self, record: Dict[str, Any], source: Optional[str]) -> Optional[int]:
+        if not record_keys(record):
+            return None
+        sources = list(record.get("sources") or [])
+        if source or record.get("source"):
+            sources.append(source or record["source"])
+        row = self._find(record)
+        if row is None:
+            cursor = self._conn.execute(
+                "INSERT INTO papers (title, norm_title, summary, published, arxiv_id, norm_arxiv_id, doi, url, "
+                "venue, citations, sources, added) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (record.get("title"), normalize_title(record.get("title")), record.get("summary"),
+                 record.get("published"), record.get("arxiv_id"), normalize_arxiv_id(record.get("arxiv_id")) or None,
+                 record.get("doi"), record.get("url"), record.get("venue"), record.get("citations"),
+                 ",".join(dict.fromkeys(sources)), time.time()))
+            return cursor.lastrowid
+        updates = {}
+        for field in _RECORD_FIELDS:
+            value = record.get(field)
+            if value in (None, ""):
+                continue
+            current = row[field]
+            if field == "summary" and len(str(value)) > len(current or ""):
+                updates[field] = value
+            elif field == "citations" and (current is None or value > current):
+                updates[field] = value
+            elif current in (None, ""):
+                updates[field] = value
+        if "title" in updates:
+            updates["norm_title"] = normalize_title(updates["title"])
+        if "arxiv_id" in updates:
+            updates["norm_arxiv_id"] = normalize_arxiv_id(updates["arxiv_id"])
+        merged_sources = ",".join(dict.fromkeys([s for s in (row["sources"] or "").split(",") if s] + sources))
+        if merged_sources != row["sources"]:
+            updates["sources"] = merged_sources
+        if updates:
+            assignments = ", ".join(f"{column} = ?" for column in updates)
+            self._conn.execute(f"UPDATE papers SET {assignments} WHERE id = ?", (*updates.values(), row["id"]))
+        return row["id"]
+
+    def add_records(self, records: List[Dict[str, Any]], source: Optional[str] = None) -> int:
+        """
+        Add or merge paper records.
+
+        Args:
+            records: Records with title, summary, published, arxiv_id, doi,
+                url, venue, citations and source fields (all optional)
+            source: Source name overriding each record's ``source``
+
+        Returns:
+            Number of records stored
+        """
+        stored = 0
+        with self._lock:
+            for record in records:
+                if self._upsert(record, source) is not None:
+                    stored += 1
+            self._conn.commit()
+        return stored
+
+    def add_full_text(self, paper_id: str, text: str, budget: Optional[int] = None,
+                      title: Optional[str] = None, source: Optional[str] = None):
+        """
+        Store the full text of a paper.
+
+        Args:
+            paper_id: arXiv paper ID
+            text: Extracted text
+            budget: Character budget the text was extracted with, ``None``
+                when it is the complete text
+            title: Title used when the paper is not indexed yet
+            source: Source name used when the paper is not indexed yet
+        """
+        with self._lock:
+            row_id = self._upsert({"arxiv_id": paper_id, "title": title}, source)
+            self._conn.execute("UPDATE papers SET full_text = ?, full_text_budget = ? WHERE id = ?",
+                               (text, budget, row_id))
+            self._conn.commit()
+
+    def get_full_text(self, paper_id: str, max_len: Optional[int] = None) -> Optional[str]:
+        """
+        Return a stored full text, or ``None`` when it is missing or was
+        truncated at a smaller budget than ``max_len``.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT full_text, full_text_budget FROM papers WHERE norm_arxiv_id = ? AND full_text IS NOT NULL",
+                (normalize_arxiv_id(paper_id),)).fetchone()
+        if row is None:
+            return None
+        text, budget = row["full_text"], row["full_text_budget"]
+        truncated = budget is not None and len(text) >= budget
+        if truncated and (max_len is None or budget < max_len):
+            return None
+        return text if max_len is None else text[:max_len]
+
+    def search(self, query: str, limit: int = 10, require_all: bool = True,
+               sources: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Rank indexed papers against a query with BM25.
+
+        Args:
+            query: Free-text query
+            limit: Maximum number of results
+            require_all: Only return papers containing every query term
+            sources: Only return records seen through one of these sources,
+                e.g. to leave out web pages
+
+        Returns:
+            Paper records, best first, with ``sources`` as a list
+        """
+        expression = _match_expression(query, require_all)
+        if expression is None:
+            return []
+        weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+        source_filter, params = "", [expression]
+        if sources is not None:
+            if not sources:
+                return []
+            # sources are stored comma-separated
+            source_filter = " AND (" + " OR ".join("instr(',' || papers.sources || ',', ?) > 0" for _ in sources) + ")"
+            params += [f",{source}," for source in sources]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT papers.*, bm25(papers_fts, {weights}) AS rank FROM papers_fts "
+                f"JOIN papers ON papers.id = papers_fts.rowid WHERE papers_fts MATCH ?{source_filter} "
+                f"ORDER BY rank LIMIT ?", (*params, limit)).fetchall()
+        records = []
+        for row in rows:
+            record = {field: row[field] for field in _RECORD_FIELDS}
+            record["sources"] = [s for s in (row["sources"] or "").split(",") if s]
+            record["has_full_text"] = row["full_text"] is not None
+            records.append(record)
+        return records
+
+
+def get_paper_index(path: Optional[str] = None) -> PaperIndex:
+    """
+    Get or create the shared paper index.
+
+    Args:
+        path: Database path, defaults to ``PAPER_INDEX_PATH`` or
+            ``paper_index.db`` in the working directory
+
+    Returns:
+        PaperIndex instance
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PaperIndex(path or DEFAULT_INDEX_PATH)
+        return _index
@@ -8,10 +8,14 @@ from pathlib import Path
 from copy import deepcopy
 from common_imports import *
 from agents import get_score
+from section_review import SectionReviewer
+from document import Document
+from incremental_context import LATEX_OUTLINE, IncrementalContext
 from abc import abstractmethod
 
 from contextlib import contextmanager
-import sys, os
+from concurrent.futures import ThreadPoolExecutor
+import sys, os, time, threading
 
 class Command:
     def __init__(self):
@@ -115,7 +119,7 @@ class PaperReplace(Command):
         new_latex = extract_prompt(args[0], "REPLACE")
         latex_ret = compile_latex(new_latex, self.save_loc, compile=args[1])
         if "[CODE EXECUTION ERROR]" in latex_ret: return False, (None, latex_ret,)
-        return True, (new_latex.split("\n"), latex_ret)
+        return True, (Document.from_text(new_latex), latex_ret)
 
 
 
@@ -140,14 +144,9 @@ class PaperEdit(Command):
         # args[3] -> new lines to replace
         try:
             args = args[0]
-            current_latex = args[2]
-            lines_to_add = list(reversed(args[3]))
-            lines_to_replace = list(reversed(range(args[0], args[1]+1)))
-            for _ln in lines_to_replace:
-                current_latex.pop(_ln)
-            for _line in lines_to_add:
-                current_latex.insert(args[0], _line)
-            new_latex = "\n".join(current_latex)
+            # a new version sharing every untouched line with the old latex
+            current_latex = Document.coerce(args[2]).replace_range(args[0], args[1]+1, args[3])
+            new_latex = current_latex.text
             latex_exec = f"{new_latex}"
             latex_ret = compile_latex(latex_exec, self.save_loc, compile=args[4])
             if "error" in latex_ret.lower(): return (False, None, latex_ret)
@@ -234,8 +233,21 @@ Please make sure the abstract reads smoothly and is well-motivated. This should
 """,
 }
 
+# Sections drafted into the scaffold, in the order they are merged
+PAPER_SECTIONS = ["abstract", "introduction", "related work", "background", "methods", "experimental setup", "results", "discussion"]
+# Sections drafted with the papers of a related-work search
+CITING_SECTIONS = ["introduction", "related work", "background", "methods", "discussion"]
+# Related-work searches and section drafts running at once
+MAX_SECTION_WORKERS = int(os.getenv("PAPER_SECTION_WORKERS", "8"))
+# compiles write the same tex file under the save location, so they run one at a time
+_latex_lock = threading.Lock()
+
 class PaperSolver:
-    def __init__(self, llm_str, notes=None, max_steps=10, insights=None, plan=None, exp_code=None, exp_results=None, lit_review=None, ref_papers=None, topic=None, openai_api_key=None, compile_pdf=True, save_loc=None):
+    def __init__(self, llm_str, notes=None, max_steps=10, insights=None, plan=None, exp_code=None, exp_results=None, lit_review=None, ref_papers=None, topic=None, openai_api_key=None, compile_pdf=True, save_loc=None, incremental_context=False, section_review=False):
+        """
+        @param incremental_context: (bool) show the numbered paper once per session and then only diffs against it
+        @param section_review: (bool) score edits by re-reviewing only the changed sections plus a coherence pass
+        """
         self.supress_print = True
         if notes is None: self.notes = []
         else: self.notes = notes
@@ -265,6 +277,10 @@ class PaperSolver:
         self.prev_paper_ret = str()
         self.section_related_work = {}
         self.openai_api_key = openai_api_key
+        # what the model has been shown of the paper, None re-sends the paper in full
+        self.paper_context = IncrementalContext("paper", LATEX_OUTLINE, "papersolver") if incremental_context else None
+        # cached per-section reviews, None reviews every edited paper in full
+        self.section_reviewer = SectionReviewer(self.plan, llm_str, openai_api_key) if section_review else None
 
     def solve(self):
         num_attempts = 0
@@ -273,10 +289,12 @@ class PaperSolver:
         self.prev_paper_ret = None
         while True:
             self.paper_lines = copy(random.choice(self.best_report)[0])
+            paper_changes = str()
+            if self.paper_context is not None: paper_changes = self.paper_context.render(self.paper_lines) + "\n"
             model_resp = query_model(
                 model_str=self.model,
                 system_prompt=self.system_prompt(),
-                prompt=f"\nNow please enter a command: ",
+                prompt=f"\n{paper_changes}Now please enter a command: ",
                 temp=1.0,
                 openai_api_key=self.openai_api_key)
             model_resp = self.clean_text(model_resp)
@@ -328,74 +346,128 @@ class PaperSolver:
         return text
 
     def gen_initial_report(self):
-        num_attempts = 0
-        arx = ArxivSearch()
-        section_scaffold = str()
-        #  1. Abstract 2. Introduction, 3. Background, 4. Methods, 5. Experimental Setup 6. Results, and 7. Discussion
-        for _section in ["scaffold", "abstract", "introduction", "related work", "background", "methods", "experimental setup", "results", "discussion"]:
-            section_complete = False
-            if _section in ["introduction", "related work", "background", "methods", "discussion"]:
-                attempts = 0
-                papers = str()
-                first_attempt = True
-                while len(papers) == 0:
-                    att_str = str()
-                    if attempts > 5:
-                        break
-                    if not first_attempt:
-                        att_str = "This is not your first attempt please try to come up with a simpler search query."
-                    search_query = query_model(model_str=f"{self.llm_str}", prompt=f"Given the following research topic {self.topic} and research plan: \n\n{self.plan}\n\nPlease come up with a search query to find relevant papers on arXiv. Respond only with the search query and nothing else. This should be a a string that will be used to find papers with semantically similar content. {att_str}", system_prompt=f"You are a research paper finder. You must find papers for the section {_section}. Query must be text nothing else.", openai_api_key=self.openai_api_key)
-                    search_query.replace('"', '')
-                    papers = arx.find_papers_by_str(query=search_query, N=10)
-                    first_attempt = False
-                    attempts += 1
-                if len(papers) != 0:
-                    self.section_related_work[_section] = papers
-            while not section_complete:
-                section_scaffold_temp = copy(section_scaffold)
-                if num_attempts == 0: err = str()
-                else: err = f"The following was the previous command generated: {model_resp}. This was the error return {cmd_str}. You should make sure not to repeat this error and to solve the presented problem."
-                if _section == "scaffold":
-                    prompt = f"{err}\nNow please enter the ```REPLACE command to create the scaffold:\n "
-                else:
-                    rp = str()
-                    if _section in self.section_related_work:
-                        rp = f"Here are related papers you can cite: {self.section_related_work[_section]}. You can cite them just by putting the arxiv ID in parentheses, e.g. (arXiv 2308.11483v1)\n"
-                    prompt = f"{err}\n{rp}\nNow please enter the ```REPLACE command to create the designated section, make sure to only write the text for that section and nothing else. Do not include packages or section titles, just the section content:\n "
-                model_resp = query_model(
-                    model_str=self.model,
-                    system_prompt=self.system_prompt(section=_section),
-                    prompt=f"{prompt}",
-                    temp=0.8,
-                    openai_api_key=self.openai_api_key)
-                model_resp = self.clean_text(model_resp)
-                if _section == "scaffold":
-                    # minimal scaffold (some other sections can be combined)
-                    for _sect in ["[ABSTRACT HERE]", "[INTRODUCTION HERE]", "[METHODS HERE]", "[RESULTS HERE]", "[DISCUSSION HERE]"]:
-                        if _sect not in model_resp:
-                            cmd_str = "Error: scaffold section placeholders were not present (e.g. [ABSTRACT HERE])."
-                            if not self.supress_print: print("@@@ INIT ATTEMPT:", cmd_str)
-                            continue
-                elif _section != "scaffold":
-                    new_text = extract_prompt(model_resp, "REPLACE")
-                    section_scaffold_temp = section_scaffold_temp.replace(f"[{_section.upper()} HERE]", new_text)
-                    model_resp = '```REPLACE\n' + copy(section_scaffold_temp) + '\n```'
-                    if "documentclass{article}" in new_text or "usepackage{" in new_text:
-                            cmd_str = "Error: You must not include packages or documentclass in the text! Your latex must only include the section text, equations, and tables."
-                            if not self.supress_print: print("@@@ INIT ATTEMPT:", cmd_str)
-                            continue
-                cmd_str, latex_lines, prev_latex_ret, score = self.process_command(model_resp, scoring=False)
-                if not self.supress_print: print(f"@@@ INIT ATTEMPT: Command Exec // Attempt {num_attempts}: ", str(cmd_str).replace("\n", " | "))
-                #print(f"$$$ Score: {score}")
-                if score is not None:
-                    section_complete = True
-                    section_scaffold = "\n".join(latex_lines)
-                num_attempts += 1
-            self.paper_lines = section_scaffold.split("\n")
-            if not self.supress_print: print("$"*10, f"SCAFFOLD [{_section}] CREATED", "$"*10)
+        """
+        Draft the initial paper. The related-work searches start first and run while the scaffold is written, then
+        every section is drafted concurrently against the scaffold and the drafts are merged into its placeholders
+        @return: (tuple) merged paper lines, latex return and score
+        """
+        from logger import get_logger
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=MAX_SECTION_WORKERS) as executor:
+            # searches only need the topic and plan; submitted first, they start before any draft waits on them
+            arx = ArxivSearch()
+            searches = {_section: executor.submit(self.find_related_work, _section, arx) for _section in CITING_SECTIONS}
+            scaffold = self.gen_scaffold()
+            self.paper_lines = Document.from_text(scaffold)
+
+            def _draft(section):
+                if section in searches and searches[section].result():
+                    self.section_related_work[section] = searches[section].result()
+                return self.draft_section(section, scaffold)
+            drafts = {_section: executor.submit(_draft, _section) for _section in PAPER_SECTIONS}
+            drafts = {_section: _future.result()[0] for _section, _future in drafts.items()}
+        merged = scaffold
+        for _section in PAPER_SECTIONS:
+            merged = merged.replace(f"[{_section.upper()} HERE]", drafts[_section])
+        cmd_str, latex_lines, prev_latex_ret, score = self.process_command(f"```REPLACE\n{merged}\n```", scoring=False)
+        if score is None:
+            # each draft compiled on its own, merge them one at a time and redraft the one breaking the paper
+            if not self.supress_print: print("@@@ MERGED DRAFT FAILED:", str(cmd_str).replace("\n", " | "))
+            merged = scaffold
+            for _section in PAPER_SECTIONS:
+                candidate = merged.replace(f"[{_section.upper()} HERE]", drafts[_section])
+                cmd_str, latex_lines, prev_latex_ret, score = self.process_command(f"```REPLACE\n{candidate}\n```", scoring=False)
+                if score is None:
+                    self.paper_lines = Document.from_text(merged)
+                    drafts[_section], (latex_lines, prev_latex_ret, score) = self.draft_section(_section, merged)
+                merged = "\n".join(latex_lines)
+        self.paper_lines = Document.from_text("\n".join(latex_lines))
+        get_logger().metric("papersolver_initial_draft_time", time.monotonic() - start, "seconds")
         if not self.supress_print: print("$"*10, "SCAFFOLD CREATED", "$"*10)
         return latex_lines, prev_latex_ret, score
 
+    def find_related_work(self, section, arx=None):
+        """
+        Search arXiv for papers a section can cite, with simpler queries after an empty search
+        @param section: (str) section name
+        @param arx: (ArxivSearch) search shared by concurrent calls, arXiv requests are spaced across all of them
+        @return: (str) paper summaries, empty if every search failed
+        """
+        if arx is None: arx = ArxivSearch()
+        papers = str()
+        for _attempt in range(6):
+            att_str = str()
+            if _attempt > 0:
+                att_str = "This is not your first attempt please try to come up with a simpler search query."
+            search_query = query_model(model_str=f"{self.llm_str}", prompt=f"Given the following research topic {self.topic} and research plan: \n\n{self.plan}\n\nPlease come up with a search query to find relevant papers on arXiv. Respond only with the search query and nothing else. This should be a a string that will be used to find papers with semantically similar content. {att_str}", system_prompt=f"You are a research paper finder. You must find papers for the section {section}. Query must be text nothing else.", openai_api_key=self.openai_api_key)
+            papers = arx.find_papers_by_str(query=search_query.replace('"', ''), N=10)
+            if papers: break
+        return papers or str()
+
+    def gen_scaffold(self):
+        """
+        Generate the paper scaffold, retrying until it compiles and holds the section placeholders
+        @return: (str) scaffold latex
+        """
+        num_attempts = 0
+        while True:
+            if num_attempts == 0: err = str()
+            else: err = f"The following was the previous command generated: {model_resp}. This was the error return {cmd_str}. You should make sure not to repeat this error and to solve the presented problem."
+            model_resp = query_model(
+                model_str=self.model,
+                system_prompt=self.system_prompt(section="scaffold"),
+                prompt=f"{err}\nNow please enter the ```REPLACE command to create the scaffold:\n ",
+                temp=0.8,
+                openai_api_key=self.openai_api_key)
+            model_resp = self.clean_text(model_resp)
+            num_attempts += 1
+            # minimal scaffold (some other sections can be combined)
+            if any(_sect not in model_resp for _sect in ["[ABSTRACT HERE]", "[INTRODUCTION HERE]", "[METHODS HERE]", "[RESULTS HERE]", "[DISCUSSION HERE]"]):
+                cmd_str = "Error: scaffold section placeholders were not present (e.g. [ABSTRACT HERE])."
+                if not self.supress_print: print("@@@ INIT ATTEMPT:", cmd_str)
+                continue
+            with _latex_lock:
+                cmd_str, latex_lines, prev_latex_ret, score = self.process_command(model_resp, scoring=False)
+            if not self.supress_print: print(f"@@@ INIT ATTEMPT: Command Exec // Attempt {num_attempts}: ", str(cmd_str).replace("\n", " | "))
+            if score is not None:
+                if not self.supress_print: print("$"*10, "SCAFFOLD [scaffold] CREATED", "$"*10)
+                return "\n".join(latex_lines)
+
+    def draft_section(self, section, scaffold):
+        """
+        Draft one section into its placeholder of the scaffold, retrying until the latex compiles
+        @param section: (str) section name
+        @param scaffold: (str) latex holding the [SECTION HERE] placeholder of the section
+        @return: (tuple) section latex and the (paper lines, latex return, score) of the scaffold holding it
+        """
+        num_attempts = 0
+        while True:
+            if num_attempts == 0: err = str()
+            else: err = f"The following was the previous command generated: {model_resp}. This was the error return {cmd_str}. You should make sure not to repeat this error and to solve the presented problem."
+            rp = str()
+            if section in self.section_related_work:
+                rp = f"Here are related papers you can cite: {self.section_related_work[section]}. You can cite them just by putting the arxiv ID in parentheses, e.g. (arXiv 2308.11483v1)\n"
+            model_resp = query_model(
+                model_str=self.model,
+                system_prompt=self.system_prompt(section=section),
+                prompt=f"{err}\n{rp}\nNow please enter the ```REPLACE command to create the designated section, make sure to only write the text for that section and nothing else. Do not include packages or section titles, just the section content:\n ",
+                temp=0.8,
+                openai_api_key=self.openai_api_key)
+            model_resp = self.clean_text(model_resp)
+            num_attempts += 1
+            new_text = extract_prompt(model_resp, "REPLACE")
+            if "documentclass{article}" in new_text or "usepackage{" in new_text:
+                cmd_str = "Error: You must not include packages or documentclass in the text! Your latex must only include the section text, equations, and tables."
+                if not self.supress_print: print("@@@ INIT ATTEMPT:", cmd_str)
+                continue
+            paper = scaffold.replace(f"[{section.upper()} HERE]", new_text)
+            with _latex_lock:
+                cmd_str, latex_lines, prev_latex_ret, score = self.process_command(f"```REPLACE\n{paper}\n```", scoring=False)
+            if not self.supress_print: print(f"@@@ INIT ATTEMPT [{section}]: Command Exec // Attempt {num_attempts}: ", str(cmd_str).replace("\n", " | "))
+            if score is not None:
+                if not self.supress_print: print("$"*10, f"SCAFFOLD [{section}] CREATED", "$"*10)
+                return new_text, (latex_lines, prev_latex_ret, score)
+
     def process_command(self, model_resp, scoring=True):
         """
         Take command from language model and execute if valid
@@ -429,8 +501,10 @@ class PaperSolver:
                         if not success: pass
                         else:
                             paper_lines = copy(args[1]) #
-                            if scoring:
-                                score, cmd_str, is_valid = get_score(self.plan, "\n".join(paper_lines), reward_model_llm=self.llm_str)
+                            if scoring and self.section_reviewer is not None:
+                                score, cmd_str, is_valid = self.section_reviewer.get_score(Document.coerce(paper_lines).text)
+                            elif scoring:
+                                score, cmd_str, is_valid = get_score(self.plan, Document.coerce(paper_lines).text, reward_model_llm=self.llm_str)
                             else:
                                 score, cmd_str, is_valid = 0.0, "Paper scored successfully", True
                             if is_valid: failed = False
@@ -438,6 +512,8 @@ class PaperSolver:
                         if not self.supress_print: print("$$$$ PAPER EDIT (success)")
                     if failed:
                         cmd_str = f"Paper edit FAILED due to the following error: {paper_err}.  Paper was reverted back to original state before edits."
+                        # the line numbers may have been read from the wrong version
+                        if self.paper_context is not None: self.paper_context.resync()
                         if not self.supress_print: print("$$$$ PAPER EDIT (failed)")
                     else:
                         cmd_str = "Paper was successfully edited."
@@ -452,7 +528,7 @@ class PaperSolver:
                     if success:
                         paper_lines = copy(args[0]) #
                         if scoring:
-                            score, cmd_str, is_valid = get_score(self.plan, "\n".join(paper_lines), reward_model_llm=self.llm_str)
+                            score, cmd_str, is_valid = get_score(self.plan, Document.coerce(paper_lines).text, reward_model_llm=self.llm_str)
                         else:
                             score, cmd_str, is_valid = 0.0, "Paper scored successfully", True
                         if is_valid: failed = False
@@ -474,8 +550,8 @@ class PaperSolver:
         @return: (str) code lines formatted with line numbers
         """
         codestr = str()
-        for _index in range(len(code)):
-            codestr += f"{_index} |{code[_index]}\n"
+        for _index, _line in enumerate(code):
+            codestr += f"{_index} |{_line}\n"
         return codestr
 
     def system_prompt(self, commands=True, section=None):
@@ -520,6 +596,10 @@ class PaperSolver:
             refpapers = '\n'.join(self.ref_papers)
             ref_papers = f"Here is a reference paper that is high quality:\n{refpapers}\n\n\n"
         lit_review_str = str(self.lit_review)[:20000]
+        if self.paper_context is not None and self.paper_context.reference is not None:
+            # unchanged until it is re-sent, the turn's prompt holds the changes against it
+            paper_listing = f"as listed at the start of this session:\n{self.paper_context.listing()}"
+        else: paper_listing = self.generate_paper_lines(self.paper_lines)
         return (
             f"{ref_papers}"
             # ROLE DESCRIPTION
@@ -544,7 +624,7 @@ class PaperSolver:
             # COMMAND SET
             f"{cmd_set}\n"
             # PAPER
-            f"Provided here is your current paper {self.generate_paper_lines(self.paper_lines)}"
+            f"Provided here is your current paper {paper_listing}"
             # optional section command
             f"{section_cmd}"
         )
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+PDF Text Extraction
+Shared extraction engine for arXiv full texts, AgentRxiv papers and uploads.
+
+Pages are extracted in order and extraction stops as soon as the character
+budget is reached. Large documents are split into page ranges that are
+extracted by a process pool, and every document can be given a timeout.
+
+The pool is shared by every thread of the process (Flask requests and
+parallel labs). A timed-out document cannot interrupt its stuck worker, so
+the pool it used is retired: new documents get a fresh pool, and the retired
+one is terminated once the last document still extracting with it is done.
+"""
+import io
+import os
+import time
+import threading
+import multiprocessing
+from typing import List, Optional, Union
+
+# Documents with at least this many pages are farmed out to the process pool
+PARALLEL_PAGE_THRESHOLD = 24
+# Number of pages handed to a pool worker at a time
+PAGES_PER_CHUNK = 8
+# Upper bound on pool size, the pool never exceeds the number of cores
+MAX_WORKERS = 4
+
+PdfSource = Union[str, bytes, os.PathLike]
+
+_POOL = None
+_POOL_SIZE = 0
+# documents extracting with each pool, current or retired
+_POOL_USERS = {}
+_POOL_LOCK = threading.Lock()
+
+
+class PdfExtractionError(Exception):
+    """Raised when a PDF cannot be opened or a page fails to extract."""
+
+
+class PdfExtractionTimeout(PdfExtractionError):
+    """Raised when extraction exceeds the per-document timeout."""
+
+
+def _open_reader(source: PdfSource):
+    """Open a pypdf reader over a file path or raw PDF bytes."""
+    from pypdf import PdfReader
+    if isinstance(source, (bytes, bytearray)):
+        return PdfReader(io.BytesIO(source))
+    return PdfReader(source)
+
+
+def _format_page(page_number: int, text: Optional[str], page_markers: bool) -> str:
+    if page_markers:
+        return f"--- Page {page_number} ---{text or ''}\n"
+    return text or ""
+
+
+def _extract_page_range(source: PdfSource, start: int, stop: int, page_markers: bool) -> List[str]:
+    """
+    Extract pages [start, stop) of a document. Runs inside pool workers, so
+    the reader is opened per call rather than shipped between processes.
+    """
+    reader = _open_reader(source)
+    return [
+        _format_page(index + 1, reader.pages[index].extract_text(), page_markers)
+        for index in range(start, min(stop, len(reader.pages)))
+    ]
+
+
+def _acquire_pool(workers: int):
+    """The current pool, started or resized if needed, counted as used until ``_release_pool``."""
+    global _POOL, _POOL_SIZE
+    retired = None
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_SIZE != workers:
+            if _POOL is not None and not _POOL_USERS.get(_POOL):
+                retired = _POOL
+                _POOL_USERS.pop(retired, None)
+            _POOL = multiprocessing.Pool(processes=workers)
+            _POOL_SIZE = workers
+        pool = _POOL
+        _POOL_USERS[pool] = _POOL_USERS.get(pool, 0) + 1
+    if retired is not None:
+        _terminate(retired)
+    return pool
+
+
+def _release_pool(pool, discard: bool = False):
+    """
+    Stop using a pool. ``discard`` retires it so new documents get a fresh
+    pool; a retired pool is terminated when its last user releases it.
+    """
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        if discard and pool is _POOL:
+            _POOL = None
+            _POOL_SIZE = 0
+        if pool not in _POOL_USERS:
+            # already terminated by shutdown_pool
+            return
+        _POOL_USERS[pool] -= 1
+        idle = _POOL_USERS[pool] == 0 and pool is not _POOL
+        if idle:
+            del _POOL_USERS[pool]
+    if idle:
+        _terminate(pool)
+
+
+def _terminate(pool):
+    pool.terminate()
+    pool.join()
+
+
+def shutdown_pool():
+    """Terminate the shared extraction pool, if one was started."""
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        pool = _POOL
+        _POOL = None
+        _POOL_SIZE = 0
+        if pool is not None:
+            _POOL_USERS.pop(pool, None)
+    if pool is not None:
+        _terminate(pool)
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise PdfExtractionTimeout("PDF extraction exceeded its timeout")
+    return remaining
+
+
+def _extract_serial(reader, max_chars, deadline, page_markers) -> str:
+    parts = []
+    length = 0
+    for index, page in enumerate(reader.pages):
+        _remaining(deadline)
+        text = _format_page(index + 1, page.extract_text(), page_markers)
+        parts.append(text)
+        length += len(text)
+        if max_chars is not None and length >= max_chars:
+            break
+    return "".join(parts)
+
+
+def _extract_parallel(source, num_pages, max_chars, deadline, page_markers, workers) -> str:
+    pool = _acquire_pool(workers)
+    chunks = [(start, start + PAGES_PER_CHUNK) for start in range(0, num_pages, PAGES_PER_CHUNK)]
+    # keep a bounded window of chunks in flight so a small budget does not
+    # pay for extracting the whole document
+    window = workers * 2
+    pending = []
+    parts = []
+    length = 0
+    next_chunk = 0
+    timed_out = False
+    try:
+        while next_chunk < len(chunks) or pending:
+            while next_chunk < len(chunks) and len(pending) < window:
+                start, stop = chunks[next_chunk]
+                pending.append(pool.apply_async(_extract_page_range, (source, start, stop, page_markers)))
+                next_chunk += 1
+            result = pending.pop(0)
+            try:
+                pages = result.get(timeout=_remaining(deadline))
+            except multiprocessing.TimeoutError:
+                raise PdfExtractionTimeout("PDF extraction exceeded its timeout")
+            for text in pages:
+                parts.append(text)
+                length += len(text)
+            if max_chars is not None and length >= max_chars:
+                break
+    except PdfExtractionTimeout:
+        # a stuck page cannot be interrupted, so the workers are retired
+        timed_out = True
+        raise
+    finally:
+        _release_pool(pool, discard=timed_out)
+    return "".join(parts)
+
+
+def extract_text(
+    source: PdfSource,
+    max_chars: Optional[int] = None,
+    timeout: Optional[float] = None,
+    page_markers: bool = False,
+    parallel: bool = True,
+) -> str:
+    """
+    Extract the text of a PDF.
+
+    Args:
+        source: Path to a PDF file or the raw PDF bytes
+        max_chars: Character budget, extraction stops once it is reached and
+            the result is truncated to it
+        timeout: Per-document timeout in seconds
+        page_markers: Prefix every page with ``--- Page N ---``
+        parallel: Allow large documents to be extracted by the process pool
+
+    Returns:
+        Extracted text
+
+    Raises:
+        PdfExtractionTimeout: If the document takes longer than ``timeout``
+        PdfExtractionError: If the document cannot be read
+    """
+    if isinstance(source, os.PathLike):
+        source = os.fspath(source)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    try:
+        reader = _open_reader(source)
+        num_pages = len(reader.pages)
+        workers = min(MAX_WORKERS, os.cpu_count() or 1)
+        # only worth it when the budget is likely to need more than a chunk
+        budget_pages = num_pages if max_chars is None else max_chars // 1000 + 1
+        if parallel and workers > 1 and num_pages >= PARALLEL_PAGE_THRESHOLD and budget_pages > PAGES_PER_CHUNK:
+            text = _extract_parallel(source, num_pages, max_chars, deadline, page_markers, workers)
+        else:
+            text = _extract_serial(reader, max_chars, deadline, page_markers)
+    except PdfExtractionError:
+        raise
+    except Exception as e:
+        raise PdfExtractionError(f"Failed to extract PDF text: {e}") from e
+    return text if max_chars is None else text[:max_chars]
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Program Pre-flight Check
+Static checks tools.execute_code runs before a program reaches the sandbox.
+
+Syntax errors, calls to exit() and names that are bound nowhere (neither in
+the program, the dataset code it runs after, ``utils`` nor builtins) are
+reported without starting a process or loading the dataset. Errors are
+formatted like compiler diagnostics, with the offending line and a caret,
+so the repair prompt can locate them in the code.
+
+Name resolution is deliberately loose: a name bound anywhere in the program
+counts as defined everywhere, and programs that use star imports of unknown
+modules, ``exec``/``eval`` or ``globals()`` are not checked for undefined
+names at all, nor are names read inside a ``try`` that catches NameError,
+so valid programs are not rejected.
+"""
+import ast
+import sys
+import builtins
+from functools import lru_cache
+from typing import FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+ERROR_PREFIX = "[CODE EXECUTION ERROR]"
+# Calls that would end the sandbox run instead of the experiment
+FORBIDDEN_CALLS = {"exit", "quit", "sys.exit", "os._exit"}
+# Modules whose star import the check can resolve
+RESOLVABLE_STAR_IMPORTS = {"utils"}
+# Reported issues per program, the first ones are what the repair needs
+MAX_ISSUES = 5
+
+# Using any of these can bind names the check cannot see
+_DYNAMIC_NAMES = {"exec", "eval", "globals", "locals"}
+# Handlers that catch a NameError raised in their try block
+_NAME_ERROR_HANDLERS = {"NameError", "Exception", "BaseException"}
+_TRY_NODES = tuple(getattr(ast, name) for name in ("Try", "TryStar") if hasattr(ast, name))
+_MATCH_NODES = tuple(getattr(ast, name) for name in ("MatchAs", "MatchStar", "MatchMapping") if hasattr(ast, name))
+_BUILTIN_NAMES = frozenset(dir(builtins))
+_MODULE_NAMES = {"__name__", "__file__", "__doc__", "__builtins__", "__spec__", "__loader__", "__package__",
+                 "__annotations__"}
+
+
+class Issue(NamedTuple):
+    """One problem found in a program; ``line`` is 1-based, ``col`` 0-based."""
+    line: int
+    col: int
+    length: int
+    kind: str
+    message: str
+
+
+class _Bindings:
+    """
+    Every name a module binds in any scope, the names it reads outside of
+    NameError-catching ``try`` blocks, and its calls to forbidden functions,
+    collected in a single pass over the tree.
+    """
+
+    def __init__(self, tree: ast.AST):
+        self.bound: Set[str] = set()
+        self.loads: List[ast.Name] = []
+        self.star_imports: List[str] = []
+        self.forbidden_calls: List[Tuple[ast.Call, str]] = []
+        self.dynamic = False
+        guarded = []
+        for node in ast.walk(tree):
+            kind = type(node)
+            if kind is ast.Name:
+                if type(node.ctx) is ast.Load:
+                    self.loads.append(node)
+                    if node.id in _DYNAMIC_NAMES:
+                        self.dynamic = True
+                else:
+                    self.bound.add(node.id)
+            elif kind is ast.Call:
+                name = _dotted_name(node.func)
+                if name in FORBIDDEN_CALLS:
+                    self.forbidden_calls.append((node, name))
+            elif kind is ast.arg:
+                self.bound.add(node.arg)
+            elif kind in (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef):
+                self.bound.add(node.name)
+            elif kind is ast.Import:
+                self.bound.update(alias.asname or alias.name.split(".")[0] for alias in node.names)
+            elif kind is ast.ImportFrom:
+                for alias in node.names:
+                    if alias.name == "*":
+                        self.star_imports.append(node.module or "")
+                    else:
+                        self.bound.add(alias.asname or alias.name)
+            elif kind in (ast.Global, ast.Nonlocal):
+                self.bound.update(node.names)
+            elif kind in _TRY_NODES:
+                if any(_catches_name_error(handler) for handler in node.handlers) and node.body:
+                    guarded.append(((node.body[0].lineno, node.body[0].col_offset),
+                                    (node.body[-1].end_lineno, node.body[-1].end_col_offset)))
+            elif kind is ast.ExceptHandler or kind in _MATCH_NODES:
+                name = getattr(node, "name", None) or getattr(node, "rest", None)
+                if name:
+                    self.bound.add(name)
+        if guarded:
+            self.loads = [node for node in self.loads
+                          if not any(start <= (node.lineno, node.col_offset) < end for start, end in guarded)]
+
+
+def _catches_name_error(handler: ast.ExceptHandler) -> bool:
+    if handler.type is None:
+        return True
+    caught = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+    return any(isinstance(t, ast.Name) and t.id in _NAME_ERROR_HANDLERS for t in caught)
+
+
+@lru_cache(maxsize=None)
+def _module_exports(module_name: str) -> FrozenSet[str]:
+    module = sys.modules.get(module_name)
+    if module is None:
+        import importlib
+        module = importlib.import_module(module_name)
+    exported = getattr(module, "__all__", None)
+    if exported is None:
+        exported = [name for name in vars(module) if not name.startswith("_")]
+    return frozenset(exported)
+
+
+def _resolve_star_imports(modules: List[str]) -> Optional[Set[str]]:
+    names = set()
+    for module_name in modules:
+        if module_name not in RESOLVABLE_STAR_IMPORTS:
+            return None
+        try:
+            names |= _module_exports(module_name)
+        except Exception:
+            return None
+    return names
+
+
+@lru_cache(maxsize=16)
+def _prelude_names(prelude: str) -> Optional[FrozenSet[str]]:
+    """Names the dataset code defines, or None when they cannot be determined."""
+    try:
+        tree = ast.parse(prelude)
+    except SyntaxError:
+        return None
+    bindings = _Bindings(tree)
+    star_names = _resolve_star_imports(bindings.star_imports)
+    if star_names is None or bindings.dynamic:
+        return None
+    return frozenset(bindings.bound | star_names)
+
+
+def _dotted_name(node: ast.AST) -> str:
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return f"{_dotted_name(node.value)}.{node.attr}"
+    return ""
+
+
+def defined_names(code: str, prelude: Optional[str] = None) -> Optional[FrozenSet[str]]:
+    """
+    Every name a program can read: builtins and the names bound by the
+    program, its star imports and ``prelude``.
+
+    Returns:
+        The names, or None when the program does not parse or its names
+        cannot be determined statically
+    """
+    try:
+        bindings = _Bindings(ast.parse(code))
+    except SyntaxError:
+        return None
+    prelude_names = frozenset() if prelude is None else _prelude_names(prelude)
+    star_names = _resolve_star_imports(bindings.star_imports)
+    if prelude_names is None or star_names is None or bindings.dynamic:
+        return None
+    return _BUILTIN_NAMES | _MODULE_NAMES | bindings.bound | prelude_names | star_names
+
+
+def find_issues(code: str, prelude: Optional[str] = None) -> List[Issue]:
+    """
+    Statically check a program.
+
+    Args:
+        code: Program text
+        prelude: Code that runs before ``code`` in the same namespace, e.g.
+            the dataset code
+
+    Returns:
+        Problems in source order, at most MAX_ISSUES of them
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        lineno = e.lineno or 1
+        col = max(0, (e.offset or 1) - 1)
+        length = max(1, (e.end_offset or 0) - (e.offset or 0)) if e.end_lineno in (None, lineno) else 1
+        return [Issue(lineno, col, length, type(e).__name__, e.msg)]
+
+    bindings = _Bindings(tree)
+    issues = [Issue(node.lineno, node.col_offset, len(name), "ForbiddenCall",
+                    f"{name}() is not allowed, you must remove it") for node, name in bindings.forbidden_calls]
+    known = _BUILTIN_NAMES | _MODULE_NAMES | bindings.bound
+    prelude_names = frozenset() if prelude is None else _prelude_names(prelude)
+    star_names = _resolve_star_imports(bindings.star_imports)
+    if prelude_names is not None and star_names is not None and not bindings.dynamic:
+        known |= prelude_names | star_names
+        reported = set()
+        for node in bindings.loads:
+            if node.id not in known and node.id not in reported:
+                reported.add(node.id)
+                issues.append(Issue(node.lineno, node.col_offset, len(node.id), "NameError",
+                                    f"name '{node.id}' is not defined"))
+    issues.sort(key=lambda issue: (issue.line, issue.col))
+    return issues[:MAX_ISSUES]
+
+
+def format_issues(code: str, issues: List[Issue]) -> str:
+    """
+    Render issues as compiler-style diagnostics.
+
+    Args:
+        code: Program text the issues refer to
+        issues: Issues from ``find_issues``
+
+    Returns:
+        Error report starting with ``[CODE EXECUTION ERROR]``
+    """
+    lines = code.split("\n")
+    report = [f"{ERROR_PREFIX}: The program was rejected before running, fix these errors:"]
+    for issue in issues:
+        report.append(f"line {issue.line}:{issue.col + 1}: {issue.kind}: {issue.message}")
+        if 0 < issue.line <= len(lines):
+            source = lines[issue.line - 1]
+            indent = len(source) - len(source.lstrip())
+            report.append("    " + source.strip())
+            report.append("    " + " " * max(0, issue.col - indent) + "^" * issue.length)
+    return "\n".join(report) + "\n"
+
+
+def check_program(code: str, prelude: Optional[str] = None) -> Optional[str]:
+    """
+    Pre-flight a program.
+
+    Args:
+        code: Program text
+        prelude: Code that runs before ``code`` in the same namespace
+
+    Returns:
+        Compiler-style error report, or None if the program may run
+    """
+    issues = find_issues(code, prelude)
+    return format_issues(code, issues) if issues else None
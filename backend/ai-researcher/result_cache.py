@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Execution Result Cache
+Bounded on-disk memo of sandbox runs for tools.execute_code.
+
+MLESolver's repair loop and candidate search often execute byte-identical
+programs. A run is keyed by the full program text, the working directory,
+the Python and library versions, the seeds the program sets and the run's
+limits, and its output, resource usage and the files it wrote to the working
+directory are stored, so a repeat returns the same result and leaves the
+same files behind without running again.
+
+Programs that read the clock, or draw random numbers without setting a seed,
+are never cached.
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# Default location of the cache, shared by every run started from this directory
+DEFAULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "result_cache.db")
+# Least recently used results are dropped once the cache holds more than this ...
+MAX_CACHE_BYTES = int(os.getenv("RESULT_CACHE_MAX_MB", "256")) * 1024 * 1024
+# ... or more results than this
+MAX_CACHE_ENTRIES = 2000
+# Runs that wrote more than this to the working directory are not cached
+MAX_FILE_BYTES = 32 * 1024 * 1024
+
+# Databases in the working directory are written by other threads, not by the run
+_IGNORED_SUFFIXES = (".db", ".db-wal", ".db-shm", ".db-journal")
+
+# Libraries whose version changes what a program computes
+VERSIONED_LIBRARIES = ["numpy", "scipy", "pandas", "scikit-learn", "torch", "datasets", "transformers"]
+
+# Reading any of these makes a program's output depend on when it ran
+_CLOCK_PATTERN = re.compile(
+    r"\b(time\.(time|time_ns|perf_counter|perf_counter_ns|monotonic|process_time|ctime|localtime|gmtime)"
+    r"|datetime\.(now|today|utcnow)|date\.today|uuid[14]|os\.urandom|secrets\.)")
+# Sources of randomness: stdlib/numpy/torch sampling and estimators that shuffle or initialize randomly
+_RANDOM_PATTERN = re.compile(
+    r"\b(random\.\w+|np\.random\.\w+|numpy\.random\.\w+|torch\.(rand\w*|normal|bernoulli|multinomial)"
+    r"|torch\.nn|nn\.\w+|DataLoader|train_test_split|shuffle|sample|Random\w+|KMeans|MLP\w+|SGD\w*"
+    r"|Dropout|dropout|GradientBoosting\w+|permutation)\b")
+# Seeding calls; their text becomes part of the key
+_SEED_PATTERN = re.compile(
+    r"(\b(random\.seed|np\.random\.seed|numpy\.random\.seed|torch\.manual_seed|torch\.cuda\.manual_seed_all"
+    r"|set_seed|seed_everything|default_rng|RandomState)\s*\([^)]*\)|\brandom_state\s*=\s*\d+)")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    output TEXT,
+    stats TEXT,
+    size INTEGER,
+    created REAL,
+    used REAL
+);
+CREATE TABLE IF NOT EXISTS files (
+    key TEXT,
+    name TEXT,
+    data BLOB,
+    PRIMARY KEY (key, name)
+);
+CREATE INDEX IF NOT EXISTS results_used ON results(used);
+"""
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def seed_marker(program: str) -> str:
+    """The seeding calls a program makes, in order of appearance."""
+    return "|".join(re.sub(r"\s+", "", match.group(0)) for match in _SEED_PATTERN.finditer(program))
+
+
+def is_cacheable(program: str) -> bool:
+    """
+    Whether a program's result can be reused: it must not read the clock,
+    and any randomness it uses must be seeded.
+    """
+    if _CLOCK_PATTERN.search(program):
+        return False
+    return not _RANDOM_PATTERN.search(program) or bool(seed_marker(program))
+
+
+def library_versions(libraries: Iterable[str] = VERSIONED_LIBRARIES) -> Dict[str, Optional[str]]:
+    from importlib import metadata
+    versions = {}
+    for name in libraries:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def directory_state(path: str = ".") -> Dict[str, Tuple[int, int]]:
+    """Modification time and size of every file directly inside ``path``."""
+    state = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                info = entry.stat(follow_symlinks=False)
+                state[entry.name] = (info.st_mtime_ns, info.st_size)
+    return state
+
+
+def changed_files(before: Dict[str, Tuple[int, int]], path: str = ".",
+                  max_bytes: int = MAX_FILE_BYTES) -> Optional[Dict[str, bytes]]:
+    """
+    Files a run created or modified directly inside ``path``.
+
+    Returns:
+        File name to contents, or None when they add up to more than ``max_bytes``
+    """
+    files, total = {}, 0
+    for name, state in directory_state(path).items():
+        if before.get(name) == state or name.endswith(_IGNORED_SUFFIXES):
+            continue
+        total += state[1]
+        if total > max_bytes:
+            return None
+        try:
+            with open(os.path.join(path, name), "rb") as f:
+                files[name] = f.read()
+        except OSError:
+            return None
+    return files
+
+
+class ResultCache:
+    """
+    SQLite store of execution results, evicted least recently used first.
+    Safe to share between threads and between processes using the same file.
+
+    Args:
+        path: Database path
+        max_bytes: Total size of outputs and files kept
+        max_entries: Number of results kept
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = MAX_CACHE_BYTES,
+                 max_entries: int = MAX_CACHE_ENTRIES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._versions = None
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        if path != ":memory:":
+            # parallel labs share the file
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def key(self, program: str, path: str = ".", **options) -> str:
+        """
+        Cache key of a program.
+
+        Args:
+            program: Full program text, including any prelude
+            path: Directory the program runs in
+            options: Run settings that change the result, e.g. limits
+
+        Returns:
+            Hex digest
+        """
+        if self._versions is None:
+            self._versions = library_versions()
+        material = {
+            "program": program,
+            "cwd": os.path.abspath(path),
+            "python": sys.version,
+            "libraries": self._versions,
+            "seeds": seed_marker(program),
+            "options": options,
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str, path: str = ".") -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Look up a result and write the files the run produced back into ``path``.
+
+        Returns:
+            (output, stats) of the cached run, or None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT output, stats FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            files = self._conn.execute("SELECT name, data FROM files WHERE key = ?", (key,)).fetchall()
+            self._conn.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        for name, data in files:
+            with open(os.path.join(path, name), "wb") as f:
+                f.write(data)
+        return row[0], json.loads(row[1])
+
+    def put(self, key: str, output: str, stats: Dict[str, Any], files: Optional[Dict[str, bytes]] = None):
+        """
+        Store a result.
+
+        Args:
+            key: Key from ``key()``
+            output: Program output
+            stats: Resource usage of the run
+            files: Files the run wrote to the working directory
+        """
+        files = files or {}
+        size = len(output.encode()) + sum(len(data) for data in files.values())
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE key = ?", (key,))
+            self._conn.execute("INSERT OR REPLACE INTO results (key, output, stats, size, created, used) "
+                               "VALUES (?, ?, ?, ?, ?, ?)", (key, output, json.dumps(stats), size, now, now))
+            self._conn.executemany("INSERT INTO files (key, name, data) VALUES (?, ?, ?)",
+                                   [(key, name, data) for name, data in files.items()])
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM results ORDER BY used"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            count -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM files WHERE key = ?", evicted)
+        self._conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def get_result_cache(path: Optional[str] = None) -> ResultCache:
+    """
+    Get or create the shared result cache.
+
+    Args:
+        path: Database path, defaults to ``RESULT_CACHE_PATH`` or
+            ``result_cache.db`` in the working directory
+
+    Returns:
+        ResultCache instance
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(path or DEFAULT_CACHE_PATH)
+        return _cache
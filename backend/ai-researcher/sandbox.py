@@ -0,0 +1,1252 @@
+#!/usr/bin/env python3
+"""
+Code Sandbox
+Warm worker pool that executes agent-generated programs for tools.execute_code.
+
+Workers are forked from a zygote process that has already imported the heavy
+libraries generated code relies on (numpy, sklearn, datasets, torch, utils),
+so starting a run costs a pipe round trip instead of a fresh interpreter and
+its imports. The zygote is a plain single-threaded interpreter rather than a
+multiprocessing forkserver, so the caller's ``__main__`` is never re-imported.
+A worker never executes a program itself: it forks a child per program,
+which runs it in a fresh ``__main__`` namespace and exits, so modules a
+program changed, figures it left open and memory it held do not reach the
+next program. A worker is recycled after a fixed number of runs, when its
+memory has grown past a threshold, or when a run times out.
+
+Programs that share a prelude (the dataset code MLESolver prepends to every
+candidate) run in template workers instead: the template executes the prelude
+once and forks a child per program, which inherits the loaded variables
+copy-on-write. Templates are keyed by a hash of the prelude, so changing the
+dataset code starts a new template.
+
+Incremental runs split a program into top-level cells. The running child
+forks at every cell boundary, leaving a snapshot process behind that holds the
+namespace at that point. The next run of an edited program resumes from the
+snapshot of the longest unchanged prefix of cells instead of starting over.
+
+Programs write their output into a pipe that the caller drains while they
+run, into a buffer that keeps only the head and tail of the output, so a
+chatty program can neither fill the pipe nor the caller's memory.
+
+Every run reports its CPU time, peak memory and leftover child processes,
+and can be held to address-space, CPU-time and thread-count limits and
+pinned to a set of CPUs.
+"""
+import io
+import os
+import re
+import ast
+import sys
+import json
+import time
+import atexit
+import signal
+import socket
+import math
+import codecs
+import struct
+import resource
+import hashlib
+import threading
+import traceback
+import subprocess
+import multiprocessing
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import reduction
+from multiprocessing.connection import Connection, wait
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Modules imported once by the zygote and inherited by every worker,
+# modules that are not installed are skipped
+PRELOAD_MODULES = ["numpy", "sklearn", "datasets", "torch", "utils"]
+# Number of programs that may execute concurrently
+POOL_SIZE = int(os.getenv("SANDBOX_WORKERS", "2"))
+# Workers are replaced after this many runs ...
+MAX_RUNS_PER_WORKER = 25
+# ... or once their resident memory grew this much over their first run
+MAX_RSS_GROWTH = 1024 * 1024 * 1024
+# Time allowed for a freshly started worker to report ready
+WORKER_START_TIMEOUT = 120
+# Number of prelude templates kept alive, least recently used ones are stopped
+MAX_TEMPLATES = 2
+# Number of cell snapshots kept alive across all templates
+MAX_SNAPSHOTS = 12
+# Characters of output kept by default, the middle of longer output is cut
+OUTPUT_LIMIT = int(os.getenv("SANDBOX_OUTPUT_LIMIT", str(64 * 1024)))
+# Error report lines are kept even when they fall in the cut part of the output
+ERROR_MARKER = "[CODE EXECUTION ERROR]"
+MAX_PINNED_ERRORS = 3
+# Bytes read from an output pipe at a time
+_READ_SIZE = 64 * 1024
+# Default per-run limits: address space in bytes, CPU seconds and threads
+# used by OpenMP/BLAS/torch. None leaves the resource unlimited. A run may
+# also be pinned to a list of CPUs with a "cpus" limit
+DEFAULT_LIMITS = {
+    "memory": int(os.environ["SANDBOX_MEMORY_LIMIT_MB"]) * 1024 * 1024 if os.getenv("SANDBOX_MEMORY_LIMIT_MB") else None,
+    "cpu": int(os.environ["SANDBOX_CPU_LIMIT"]) if os.getenv("SANDBOX_CPU_LIMIT") else None,
+    "threads": int(os.environ["SANDBOX_THREADS"]) if os.getenv("SANDBOX_THREADS") else None,
+}
+# Environment variables read by thread pools started after the limit is applied
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+_pool = None
+_pool_lock = threading.Lock()
+# Working directory of the programs started by the current thread
+_run_directory = threading.local()
+
+
+class SandboxError(Exception):
+    """Raised when the sandbox cannot run a program."""
+
+
+class SandboxTimeout(SandboxError):
+    """Raised when a program exceeds its timeout."""
+
+
+class SandboxCrash(SandboxError):
+    """Raised when a worker dies while running a program."""
+
+
+class BoundedOutput(io.TextIOBase):
+    """
+    Text stream that keeps the first and last ``limit // 2`` characters
+    written to it. The middle is replaced by a truncation notice followed by
+    any ``[CODE EXECUTION ERROR]`` lines it contained.
+
+    Args:
+        limit: Maximum number of characters kept
+    """
+
+    def __init__(self, limit: int = OUTPUT_LIMIT):
+        self.limit = max(2, limit)
+        self.head_limit = self.limit // 2
+        self.tail_limit = self.limit - self.head_limit
+        self.truncated = 0
+        self._head: List[str] = []
+        self._head_len = 0
+        self._tail: deque = deque()
+        self._tail_len = 0
+        self._errors: List[str] = []
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        written = len(text)
+        if ERROR_MARKER in text and len(self._errors) < MAX_PINNED_ERRORS:
+            self._errors += re.findall(re.escape(ERROR_MARKER) + r"[^\n]{0,300}", text)[:MAX_PINNED_ERRORS]
+        room = self.head_limit - self._head_len
+        if room > 0:
+            self._head.append(text[:room])
+            self._head_len += len(self._head[-1])
+            text = text[room:]
+        if text:
+            self._tail.append(text)
+            self._tail_len += len(text)
+            excess = self._tail_len - self.tail_limit
+            while excess > 0:
+                chunk = self._tail[0]
+                cut = min(len(chunk), excess)
+                if cut == len(chunk):
+                    self._tail.popleft()
+                else:
+                    self._tail[0] = chunk[cut:]
+                self._tail_len -= cut
+                self.truncated += cut
+                excess -= cut
+        return written
+
+    def write_bytes(self, data: bytes):
+        """Write UTF-8 bytes read from a pipe, which may split characters."""
+        self.write(self._decoder.decode(data))
+
+    def getvalue(self) -> str:
+        head, tail = "".join(self._head), "".join(self._tail)
+        if not self.truncated:
+            return head + tail
+        notice = f"\n... [{self.truncated} characters of output truncated] ...\n"
+        errors = "".join(line + "\n" for line in self._errors if line not in head and line not in tail)
+        return head + notice + errors + tail
+
+
+def truncate_output(text: str, limit: int = OUTPUT_LIMIT) -> str:
+    """Cut the middle of ``text`` so that at most ``limit`` characters of it remain."""
+    output = BoundedOutput(limit)
+    output.write(text)
+    return output.getvalue()
+
+
+class OutputPipe:
+    """
+    Pipe a program writes its output into. The reading end is drained into a
+    BoundedOutput while the caller waits for the program, so the writer never
+    blocks on a full pipe and the caller holds at most ``limit`` characters.
+
+    Args:
+        limit: Maximum number of characters kept
+        prefix: Output that comes before what is written into the pipe
+    """
+
+    def __init__(self, limit: int = OUTPUT_LIMIT, prefix: str = ""):
+        self.reader, self.writer = multiprocessing.Pipe(duplex=False)
+        os.set_blocking(self.reader.fileno(), False)
+        self.output = BoundedOutput(limit)
+        self.output.write(prefix)
+        self._eof = False
+
+    def drain(self):
+        """Read everything currently in the pipe."""
+        while not self._eof:
+            try:
+                data = os.read(self.reader.fileno(), _READ_SIZE)
+            except BlockingIOError:
+                return
+            if not data:
+                self._eof = True
+            self.output.write_bytes(data)
+
+    def wait(self, ready, deadline: Optional[float]) -> bool:
+        """
+        Drain the pipe until ``ready`` (a Connection or process sentinel)
+        becomes readable.
+
+        Args:
+            ready: Object to wait for
+            deadline: ``time.monotonic()`` value to give up at, None to wait forever
+
+        Returns:
+            False if the deadline passed first
+        """
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            readable = wait([ready] + ([] if self._eof else [self.reader]), remaining)
+            if not readable:
+                return False
+            # output written before ``ready`` was signalled is already in the pipe
+            self.drain()
+            if ready in readable:
+                return True
+
+    def close_writer(self):
+        """Close this process's copy of the writing end once it was handed over."""
+        self.writer.close()
+
+    def getvalue(self) -> str:
+        return self.output.getvalue()
+
+    def close(self):
+        self.writer.close()
+        self.reader.close()
+
+
+@contextmanager
+def working_directory(path: str):
+    """
+    Run the programs started by the current thread in ``path`` instead of
+    the process's working directory, so concurrent callers don't share
+    their output files. Preludes still load in the process's directory.
+
+    Args:
+        path: Directory the programs run in
+    """
+    previous = getattr(_run_directory, "path", None)
+    _run_directory.path = os.path.abspath(path)
+    try:
+        yield
+    finally:
+        _run_directory.path = previous
+
+
+def run_directory() -> str:
+    """Directory the programs started by the current thread run in."""
+    return getattr(_run_directory, "path", None) or os.getcwd()
+
+
+def _output_stream(fd: int) -> io.TextIOWrapper:
+    # every print goes straight to the pipe, nothing is buffered in the program
+    return io.TextIOWrapper(io.FileIO(fd, "w"), encoding="utf-8", errors="replace", write_through=True)
+
+
+def _rss() -> int:
+    import psutil
+    return psutil.Process().memory_info().rss
+
+
+class CPUTimeLimitExceeded(Exception):
+    """Raised inside a program that used up its CPU-time limit."""
+
+
+def _cpu_times() -> Tuple[float, float]:
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + children.ru_utime, own.ru_stime + children.ru_stime
+
+
+def _peak_rss() -> int:
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux
+    return max(own.ru_maxrss, children.ru_maxrss) * 1024
+
+
+class _Usage:
+    """Resources used by the program running in this process."""
+
+    def __init__(self):
+        try:
+            # reset the peak RSS of a reused worker to its current RSS
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+        self.user, self.system, self.peak_rss = 0.0, 0.0, 0
+        self._start = _cpu_times()
+
+    def pause(self):
+        """Bank the usage so far, before a fork resets this process's counters."""
+        user, system = _cpu_times()
+        self.user += user - self._start[0]
+        self.system += system - self._start[1]
+        self.peak_rss = max(self.peak_rss, _peak_rss())
+
+    def resume(self):
+        self._start = _cpu_times()
+
+    def report(self) -> Dict[str, Any]:
+        import psutil
+        self.pause()
+        self.resume()
+        try:
+            children = len(psutil.Process().children(recursive=True))
+        except psutil.Error:
+            children = 0
+        return {"cpu_user": self.user, "cpu_system": self.system, "peak_rss": self.peak_rss, "children": children}
+
+
+def _cpu_limit_handler(signum, frame):
+    raise CPUTimeLimitExceeded("CPU time limit exceeded")
+
+
+def _apply_limits(limits: Dict[str, Optional[int]]):
+    """
+    Apply per-run limits to this process. Unset rlimits are raised back to
+    their hard limit, so a run never inherits the limits of an earlier one.
+
+    Returns:
+        Function restoring the previous limits
+    """
+    restore = []
+    for key, which in (("memory", resource.RLIMIT_AS), ("cpu", resource.RLIMIT_CPU)):
+        previous = resource.getrlimit(which)
+        soft = limits.get(key)
+        if soft is not None and which == resource.RLIMIT_CPU:
+            # the CPU rlimit counts from process start, a reused worker has used some already
+            soft = math.ceil(sum(_cpu_times())) + soft
+        if soft is not None and previous[1] != resource.RLIM_INFINITY:
+            soft = min(soft, previous[1])
+        try:
+            resource.setrlimit(which, (previous[1] if soft is None else soft, previous[1]))
+            restore.append(lambda which=which, previous=previous: resource.setrlimit(which, previous))
+        except (ValueError, OSError):
+            pass
+    if limits.get("cpu") is not None:
+        handler = signal.signal(signal.SIGXCPU, _cpu_limit_handler)
+        restore.append(lambda: signal.signal(signal.SIGXCPU, handler))
+    cpus = limits.get("cpus")
+    if cpus and hasattr(os, "sched_setaffinity"):
+        affinity = os.sched_getaffinity(0)
+        try:
+            os.sched_setaffinity(0, cpus)
+            restore.append(lambda: os.sched_setaffinity(0, affinity))
+        except OSError:
+            pass
+    threads = limits.get("threads")
+    if threads is None and cpus:
+        # one thread per CPU the run is pinned to
+        threads = len(cpus)
+    if threads is not None:
+        environ = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+        os.environ.update({name: str(threads) for name in THREAD_ENV_VARS})
+        restore.append(lambda: [os.environ.pop(name, None) if value is None else os.environ.__setitem__(name, value)
+                                for name, value in environ.items()])
+        try:
+            # thread pools of BLAS/OpenMP libraries that are already loaded
+            from threadpoolctl import threadpool_limits
+            restore.append(threadpool_limits(limits=threads).restore_original_limits)
+        except Exception:
+            pass
+        if "torch" in sys.modules:
+            torch = sys.modules["torch"]
+            torch_threads = torch.get_num_threads()
+            torch.set_num_threads(threads)
+            restore.append(lambda: torch.set_num_threads(torch_threads))
+
+    def _restore():
+        for undo in reversed(restore):
+            try:
+                undo()
+            except Exception:
+                pass
+    return _restore
+
+
+def _exec_capture(code_str: str, globals_dict: Dict[str, Any], stream) -> str:
+    """Run code in a namespace with stdout sent to ``stream``, returning "ok", "exit" or "error"."""
+    sys.stdout = stream
+    status = "ok"
+    try:
+        exec(code_str, globals_dict)
+    except SystemExit:
+        # exit() ends the program, not the worker
+        status = "exit"
+    except Exception as e:
+        status = "error"
+        try:
+            stream.write(f"{ERROR_MARKER}: {str(e)}\n")
+            traceback.print_exc(file=stream)
+        except OSError:
+            pass
+    finally:
+        sys.stdout = sys.__stdout__
+    return status
+
+
+def run_code_capture(code_str: str, limit: int = OUTPUT_LIMIT) -> str:
+    """
+    Execute a program in a fresh ``__main__`` namespace and return what it
+    printed, cut to ``limit`` characters. Exceptions are reported in the
+    output rather than raised.
+    """
+    output = BoundedOutput(limit)
+    # Create a globals dictionary with __name__ set to "__main__"
+    _exec_capture(code_str, {"__name__": "__main__"}, output)
+    return output.getvalue()
+
+
+def run_code_to_pipe(code_str: str, writer: Connection,
+                     limits: Optional[Dict[str, Optional[int]]] = None) -> Dict[str, Any]:
+    """
+    Execute a program in a fresh ``__main__`` namespace, writing its output
+    into the writing end of an OutputPipe as it is printed.
+
+    Returns:
+        CPU time, peak RSS and child process count of the run
+    """
+    restore = _apply_limits(DEFAULT_LIMITS if limits is None else limits)
+    usage = _Usage()
+    with _output_stream(os.dup(writer.fileno())) as stream:
+        _exec_capture(code_str, {"__name__": "__main__"}, stream)
+    report = usage.report()
+    restore()
+    return report
+
+
+def _zygote_main(fd: int, preload: Sequence[str]):
+    """
+    Zygote loop: import the preload modules once, then fork a worker for
+    every connection handed over the control socket.
+    """
+    for module_name in preload:
+        try:
+            __import__(module_name)
+        except Exception:
+            pass
+    control = socket.socket(fileno=fd)
+    # workers are reaped automatically, the pool tracks them through their pipes
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            message, fds, _, _ = socket.recv_fds(control, 16, 1)
+        except OSError:
+            break
+        if not message or not fds:
+            break
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            # own process group, so a timeout also kills processes the program started
+            os.setpgid(0, 0)
+            exit_code = 0
+            try:
+                _worker_main(Connection(fds[0]))
+            except BaseException:
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(exit_code)
+        os.close(fds[0])
+        control.sendall(struct.pack("q", pid))
+
+
+class _Zygote:
+    def __init__(self, preload: Sequence[str]):
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        here = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([here] + [os.path.abspath(p) for p in sys.path if p])
+        command = f"import sandbox; sandbox._zygote_main({child_sock.fileno()}, {json.dumps(list(preload))})"
+        self.process = subprocess.Popen([sys.executable, "-c", command], pass_fds=[child_sock.fileno()], env=env)
+        child_sock.close()
+        self.sock = parent_sock
+        self.lock = threading.Lock()
+
+    def spawn(self) -> Tuple[Connection, int]:
+        parent_conn, child_conn = multiprocessing.Pipe()
+        try:
+            with self.lock:
+                socket.send_fds(self.sock, [b"spawn"], [child_conn.fileno()])
+                reply = b""
+                while len(reply) < 8:
+                    chunk = self.sock.recv(8 - len(reply))
+                    if not chunk:
+                        raise SandboxError("Sandbox zygote exited")
+                    reply += chunk
+        except OSError as e:
+            parent_conn.close()
+            raise SandboxError(f"Sandbox zygote is unavailable: {e}")
+        finally:
+            child_conn.close()
+        return parent_conn, struct.unpack("q", reply)[0]
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def close(self):
+        self.sock.close()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def split_cells(code: str) -> List[Tuple[int, str]]:
+    """
+    Split a program into top-level cells for incremental execution.
+
+    A new cell starts at every top-level statement that follows a blank line,
+    or at a ``# %%`` marker. Comment lines directly above a statement belong
+    to its cell. Programs that do not parse are a single cell.
+
+    Args:
+        code: Program text
+
+    Returns:
+        (line offset, cell text) pairs in program order
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return [(0, code)]
+    lines = code.split("\n")
+    starts = [0]
+    for node in tree.body[1:]:
+        first = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+        while first > 0 and lines[first - 1].lstrip().startswith("#") and not lines[first].lstrip().startswith("# %%"):
+            first -= 1
+        if first <= starts[-1]:
+            continue
+        if lines[first - 1].strip() == "" or lines[first].lstrip().startswith("# %%"):
+            starts.append(first)
+    bounds = starts + [len(lines)]
+    return [(bounds[i], "\n".join(lines[bounds[i]:bounds[i + 1]])) for i in range(len(starts))]
+
+
+def _import_all(module_names: Sequence[str]):
+    for module_name in module_names:
+        try:
+            __import__(module_name)
+        except BaseException:
+            pass
+
+
+def _snapshot(namespace: Dict[str, Any], run_conn: Connection, index: int, stream: io.TextIOWrapper):
+    """
+    Fork at a cell boundary. The parent stays behind as a snapshot holding
+    the namespace after cell ``index`` and serves later resumes; the child
+    carries on with the next cell.
+    """
+    keep, give = socket.socketpair()
+    if os.fork() != 0:
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        give.close()
+        run_conn.close()
+        stream.close()
+        _serve_forks(Connection(keep.detach()), namespace)
+        sys.stdout.flush()
+        os._exit(0)
+    keep.close()
+    os.setpgid(0, 0)
+    run_conn.send({"snapshot": index, "pid": os.getppid(), "run_pid": os.getpid()})
+    reduction.send_handle(run_conn, give.fileno(), 0)
+    give.close()
+
+
+def _run_cells(cells: List[Tuple[int, str]], namespace: Dict[str, Any], run_conn: Connection,
+               stream: io.TextIOWrapper, snapshots: bool, limits: Dict[str, Optional[int]]):
+    modules_before = set(sys.modules)
+    _apply_limits(limits)
+    usage = _Usage()
+    for index, (offset, text) in enumerate(cells):
+        # padding keeps traceback line numbers relative to the whole program
+        status = _exec_capture("\n" * offset + text, namespace, stream)
+        if status != "ok":
+            break
+        if snapshots and index < len(cells) - 1:
+            usage.pause()
+            _snapshot(namespace, run_conn, index, stream)
+            usage.resume()
+    # modules the program imported, so the template can import them for later runs
+    modules = sorted(name for name in set(sys.modules) - modules_before if not name.startswith("_"))
+    run_conn.send({"rss": _rss(), "modules": modules, "usage": usage.report()})
+
+
+def _fork_run(cells: List[Tuple[int, str]], snapshots: bool, namespace: Dict[str, Any], fd: int,
+              output_fd: int, limits: Dict[str, Optional[int]]) -> int:
+    """Run a program in a forked copy of a loaded namespace."""
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.setpgid(0, 0)
+        exit_code = 0
+        try:
+            _run_cells(cells, namespace, Connection(fd), _output_stream(output_fd), snapshots, limits)
+        except BaseException:
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(exit_code)
+    os.close(fd)
+    os.close(output_fd)
+    return pid
+
+
+def _serve_forks(conn: Connection, namespace: Dict[str, Any]):
+    """Fork loop of templates and snapshots: one child per requested run."""
+    # forked children are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        if "import" in request:
+            _import_all(request["import"])
+            continue
+        os.chdir(request["cwd"])
+        fd = reduction.recv_handle(conn)
+        output_fd = reduction.recv_handle(conn)
+        pid = _fork_run(request["cells"], request["snapshots"], namespace, fd, output_fd, request["limits"])
+        conn.send({"pid": pid})
+
+
+def _fork_program(code: str, stream: io.TextIOWrapper, limits: Dict[str, Optional[int]]) -> Optional[Dict[str, Any]]:
+    """
+    Run a program in a child forked from this worker, so nothing the program
+    imports, sets or plots is left behind for the next one. The child stays
+    in the worker's process group, so stopping the worker also stops it.
+
+    Returns:
+        Resource usage of the run, None if the child died without reporting
+    """
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    pid = os.fork()
+    if pid == 0:
+        reader.close()
+        exit_code = 0
+        try:
+            _apply_limits(limits)
+            usage = _Usage()
+            with stream:
+                _exec_capture(code, {"__name__": "__main__"}, stream)
+            writer.send(usage.report())
+        except BaseException:
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(exit_code)
+    writer.close()
+    stream.close()
+    try:
+        report = reader.recv()
+    except EOFError:
+        report = None
+    finally:
+        reader.close()
+        os.waitpid(pid, 0)
+    return report
+
+
+def _worker_main(conn: Connection):
+    """
+    Worker loop: receive a program, run it in a forked child, send back its
+    output. A worker that receives a prelude becomes a template and forks a
+    child per program as well.
+    """
+    conn.send({"rss": _rss()})
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        os.chdir(request["cwd"])
+        stream = _output_stream(reduction.recv_handle(conn))
+        if "prelude" in request:
+            namespace = {"__name__": "__main__"}
+            with stream:
+                status = _exec_capture(request["prelude"], namespace, stream)
+            conn.send({"ok": status == "ok", "rss": _rss()})
+            if status == "ok":
+                _serve_forks(conn, namespace)
+            break
+        report = _fork_program(request["code"], stream, request["limits"])
+        conn.send({"rss": _rss(), "usage": report})
+
+
+def _kill_group(pid: int):
+    for kill in (os.killpg, os.kill):
+        try:
+            kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class _Worker:
+    def __init__(self, zygote: _Zygote):
+        self.conn, self.pid = zygote.spawn()
+        self.runs = 0
+        self.baseline_rss = None
+        self.rss = None
+        # processes the last program left running
+        self.children = 0
+
+    def wait_ready(self, timeout: float):
+        if not self.conn.poll(timeout):
+            raise SandboxError("Sandbox worker did not start in time")
+        self.baseline_rss = self.conn.recv()["rss"]
+
+    def run(self, code: str, timeout: Optional[float], limit: int = OUTPUT_LIMIT,
+            limits: Optional[Dict[str, Optional[int]]] = None) -> Tuple[str, Dict[str, Any]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pipe = OutputPipe(limit)
+        try:
+            self.conn.send({"code": code, "cwd": run_directory(), "limits": limits or {}})
+            reduction.send_handle(self.conn, pipe.writer.fileno(), self.pid)
+            pipe.close_writer()
+            self.runs += 1
+            if not pipe.wait(self.conn, deadline):
+                raise SandboxTimeout(f"Code execution exceeded the timeout limit of {timeout} seconds")
+            reply = self.conn.recv()
+        except (EOFError, ConnectionResetError, BrokenPipeError):
+            raise SandboxCrash("Sandbox process exited unexpectedly")
+        finally:
+            pipe.close()
+        self.rss = reply["rss"]
+        if reply["usage"] is None:
+            raise SandboxCrash("Sandbox process exited unexpectedly")
+        self.children = reply["usage"]["children"]
+        return pipe.getvalue(), reply["usage"]
+
+    def kill(self):
+        _kill_group(self.pid)
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.conn.close()
+
+
+class _ForkSource:
+    """
+    A process holding a loaded namespace that forks a child per run: either a
+    template that ran a prelude, or a snapshot taken at a cell boundary.
+    """
+
+    def __init__(self, conn: Connection, pid: int, output: str, template_key: str):
+        self.conn = conn
+        self.pid = pid
+        # what the program printed before this point
+        self.output = output
+        self.template_key = template_key
+        self.lock = threading.Lock()
+        self.imported = set()
+
+    def run(self, cells: List[Tuple[int, str]], timeout: Optional[float], snapshots: bool = False,
+            on_snapshot=None, limit: int = OUTPUT_LIMIT,
+            limits: Optional[Dict[str, Optional[int]]] = None) -> Tuple[str, Dict[str, Any]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        parent_conn, child_conn = multiprocessing.Pipe()
+        # earlier output comes first, as if everything had run as one program
+        pipe = OutputPipe(limit, prefix=self.output)
+        try:
+            with self.lock:
+                try:
+                    self.conn.send({"cells": cells, "snapshots": snapshots, "cwd": run_directory(), "limits": limits or {}})
+                    reduction.send_handle(self.conn, child_conn.fileno(), self.pid)
+                    reduction.send_handle(self.conn, pipe.writer.fileno(), self.pid)
+                    if not self.conn.poll(WORKER_START_TIMEOUT):
+                        raise SandboxCrash("Sandbox template stopped responding")
+                    run_pid = self.conn.recv()["pid"]
+                except (EOFError, OSError):
+                    raise SandboxCrash("Sandbox template exited unexpectedly")
+            child_conn.close()
+            pipe.close_writer()
+            try:
+                while True:
+                    if not pipe.wait(parent_conn, deadline):
+                        _kill_group(run_pid)
+                        raise SandboxTimeout(f"Code execution exceeded the timeout limit of {timeout} seconds")
+                    reply = parent_conn.recv()
+                    if "snapshot" not in reply:
+                        break
+                    snapshot_conn = Connection(reduction.recv_handle(parent_conn))
+                    run_pid = reply["run_pid"]
+                    on_snapshot(reply["snapshot"], snapshot_conn, reply["pid"], pipe.getvalue())
+            except (EOFError, ConnectionResetError):
+                raise SandboxCrash("Sandbox process exited unexpectedly")
+        finally:
+            child_conn.close()
+            parent_conn.close()
+            pipe.close()
+        self._import_modules(reply.get("modules", []))
+        return pipe.getvalue(), reply["usage"]
+
+    def _import_modules(self, modules: List[str]):
+        """Have the source import what programs import, so later forks inherit it."""
+        with self.lock:
+            missing = [name for name in modules if name not in self.imported]
+            if not missing:
+                return
+            self.imported.update(missing)
+            try:
+                self.conn.send({"import": missing})
+            except OSError:
+                pass
+
+    def kill(self):
+        _kill_group(self.pid)
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    Pool of warm sandbox workers shared by every caller in the process.
+
+    Args:
+        size: Maximum number of concurrently running programs
+        max_runs: Runs after which a worker is replaced
+        max_rss_growth: Resident memory growth in bytes after which a worker
+            is replaced
+        preload: Modules imported by the zygote before workers are forked
+        limits: Default per-run limits with "memory" (address space in
+            bytes), "cpu" (seconds), "threads" and "cpus" (CPUs the run is
+            pinned to, also its thread count unless "threads" is set) keys,
+            see DEFAULT_LIMITS
+    """
+
+    def __init__(
+        self,
+        size: int = POOL_SIZE,
+        max_runs: int = MAX_RUNS_PER_WORKER,
+        max_rss_growth: int = MAX_RSS_GROWTH,
+        preload: Sequence[str] = PRELOAD_MODULES,
+        limits: Optional[Dict[str, Optional[int]]] = None,
+    ):
+        self.size = max(1, size)
+        self.max_runs = max_runs
+        self.max_rss_growth = max_rss_growth
+        self.preload = list(preload)
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self._zygote: Optional[_Zygote] = None
+        self._zygote_lock = threading.Lock()
+        self._idle: List[_Worker] = []
+        self._busy = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._templates: "OrderedDict[str, _ForkSource]" = OrderedDict()
+        self._snapshots: "OrderedDict[str, _ForkSource]" = OrderedDict()
+        self._template_lock = threading.Lock()
+        # preludes being loaded, the other runs needing one wait for its future
+        self._template_loads: Dict[str, Future] = {}
+        self.stats = {"runs": 0, "workers_started": 0, "recycled": 0, "timeouts": 0, "crashes": 0,
+                      "template_loads": 0, "template_hits": 0, "snapshot_hits": 0, "cells_skipped": 0}
+
+    def _get_zygote(self) -> _Zygote:
+        with self._zygote_lock:
+            if self._zygote is None or not self._zygote.alive():
+                self._zygote = _Zygote(self.preload)
+            return self._zygote
+
+    def _start_worker(self) -> _Worker:
+        worker = _Worker(self._get_zygote())
+        try:
+            worker.wait_ready(WORKER_START_TIMEOUT)
+        except Exception:
+            worker.kill()
+            raise
+        with self._cond:
+            self.stats["workers_started"] += 1
+        return worker
+
+    def warm(self, workers: Optional[int] = None):
+        """
+        Start idle workers ahead of time in a background thread.
+
+        Args:
+            workers: Number of workers to have ready, defaults to the pool size
+        """
+        def _warm():
+            with self._cond:
+                missing = min(workers or self.size, self.size) - len(self._idle) - self._busy
+                self._busy += max(0, missing)
+            for _ in range(max(0, missing)):
+                try:
+                    worker = self._start_worker()
+                except Exception:
+                    worker = None
+                self._release(worker)
+        threading.Thread(target=_warm, name="sandbox-warm", daemon=True).start()
+
+    def _acquire_slot(self):
+        with self._cond:
+            while self._busy >= self.size and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise SandboxError("Sandbox pool is shut down")
+            self._busy += 1
+
+    def _acquire(self) -> Optional[_Worker]:
+        self._acquire_slot()
+        with self._cond:
+            if self._idle:
+                return self._idle.pop()
+        return None
+
+    def _release(self, worker: Optional[_Worker]):
+        with self._cond:
+            self._busy -= 1
+            if worker is not None:
+                if self._closed:
+                    worker.close()
+                else:
+                    self._idle.append(worker)
+            self._cond.notify()
+
+    def _should_recycle(self, worker: _Worker) -> bool:
+        if worker.runs >= self.max_runs:
+            return True
+        return worker.rss is not None and worker.rss - worker.baseline_rss > self.max_rss_growth
+
+    @staticmethod
+    def _template_key(prelude: str) -> str:
+        # the prelude may read relative paths, so the directory is part of the key
+        return hashlib.sha256(f"{os.getcwd()}\0{prelude}".encode()).hexdigest()
+
+    def _get_template(self, prelude: str, timeout: Optional[float]):
+        """
+        Return the template for a prelude, loading it if needed. Returns the
+        prelude's output instead when the prelude itself fails.
+
+        The template lock is not held while a prelude loads, so runs of other
+        templates and snapshots taken by running programs are not held up.
+        Runs needing a prelude that is being loaded wait for that load.
+        """
+        key = self._template_key(prelude)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._template_lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                with self._cond:
+                    self.stats["template_hits"] += 1
+                return template
+            loading = self._template_loads.get(key)
+            if loading is None:
+                loading = self._template_loads[key] = Future()
+                loader = True
+            else:
+                loader = False
+        if not loader:
+            try:
+                result = loading.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                raise SandboxTimeout(f"Code execution exceeded the timeout limit of {timeout} seconds")
+            if not isinstance(result, str):
+                with self._cond:
+                    self.stats["template_hits"] += 1
+            return result
+        try:
+            result = self._load_template(key, prelude, deadline, timeout)
+        except BaseException as e:
+            with self._template_lock:
+                del self._template_loads[key]
+            loading.set_exception(e)
+            raise
+        with self._template_lock:
+            del self._template_loads[key]
+            if not isinstance(result, str):
+                self._templates[key] = result
+                while len(self._templates) > MAX_TEMPLATES:
+                    self._evict_template(self._templates.popitem(last=False)[1])
+        loading.set_result(result)
+        return result
+
+    def _load_template(self, key: str, prelude: str, deadline: Optional[float], timeout: Optional[float]):
+        """Run a prelude in a new worker and keep the worker as its template."""
+        worker = self._start_worker()
+        pipe = OutputPipe()
+        try:
+            worker.conn.send({"prelude": prelude, "cwd": os.getcwd()})
+            reduction.send_handle(worker.conn, pipe.writer.fileno(), worker.pid)
+            pipe.close_writer()
+            if not pipe.wait(worker.conn, deadline):
+                raise SandboxTimeout(f"Code execution exceeded the timeout limit of {timeout} seconds")
+            reply = worker.conn.recv()
+        except (EOFError, ConnectionResetError):
+            worker.kill()
+            raise SandboxCrash("Sandbox process exited unexpectedly")
+        except BaseException:
+            worker.kill()
+            raise
+        finally:
+            pipe.close()
+        with self._cond:
+            self.stats["template_loads"] += 1
+        if not reply["ok"]:
+            # failures are not cached, the dataset code may fail transiently
+            worker.close()
+            return pipe.getvalue()
+        return _ForkSource(worker.conn, worker.pid, pipe.getvalue(), key)
+
+    def _evict_template(self, template: _ForkSource):
+        """Stop a template and its snapshots. Caller holds the template lock."""
+        for key, snapshot in list(self._snapshots.items()):
+            if snapshot.template_key == template.template_key:
+                del self._snapshots[key]
+                snapshot.close()
+        template.close()
+
+    def _drop_source(self, source: _ForkSource):
+        """Forget a template or snapshot whose process died."""
+        with self._template_lock:
+            if self._templates.get(source.template_key) is source:
+                del self._templates[source.template_key]
+                self._evict_template(source)
+            for key, snapshot in list(self._snapshots.items()):
+                if snapshot is source:
+                    del self._snapshots[key]
+        source.kill()
+
+    @staticmethod
+    def _cell_keys(template_key: str, cells: List[Tuple[int, str]]) -> List[str]:
+        # every key covers the cell and everything upstream of it
+        keys = []
+        digest = hashlib.sha256(template_key.encode())
+        for _, text in cells:
+            digest.update(b"\0" + text.encode())
+            keys.append(digest.copy().hexdigest())
+        return keys
+
+    def _run_incremental(self, template: _ForkSource, code: str, timeout: Optional[float], limit: int,
+                         limits: Dict[str, Optional[int]]) -> Tuple[str, Dict[str, Any]]:
+        cells = split_cells(code)
+        # files written by the skipped cells are only there in the directory the snapshot ran in
+        keys = self._cell_keys(f"{template.template_key}\0{run_directory()}", cells)
+        source, start = template, 0
+        with self._template_lock:
+            # the snapshot after the last cell is never taken, the last cell always runs
+            for index in range(len(cells) - 2, -1, -1):
+                snapshot = self._snapshots.get(keys[index])
+                if snapshot is not None:
+                    self._snapshots.move_to_end(keys[index])
+                    source, start = snapshot, index + 1
+                    break
+        if source is not template:
+            with self._cond:
+                self.stats["snapshot_hits"] += 1
+                self.stats["cells_skipped"] += start
+
+        def on_snapshot(index: int, conn: Connection, pid: int, output: str):
+            snapshot = _ForkSource(conn, pid, output, template.template_key)
+            with self._template_lock:
+                if keys[start + index] in self._snapshots or template.template_key not in self._templates:
+                    snapshot.close()
+                    return
+                self._snapshots[keys[start + index]] = snapshot
+                while len(self._snapshots) > MAX_SNAPSHOTS:
+                    self._snapshots.popitem(last=False)[1].close()
+
+        try:
+            return source.run(cells[start:], timeout, snapshots=True, on_snapshot=on_snapshot, limit=limit,
+                              limits=limits)
+        except SandboxCrash:
+            if source is template:
+                raise
+            # a dead snapshot is dropped and the program resumes from an earlier point
+            self._drop_source(source)
+            return self._run_incremental(template, code, timeout, limit, limits)
+
+    def _run_with_prelude(self, code: str, timeout: Optional[float], prelude: str, incremental: bool,
+                          limit: int, limits: Dict[str, Optional[int]]) -> Tuple[str, Dict[str, Any]]:
+        self._acquire_slot()
+        try:
+            start = time.monotonic()
+            template = self._get_template(prelude, timeout)
+            if isinstance(template, str):
+                # the program never ran, the prelude's failure is its output
+                return truncate_output(template, limit), {"status": "prelude_error"}
+            remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - start))
+            try:
+                if incremental:
+                    result = self._run_incremental(template, code, remaining, limit, limits)
+                else:
+                    result = template.run([(0, code)], remaining, limit=limit, limits=limits)
+            except SandboxCrash:
+                self._drop_source(template)
+                raise
+            with self._cond:
+                self.stats["runs"] += 1
+            return result
+        except SandboxError as e:
+            with self._cond:
+                self.stats["timeouts" if isinstance(e, SandboxTimeout) else "crashes"] += 1
+            raise
+        finally:
+            self._release(None)
+
+    def _run_in_worker(self, code: str, timeout: Optional[float], limit: int,
+                       limits: Dict[str, Optional[int]]) -> Tuple[str, Dict[str, Any]]:
+        worker = self._acquire()
+        try:
+            if worker is None:
+                worker = self._start_worker()
+            result = worker.run(code, timeout, limit, limits)
+        except SandboxError as e:
+            with self._cond:
+                self.stats["timeouts" if isinstance(e, SandboxTimeout) else "crashes"] += 1
+            if worker is not None:
+                worker.kill()
+            self._release(None)
+            raise
+        except BaseException:
+            if worker is not None:
+                worker.kill()
+            self._release(None)
+            raise
+        with self._cond:
+            self.stats["runs"] += 1
+        if worker.children:
+            # killing the process group also stops what the program left running
+            worker.kill()
+            worker = None
+            with self._cond:
+                self.stats["recycled"] += 1
+        elif self._should_recycle(worker):
+            worker.close()
+            worker = None
+            with self._cond:
+                self.stats["recycled"] += 1
+        self._release(worker)
+        return result
+
+    def run(self, code: str, timeout: Optional[float] = None, prelude: Optional[str] = None,
+            incremental: bool = False, max_output: int = OUTPUT_LIMIT,
+            limits: Optional[Dict[str, Optional[int]]] = None, return_stats: bool = False):
+        """
+        Execute a program in a warm worker.
+
+        Args:
+            code: Program text
+            timeout: Wall-clock timeout in seconds
+            prelude: Code that runs before ``code`` as part of the same
+                program, executed once per distinct prelude in a template
+                whose namespace every run with that prelude inherits
+            incremental: Split ``code`` into cells, keep a snapshot after
+                each cell and resume from the longest unchanged prefix of a
+                previous run. Requires a prelude
+            max_output: Characters of output returned, longer output keeps
+                its head and tail
+            limits: Per-run limits overriding the pool's defaults. A program
+                over its CPU time gets a CPUTimeLimitExceeded error, one over
+                its address space a MemoryError
+            return_stats: Also return the run's resource usage
+
+        Returns:
+            What the program printed to stdout, with a
+            ``[CODE EXECUTION ERROR]`` report if it raised. With
+            ``return_stats`` an (output, stats) tuple, where stats holds
+            wall_time, cpu_user and cpu_system in seconds, peak_rss in bytes
+            and the number of child processes left running
+
+        Raises:
+            SandboxTimeout: If the program runs longer than ``timeout``
+            SandboxCrash: If the worker process dies during the run
+        """
+        start = time.monotonic()
+        limits = {**self.limits, **(limits or {})}
+        if prelude:
+            output, usage = self._run_with_prelude(code, timeout, prelude, incremental, max_output, limits)
+        else:
+            output, usage = self._run_in_worker(code, timeout, max_output, limits)
+        if not return_stats:
+            return output
+        return output, {"wall_time": time.monotonic() - start, **usage}
+
+    def shutdown(self):
+        """Stop every idle worker; busy workers stop when their run ends."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for worker in idle:
+            worker.close()
+        with self._template_lock:
+            sources = list(self._templates.values()) + list(self._snapshots.values())
+            self._templates, self._snapshots = OrderedDict(), OrderedDict()
+        for source in sources:
+            source.close()
+        with self._zygote_lock:
+            if self._zygote is not None:
+                self._zygote.close()
+                self._zygote = None
+
+
+def get_sandbox_pool() -> SandboxPool:
+    """
+    Get or create the process-wide sandbox pool.
+
+    Returns:
+        SandboxPool instance
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool()
+            atexit.register(shutdown_sandbox_pool)
+        return _pool
+
+
+def shutdown_sandbox_pool():
+    """Stop the process-wide sandbox pool, if one was started."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Execution Scheduler
+Process-wide CPU slots for the programs tools.execute_code runs.
+
+With parallel labs every lab executes code at the same time, and each BLAS or
+torch program starts as many threads as the machine has cores. The scheduler
+splits the CPUs this process may use into a fixed number of slots. A run
+holds a slot while it executes, its process is pinned to the slot's CPUs and
+its thread pools are sized to match, and runs beyond the slot count wait in
+a queue, served in arrival order or by priority.
+
+The time a run spends queued is reported separately from its execution time.
+"""
+import os
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from sandbox import POOL_SIZE
+
+# Number of programs executing at once, by default one per sandbox worker
+SLOTS = int(os.getenv("SANDBOX_SLOTS", str(POOL_SIZE)))
+# "fifo" serves queued runs in arrival order, "priority" lowest priority value first
+QUEUE_POLICY = os.getenv("SANDBOX_QUEUE_POLICY", "fifo").lower()
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cpus(cpus: List[int], slots: int) -> List[List[int]]:
+    """
+    Split CPUs into ``slots`` contiguous subsets of near-equal size. With
+    more slots than CPUs, slots share CPUs round-robin.
+    """
+    if slots <= len(cpus):
+        return [cpus[i * len(cpus) // slots:(i + 1) * len(cpus) // slots] for i in range(slots)]
+    return [[cpus[i % len(cpus)]] for i in range(slots)]
+
+
+class Slot:
+    """A held execution slot: the CPUs a run is pinned to and how long it queued."""
+
+    def __init__(self, index: int, cpus: List[int], queue_wait: float):
+        self.index = index
+        self.cpus = cpus
+        self.queue_wait = queue_wait
+
+    def limits(self, limits: Optional[Dict[str, Optional[int]]] = None) -> Dict[str, Optional[int]]:
+        """Per-run limits pinning a run to this slot, on top of ``limits``."""
+        return {**(limits or {}), "cpus": list(self.cpus)}
+
+
+class ExecutionScheduler:
+    """
+    Hands out CPU slots to concurrent runs.
+
+    Args:
+        slots: Number of runs executing at once
+        policy: "fifo" or "priority"
+        cpus: CPUs to divide between the slots, defaults to the CPUs this
+            process may run on
+    """
+
+    def __init__(self, slots: int = SLOTS, policy: str = QUEUE_POLICY, cpus: Optional[List[int]] = None):
+        if policy not in ("fifo", "priority"):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.slots = max(1, slots)
+        self.policy = policy
+        self.cpus = partition_cpus(cpus or available_cpus(), self.slots)
+        self._free = list(range(self.slots))
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self.stats = {"runs": 0, "queued": 0, "queue_wait": 0.0, "max_queue_length": 0}
+
+    def queue_length(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def acquire(self, priority: int = 0, timeout: Optional[float] = None) -> Optional[Slot]:
+        """
+        Wait for a free slot.
+
+        Args:
+            priority: Queue position under the "priority" policy, lower
+                values run first. Ignored under "fifo"
+            timeout: Seconds to wait at most
+
+        Returns:
+            The slot, or None if ``timeout`` passed first
+        """
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        entry = (priority if self.policy == "priority" else 0, next(self._counter))
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            queued = not self._free or self._queue[0] != entry
+            if queued:
+                self.stats["queued"] += 1
+                self.stats["max_queue_length"] = max(self.stats["max_queue_length"], len(self._queue) - 1)
+            while not self._free or self._queue[0] != entry:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    # the next waiter may be able to run now
+                    self._cond.notify_all()
+                    return None
+                self._cond.wait(remaining)
+            heapq.heappop(self._queue)
+            index = self._free.pop(0)
+            wait = time.monotonic() - start
+            self.stats["runs"] += 1
+            self.stats["queue_wait"] += wait
+            self._cond.notify_all()
+        return Slot(index, self.cpus[index], wait)
+
+    def release(self, slot: Slot):
+        with self._cond:
+            self._free.append(slot.index)
+            self._free.sort()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: int = 0) -> Iterator[Slot]:
+        """Hold a slot for the duration of a ``with`` block."""
+        held = self.acquire(priority)
+        try:
+            yield held
+        finally:
+            self.release(held)
+
+
+def get_scheduler() -> ExecutionScheduler:
+    """
+    Get or create the process-wide execution scheduler.
+
+    Returns:
+        ExecutionScheduler instance
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ExecutionScheduler()
+        return _scheduler
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Reward Score Cache
+Persistent memo of reward-model scores for mlesolver.get_score and agents.get_score.
+
+The solvers score the same artifact more than once: a repair that changed
+nothing, or a step that starts from a kept program, sends the same plan,
+code and output to the reward model again. A score is keyed by a hash of
+the reward model, the reviewer instructions, the plan, the artifact (code or
+paper text) and the execution output, and stored in SQLite, so it is reused
+across solver steps, across labs sharing the working directory and across
+resumed runs.
+
+Only successfully parsed scores are stored, a failed review is retried on
+the next call.
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Optional, Tuple
+
+# Default location of the cache, next to the result cache of the same run
+DEFAULT_CACHE_PATH = os.getenv("SCORE_CACHE_PATH", "score_cache.db")
+# Least recently used scores are dropped beyond this many
+MAX_CACHE_ENTRIES = 20000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    key TEXT PRIMARY KEY,
+    score REAL,
+    message TEXT,
+    created REAL,
+    used REAL
+);
+CREATE INDEX IF NOT EXISTS scores_used ON scores(used);
+"""
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class ScoreCache:
+    """
+    SQLite store of reward-model scores, evicted least recently used first.
+    Safe to share between threads and between processes using the same file.
+
+    Args:
+        path: Database path
+        max_entries: Number of scores kept
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = MAX_CACHE_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        if path != ":memory:":
+            # parallel labs share the file
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, plan: str, artifact: str, output: str = "", reviewer: Optional[str] = None) -> str:
+        """
+        Cache key of a scoring request.
+
+        Args:
+            model: Reward model name
+            plan: Research plan the artifact is judged against
+            artifact: Scored code or paper text
+            output: Execution output of the code
+            reviewer: Reviewer instructions, for paper reviews
+
+        Returns:
+            Hex digest
+        """
+        material = {"model": model, "plan": plan, "artifact": artifact, "output": output, "reviewer": reviewer}
+        return hashlib.sha256(json.dumps(material, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[float, str]]:
+        """
+        Look up a score.
+
+        Returns:
+            (score, message) stored for the key, or None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT score, message FROM scores WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE scores SET used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return row[0], row[1]
+
+    def put(self, key: str, score: float, message: str):
+        """
+        Store a score.
+
+        Args:
+            key: Key from ``key()``
+            score: Reward-model score
+            message: Feedback returned with the score
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO scores (key, score, message, created, used) "
+                               "VALUES (?, ?, ?, ?, ?)", (key, score, message, now, now))
+            count = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute("DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY used LIMIT ?)",
+                                   (count - self.max_entries,))
+            self._conn.commit()
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def get_score_cache(path: Optional[str] = None) -> ScoreCache:
+    """
+    Get or create the shared score cache.
+
+    Args:
+        path: Database path, defaults to ``SCORE_CACHE_PATH`` or
+            ``score_cache.db`` in the working directory
+
+    Returns:
+        ScoreCache instance
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ScoreCache(path or DEFAULT_CACHE_PATH)
+        return _cache
+
+
+def cached_score(key: str) -> Optional[Tuple[float, str]]:
+    """
+    Look up a score in the shared cache and report the cache's hit rate.
+    A cache that cannot be opened counts as a miss.
+    """
+    try:
+        cache = get_score_cache()
+        hit = cache.get(key)
+    except (sqlite3.Error, OSError):
+        return None
+    from logger import get_logger
+    get_logger().metric("reward_score_cache_hit_rate", cache.hit_rate(), "ratio")
+    return hit
+
+
+def store_score(key: str, score: float, message: str):
+    """Store a score in the shared cache, ignoring a cache that cannot be written."""
+    try:
+        get_score_cache().put(key, score, message)
+    except (sqlite3.Error, OSError):
+        pass
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Section-Scoped Paper Review
+Incremental reward scoring of PaperSolver edits.
+
+agents.get_score reviews the whole paper after every accepted edit, although an
+edit usually touches one paragraph of one section. In the section-scoped mode
+the paper is split at its abstract and ``\\section`` headings, and each section
+is reviewed on its own for the ratings that belong to a section: soundness,
+presentation, contribution and clarity. Section reviews are stored in the
+reward score cache under a hash of the model, plan, section title and section
+text, so after an edit only the changed sections are reviewed again.
+
+A cheap coherence pass then rates the paper as a whole (originality, quality,
+significance, overall and confidence) from the plan, the abstract, the outline
+and the section reviews instead of the full text. The reward is computed from
+both with the weights of the full review, section ratings averaged by section
+length. A paper without sections is reviewed in full by agents.get_score.
+"""
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from score_cache import ScoreCache, cached_score, store_score
+from structured_output import (COHERENCE_RATINGS, COHERENCE_SCHEMA, REVIEW_RATINGS, SECTION_RATINGS, SECTION_SCHEMA,
+                               parse_review, weighted_score)
+
+# Changed sections reviewed at once
+MAX_SECTION_REVIEWERS = 4
+# Characters of the abstract shown to the coherence review
+MAX_ABSTRACT_CHARS = 4000
+
+SECTION_HEADING = re.compile(r"^[ \t]*\\(?:section\*?\{(?P<title>[^}\n]*)\}|begin\{(?P<abstract>abstract)\})", re.MULTILINE)
+
+SECTION_INSTRUCTIONS = (
+    "You are an AI researcher reviewing one section of a paper submitted to a prestigious ML venue. "
+    "Be critical and cautious in your ratings. Rate only the section you are given, the rest of the paper is reviewed separately.\n"
+    "Respond with a JSON object with the following fields:\n"
+    '- "Summary": One sentence on what the section says.\n'
+    '- "Weaknesses": A short list of the weaknesses of the section.\n'
+    '- "Soundness": A rating from 1 to 4 (poor, fair, good, excellent) of whether its technical claims and methodology are sound and supported by evidence.\n'
+    '- "Presentation": A rating from 1 to 4 (poor, fair, good, excellent) of its writing and its contextualization relative to prior work.\n'
+    '- "Contribution": A rating from 1 to 4 (poor, fair, good, excellent) of what it adds to the contribution of the paper.\n'
+    '- "Clarity": A rating from 1 to 4 (low, medium, high, very high) of how clearly it is written and organized.\n'
+    "This JSON will be automatically parsed, so ensure the format is precise."
+)
+COHERENCE_INSTRUCTIONS = (
+    "You are an AI researcher deciding on a paper submitted to a prestigious ML venue. Be critical and cautious in your decision. "
+    "Every section of the paper has been reviewed separately. You are given the research plan, the abstract, and the sections "
+    "with their length and reviews. Judge the paper as a whole: whether its sections form a coherent and complete paper that "
+    "carries out the plan. The paper must have an abstract, introduction, methods, results and discussion, points must be "
+    "reduced if any of these are missing.\n"
+    "Respond with a JSON object with the following fields:\n"
+    '- "Weaknesses": A short list of the weaknesses of the paper as a whole.\n'
+    '- "Originality": A rating from 1 to 4 (low, medium, high, very high).\n'
+    '- "Quality": A rating from 1 to 4 (low, medium, high, very high).\n'
+    '- "Significance": A rating from 1 to 4 (low, medium, high, very high).\n'
+    '- "Overall": A rating from 1 to 10 (1: very strong reject, 3: reject, 4: borderline reject, 5: borderline accept, '
+    '6: weak accept, 7: accept, 8: strong accept, 10: award quality).\n'
+    '- "Confidence": A rating from 1 to 5 (low, medium, high, very high, absolute).\n'
+    '- "Decision": A decision that has to be one of the following: Accept, Reject.\n'
+    "This JSON will be automatically parsed, so ensure the format is precise."
+)
+
+
+def split_sections(latex: str) -> List[Tuple[str, str]]:
+    """
+    Reviewed sections of a paper, as (title, text) pairs: the abstract and
+    every ``\\section``, each from its heading to the next one. The preamble
+    before the first heading is not reviewed.
+    """
+    matches = list(SECTION_HEADING.finditer(latex))
+    sections = []
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(latex)
+        title = "Abstract" if match.group("abstract") else match.group("title").strip()
+        sections.append((title, latex[match.start():end].strip()))
+    return sections
+
+
+def _ratings_text(review: Dict, names) -> str:
+    return ", ".join(f"{_name} {review[_name]}/{REVIEW_RATINGS[_name]}" for _name in names)
+
+
+class SectionReviewer:
+    """
+    Section-scoped reviews of the versions of one paper.
+
+    Args:
+        plan: Research plan the paper is judged against
+        reward_model_llm: Model writing the reviews
+        openai_api_key: API key passed to query_model
+    """
+
+    def __init__(self, plan: str, reward_model_llm: str, openai_api_key: Optional[str] = None):
+        self.plan = plan
+        self.reward_model_llm = reward_model_llm
+        self.openai_api_key = openai_api_key
+        self.sections_reviewed = 0
+        self.sections_reused = 0
+
+    def _key(self, artifact: str, reviewer: str) -> str:
+        return ScoreCache.key(f"{self.reward_model_llm}", self.plan, artifact, reviewer=reviewer)
+
+    def _query(self, system_prompt: str, prompt: str, json_schema: dict, ratings, key: str) -> Dict:
+        from inference import query_model
+        response = query_model(model_str=f"{self.reward_model_llm}", system_prompt=system_prompt, prompt=prompt,
+                               temp=0.0, json_schema=json_schema, openai_api_key=self.openai_api_key)
+        review = parse_review(response, ratings, kind="section_review")
+        store_score(key, sum(review[_name] / REVIEW_RATINGS[_name] for _name in ratings) / len(ratings), json.dumps(review))
+        return review
+
+    def review_section(self, title: str, text: str, outline: str) -> Dict:
+        """
+        Review one section. The outline, titles of every section, is context
+        and not part of the cache key, so a section keeps its review while
+        other sections change.
+        """
+        return self._query(
+            SECTION_INSTRUCTIONS,
+            f"Outlined in the following text is the research plan that the paper was written for: {self.plan}\n\n"
+            f"The paper has the sections: {outline}\n\n"
+            f"The following is the section under review, {title}:\n{text}\n\n",
+            SECTION_SCHEMA, SECTION_RATINGS, self._key(text, f"section:{title}"))
+
+    def review_coherence(self, sections: List[Tuple[str, str]], reviews: List[Dict]) -> Dict:
+        """Rate the paper as a whole from its abstract, outline and section reviews."""
+        abstract = next((_text for _title, _text in sections if _title.lower() == "abstract"), "(the paper has no abstract)")
+        outline = "\n".join(
+            f"- {_title} ({len(_text.split())} words): {_review.get('Summary', '')} "
+            f"Ratings: {_ratings_text(_review, SECTION_RATINGS)}. Weaknesses: {_review.get('Weaknesses', [])}"
+            for (_title, _text), _review in zip(sections, reviews))
+        prompt = (f"Outlined in the following text is the research plan that the paper was written for: {self.plan}\n\n"
+                  f"The abstract of the paper:\n{abstract[:MAX_ABSTRACT_CHARS]}\n\n"
+                  f"The sections of the paper and their reviews:\n{outline}\n\n")
+        key = self._key(prompt, "coherence")
+        cached = cached_score(key)
+        if cached is not None: return json.loads(cached[1])
+        return self._query(COHERENCE_INSTRUCTIONS, prompt, COHERENCE_SCHEMA, COHERENCE_RATINGS, key)
+
+    def get_score(self, latex: str) -> Tuple[Optional[float], str, bool]:
+        """
+        Score a version of the paper, reviewing only the sections without a
+        cached review.
+
+        Returns:
+            (score, feedback, is_valid) like agents.get_score
+        """
+        sections = split_sections(latex)
+        if not sections:
+            from agents import get_score
+            return get_score(self.plan, latex, reward_model_llm=self.reward_model_llm, openai_api_key=self.openai_api_key)
+        outline = ", ".join(_title for _title, _ in sections)
+        reviews: List[Optional[Dict]] = []
+        for _title, _text in sections:
+            cached = cached_score(self._key(_text, f"section:{_title}"))
+            reviews.append(json.loads(cached[1]) if cached is not None else None)
+        changed = [_index for _index, _review in enumerate(reviews) if _review is None]
+        try:
+            if changed:
+                with ThreadPoolExecutor(max_workers=min(MAX_SECTION_REVIEWERS, len(changed))) as executor:
+                    for _index, _review in zip(changed, executor.map(lambda _i: self.review_section(*sections[_i], outline), changed)):
+                        reviews[_index] = _review
+            coherence = self.review_coherence(sections, reviews)
+        except Exception as e:
+            print(e)
+            return None, str(e), False
+        self.sections_reviewed += len(changed)
+        self.sections_reused += len(sections) - len(changed)
+        from logger import get_logger
+        get_logger().metric("section_review_reuse_rate", self.sections_reused / (self.sections_reused + self.sections_reviewed), "ratio")
+
+        words = [max(len(_text.split()), 1) for _, _text in sections]
+        ratings = {_name: sum(_w * _review[_name] for _w, _review in zip(words, reviews)) / sum(words) for _name in SECTION_RATINGS}
+        ratings.update({_name: coherence[_name] for _name in COHERENCE_RATINGS})
+        performance = weighted_score(ratings)
+        feedback = "\n".join(
+            f"{_title}: {_review.get('Summary', '')} ({_ratings_text(_review, SECTION_RATINGS)}) Weaknesses: {_review.get('Weaknesses', [])}"
+            for (_title, _), _review in zip(sections, reviews))
+        feedback += (f"\nWhole paper: {_ratings_text(coherence, COHERENCE_RATINGS)}, Decision {coherence.get('Decision', '')}. "
+                     f"Weaknesses: {coherence.get('Weaknesses', [])}")
+        return performance, f"The performance of your submission is: {performance}\n{feedback}", True
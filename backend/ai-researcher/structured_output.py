@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Structured Scoring Output
+Compact response schemas and a tolerant parser for reward-model scoring.
+
+agents.get_score and mlesolver.get_score used to scrape a review JSON or a
+```SCORE block from free text, and any stray comma, missing fence or
+"7 (Accept)" rating failed the score, costing the solvers another scoring or
+repair round trip. The scorers now pass a compact JSON schema to query_model,
+which asks the providers that support it for JSON-schema, JSON-mode or tool
+output, and every response, structured or not, goes through the same
+tolerant parser: fenced or bare JSON objects are located, common syntax
+slips are repaired, keys are matched regardless of case and spacing, and
+ratings are read from the first number of their value. The share of scoring
+responses that still could not be parsed is reported per scorer, e.g. as
+``review_parse_failure_rate`` and ``reward_parse_failure_rate``.
+"""
+import re
+import ast
+import json
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+# Ratings of a review and their maximum value
+REVIEW_RATINGS = {
+    "Originality": 4,
+    "Quality": 4,
+    "Clarity": 4,
+    "Significance": 4,
+    "Soundness": 4,
+    "Presentation": 4,
+    "Contribution": 4,
+    "Overall": 10,
+    "Confidence": 5,
+}
+# Weight of each rating in the reward of a review
+REVIEW_WEIGHTS = {
+    "Clarity": 0.1,
+    "Quality": 0.1,
+    "Overall": 1.0,
+    "Soundness": 0.1,
+    "Confidence": 0.1,
+    "Originality": 0.1,
+    "Significance": 0.1,
+    "Contribution": 0.4,
+    "Presentation": 0.2,
+}
+# Ratings a section review gives its section, the coherence review gives the rest
+SECTION_RATINGS = ("Soundness", "Presentation", "Contribution", "Clarity")
+COHERENCE_RATINGS = ("Originality", "Quality", "Significance", "Overall", "Confidence")
+
+
+def _rating(maximum: int) -> dict:
+    return {"type": "integer", "enum": list(range(1, maximum + 1))}
+
+
+def _object(properties: dict) -> dict:
+    # strict schema modes want every property required and nothing else allowed
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+_TEXT_LIST = {"type": "array", "items": {"type": "string"}}
+
+# Review of a paper, in the field order of the reviewer instructions
+REVIEW_SCHEMA = {
+    "name": "review",
+    "schema": _object({
+        "Summary": {"type": "string"},
+        "Strengths": _TEXT_LIST,
+        "Weaknesses": _TEXT_LIST,
+        **{_name: _rating(REVIEW_RATINGS[_name]) for _name in ("Originality", "Quality", "Clarity", "Significance")},
+        "Questions": _TEXT_LIST,
+        "Limitations": _TEXT_LIST,
+        "Ethical Concerns": {"type": "boolean"},
+        **{_name: _rating(REVIEW_RATINGS[_name]) for _name in ("Soundness", "Presentation", "Contribution", "Overall", "Confidence")},
+        "Decision": {"type": "string", "enum": ["Accept", "Reject"]},
+    }),
+}
+# Review of one section of a paper
+SECTION_SCHEMA = {
+    "name": "section_review",
+    "schema": _object({
+        "Summary": {"type": "string"},
+        "Weaknesses": _TEXT_LIST,
+        **{_name: _rating(REVIEW_RATINGS[_name]) for _name in SECTION_RATINGS},
+    }),
+}
+# Review of a paper as a whole, from its outline and section reviews
+COHERENCE_SCHEMA = {
+    "name": "coherence_review",
+    "schema": _object({
+        "Weaknesses": _TEXT_LIST,
+        **{_name: _rating(REVIEW_RATINGS[_name]) for _name in COHERENCE_RATINGS},
+        "Decision": {"type": "string", "enum": ["Accept", "Reject"]},
+    }),
+}
+# Reward of a program, from 0 to 1
+SCORE_SCHEMA = {"name": "score", "schema": _object({"score": {"type": "number"}})}
+
+_FENCED_JSON = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_SCORE_BLOCK = re.compile(r"```\s*SCORE\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_NUMBER = re.compile(r"[-+]?\d+(?:\.\d+)?")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+_parse_counts: Dict[str, List[int]] = {}
+_parse_lock = threading.Lock()
+
+
+def _objects(text: str) -> Iterator[str]:
+    """Balanced ``{...}`` spans of ``text``, outermost first, in order."""
+    depth, start, quote, escaped = 0, None, None, False
+    for index, char in enumerate(text):
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char == '"' and depth:
+            quote = char
+        elif char == "{":
+            if depth == 0:
+                start = index
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                yield text[start:index + 1]
+
+
+def _repair(candidate: str) -> str:
+    """Fix the slips models make when writing JSON by hand."""
+    candidate = candidate.replace("“", '"').replace("”", '"').replace("’", "'")
+    candidate = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]", "", candidate)
+    candidate = re.sub(r"^\s*//.*$", "", candidate, flags=re.MULTILINE)
+    candidate = _TRAILING_COMMA.sub(r"\1", candidate)
+    # single-quoted keys and Python literals, outside of double-quoted strings
+    parts = re.split(r'("(?:[^"\\]|\\.)*")', candidate)
+    for index in range(0, len(parts), 2):
+        part = re.sub(r"'([^'\n]*)'\s*:", r'"\1":', parts[index])
+        parts[index] = re.sub(r"\b(True|False|None)\b", lambda match: _PYTHON_LITERALS[match.group(1)], part)
+    return "".join(parts)
+
+
+def parse_json_object(text: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    The JSON object a model response carries, or None.
+
+    The whole response is tried first, as returned by structured-output
+    modes, then fenced blocks and then every balanced ``{...}`` span, each
+    as written, repaired and as a Python literal.
+    """
+    if not text:
+        return None
+    candidates = [text.strip()]
+    candidates += [block.strip() for block in _FENCED_JSON.findall(text)]
+    candidates += list(_objects(text))
+    for candidate in candidates:
+        for attempt in (candidate, _repair(candidate)):
+            try:
+                parsed = json.loads(attempt, strict=False)
+            except ValueError:
+                continue
+            if isinstance(parsed, dict):
+                return parsed
+        try:
+            # a Python dict, single quotes and all
+            parsed = ast.literal_eval(candidate)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            continue
+        if isinstance(parsed, dict):
+            return parsed
+    return None
+
+
+def _normalize(key: str) -> str:
+    return re.sub(r"[^a-z]", "", str(key).lower())
+
+
+def _number(value) -> Optional[float]:
+    """Leading number of a value such as 3, "3", "3/4" or "7 (Accept)"."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER.search(str(value))
+    return float(match.group()) if match else None
+
+
+def _record(kind: str, failed: bool):
+    with _parse_lock:
+        counts = _parse_counts.setdefault(kind, [0, 0])
+        counts[0] += failed
+        counts[1] += 1
+        rate = counts[0] / counts[1]
+    from logger import get_logger
+    get_logger().metric(f"{kind}_parse_failure_rate", rate, "ratio")
+
+
+def parse_failure_rate(kind: str) -> float:
+    """Share of responses of a scorer, "review" or "reward", that could not be parsed."""
+    with _parse_lock:
+        failures, total = _parse_counts.get(kind, (0, 0))
+    return failures / total if total else 0.0
+
+
+def weighted_score(ratings: Dict[str, Any]) -> float:
+    """Reward of a review, its ratings weighted by ``REVIEW_WEIGHTS``, from 0 to 10."""
+    total = sum(_weight * float(ratings[_name]) / REVIEW_RATINGS[_name] for _name, _weight in REVIEW_WEIGHTS.items())
+    return total / sum(REVIEW_WEIGHTS.values()) * 10
+
+
+def parse_review(text: Optional[str], ratings=tuple(REVIEW_RATINGS), kind: str = "review") -> Dict[str, Any]:
+    """
+    Ratings of a reviewer response.
+
+    Args:
+        text: Response to the reviewer instructions, structured or free text
+        ratings: Names of the ratings the response must hold
+        kind: Scorer the parse failure rate is reported for
+
+    Returns:
+        The parsed review, with every key of ``ratings`` present and holding
+        an integer clipped to the rating's scale
+
+    Raises:
+        ValueError: A rating is missing from the response
+    """
+    review = parse_json_object(text) or {}
+    by_key = {_normalize(_key): _value for _key, _value in review.items()}
+    missing = []
+    for name in ratings:
+        maximum = REVIEW_RATINGS[name]
+        value = _number(by_key.get(_normalize(name)))
+        if value is None and text:
+            # a rating written outside of any parsable object
+            match = re.search(rf'"?{name}"?\s*[:=]\s*"?([-+]?\d+(?:\.\d+)?)', text, re.IGNORECASE)
+            value = float(match.group(1)) if match else None
+        if value is None:
+            missing.append(name)
+            continue
+        review[name] = min(max(int(round(value)), 1), maximum)
+    _record(kind, bool(missing))
+    if missing:
+        raise ValueError(f"Review is missing the ratings: {', '.join(missing)}")
+    return review
+
+
+def parse_score(text: Optional[str]) -> float:
+    """
+    Score of a reward-model response, from ``{"score": x}``, a ```SCORE
+    block, a ``score: x`` line or a bare number.
+
+    Raises:
+        ValueError: The response holds no score
+    """
+    score = None
+    parsed = parse_json_object(text)
+    if parsed is not None:
+        score = _number({_normalize(_key): _value for _key, _value in parsed.items()}.get("score"))
+    if score is None and text:
+        block = _SCORE_BLOCK.search(text)
+        match = re.search(r"\bscore\b\W{0,3}([-+]?\d+(?:\.\d+)?)", text, re.IGNORECASE)
+        if block is not None:
+            score = _number(block.group(1))
+        elif match is not None:
+            score = float(match.group(1))
+        elif _NUMBER.fullmatch(text.strip()):
+            score = float(text.strip())
+    _record("reward", score is None)
+    if score is None:
+        raise ValueError("Response holds no score")
+    return score
@@ -0,0 +1,73 @@
+import unittest
+from unittest.mock import patch
+import threading
+import types
+import time
+import sys
+import os
+
+# Add parent directory to path to import agents
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+
+# agents pulls in the model clients through inference
+_inference = types.ModuleType("inference")
+_inference.query_model = None
+with patch.dict(sys.modules, {"inference": _inference}):
+    import agents
+
+
+@patch("logger.get_logger")
+class TestReviewersAgent(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.behaviour = {}
+
+    def tearDown(self):
+        # lets a reviewer that was left behind finish
+        self.release.set()
+
+    def get_score(self, outlined_plan, latex, reward_model_llm, reviewer_type=None, openai_api_key=None):
+        index = agents.REVIEWER_PERSONAS.index(reviewer_type)
+        behaviour = self.behaviour.get(index, "ok")
+        if behaviour == "slow":
+            self.release.wait(10)
+        elif behaviour == "raise":
+            raise RuntimeError("reviewer crashed")
+        elif behaviour == "invalid":
+            return None, "Review is missing the ratings: Overall", False
+        return 5.0 + index, f"review {index + 1}", True
+
+    def inference(self, **kwargs):
+        with patch.object(agents, "get_score", self.get_score):
+            return agents.ReviewersAgent(**kwargs).inference("plan", "report")
+
+    def test_every_review_in_reviewer_order(self, get_logger):
+        reviews = self.inference()
+        self.assertEqual(reviews, ", \n".join(f"Reviewer #{_i + 1}:\n{(5.0 + _i, f'review {_i + 1}', True)}" for _i in range(3)))
+        get_logger.return_value.metric.assert_called_with("reviewers_failed", 0, "count")
+
+    def test_slow_reviewer_is_left_out(self, get_logger):
+        self.behaviour = {1: "slow"}
+        start = time.monotonic()
+        reviews = self.inference(reviewer_timeout=0.5)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(reviews, f"Reviewer #1:\n{(5.0, 'review 1', True)}, \nReviewer #3:\n{(7.0, 'review 3', True)}")
+        get_logger.return_value.metric.assert_called_with("reviewers_failed", 1, "count")
+
+    def test_raising_and_invalid_reviewers_are_left_out(self, get_logger):
+        self.behaviour = {0: "raise", 2: "invalid"}
+        reviews = self.inference()
+        self.assertEqual(reviews, f"Reviewer #2:\n{(6.0, 'review 2', True)}")
+        get_logger.return_value.metric.assert_called_with("reviewers_failed", 2, "count")
+
+    def test_no_review(self, get_logger):
+        self.behaviour = {0: "raise", 1: "invalid", 2: "slow"}
+        self.assertEqual(self.inference(reviewer_timeout=0.5), "No reviewer returned a review.")
+        get_logger.return_value.metric.assert_called_with("reviewers_failed", 3, "count")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import sys
+import os
+
+# Add parent directory to path to import autorepair
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from autorepair import repair_program, repair_edit
+from preflight import check_program
+
+PRELUDE = "from utils import *\ntrain_texts = ['a', 'b']\n"
+CODE = ["import numpy as np", "for i in range(3):", "    print(i)", "print('done')"]
+
+
+class TestRepairProgram(unittest.TestCase):
+
+    def test_missing_import(self):
+        repair = repair_program("x = np.arange(3)\nprint(x)", "", PRELUDE)
+        self.assertEqual(repair.code, "import numpy as np\nx = np.arange(3)\nprint(x)")
+        self.assertEqual(repair.fixes, ["added `import numpy as np`"])
+
+    def test_misspelled_name(self):
+        repair = repair_program("print(len(train_txts))", "", PRELUDE)
+        self.assertEqual(repair.code, "print(len(train_texts))")
+
+    def test_indentation(self):
+        self.assertEqual(repair_program("for i in range(3):\nprint(i)", "", PRELUDE).code, "for i in range(3):\n    print(i)")
+        self.assertEqual(repair_program("a = 1\n  b = 2\nprint(a + b)", "", PRELUDE).code, "a = 1\nb = 2\nprint(a + b)")
+        self.assertEqual(repair_program("    a = 1\n    print(a)", "", PRELUDE).code, "a = 1\nprint(a)")
+
+    def test_chained_fixes(self):
+        repair = repair_program("for i in range(3):\nprint(np.sqrt(i))\nprint(train_txts)", "", PRELUDE)
+        self.assertEqual(len(repair.fixes), 3)
+        self.assertIsNone(check_program(repair.code, PRELUDE))
+
+    def test_missing_import_reported_by_run(self):
+        # names after an unresolvable star import are not checked before the run
+        code = "from numpy import *\nprint(math.sqrt(2))"
+        repair = repair_program(code, "[CODE EXECUTION ERROR]: name 'math' is not defined", PRELUDE)
+        self.assertEqual(repair.code, "import math\n" + code)
+        self.assertIsNone(repair_program(code, "[CODE EXECUTION ERROR]: division by zero", PRELUDE))
+
+    def test_unknown_name_is_left_to_the_model(self):
+        self.assertIsNone(repair_program("print(completely_unknown)", "", PRELUDE))
+
+
+class TestRepairEdit(unittest.TestCase):
+
+    def test_range_past_the_end(self):
+        command, fixes = repair_edit("```EDIT 2 4\n    print(i * 2)\nprint('end')\n```", CODE, "pop index out of range", PRELUDE)
+        self.assertEqual(command, "```EDIT 2 3\n    print(i * 2)\nprint('end')\n```")
+        self.assertEqual(fixes, ["edit range 2-4 moved to 2-3"])
+
+    def test_range_off_by_one(self):
+        # replacing lines 2-3 drops the loop body, 1-2 was meant
+        command, _ = repair_edit("```EDIT 2 3\nfor j in range(4):\n    print(j)\n```", CODE, "", PRELUDE)
+        self.assertEqual(command, "```EDIT 1 2\nfor j in range(4):\n    print(j)\n```")
+
+    def test_edited_program_is_repaired_as_a_whole(self):
+        command, fixes = repair_edit("```EDIT 2 2\n    print(pd.Series([i]))\n```", CODE, "", PRELUDE)
+        self.assertTrue(command.startswith("```EDIT 0 3\nimport pandas as pd\n"))
+        self.assertEqual(fixes, ["added `import pandas as pd`"])
+
+    def test_working_edit_is_left_alone(self):
+        self.assertIsNone(repair_edit("```EDIT 2 2\n    print(i * 2)\n```", CODE, "ValueError: bad value", PRELUDE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import sys
+import os
+
+# Add parent directory to path to import condenser
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from condenser import OUTPUT_BUDGETS, collapse_repeats, condense_for, condense_output
+from tools import count_tokens
+
+
+def training_log(steps=500):
+    log = "Loading dataset\n"
+    log += "".join(f"\rEpoch 1: {p}%|{'#' * (p // 10)}{' ' * (10 - p // 10)}| {p}/100 [00:01<00:02, 45.3it/s]"
+                   for p in range(0, 101, 5)) + "\n"
+    log += "\n".join(f"step {i} loss {1 / (i + 1):.4f}" for i in range(steps)) + "\n"
+    log += "\n".join(f"sample {i}: {'word ' * (i % 7)}label={i % 3}" for i in range(200)) + "\n"
+    return log
+
+
+class TestCollapseRepeats(unittest.TestCase):
+
+    def test_lines_differing_only_in_numbers_are_collapsed(self):
+        lines = [f"step {i} loss {i / 10}" for i in range(6)] + ["done"]
+        self.assertEqual(collapse_repeats(lines), ["step 0 loss 0.0", "[... 4 similar lines ...]", "step 5 loss 0.5", "done"])
+
+    def test_short_runs_are_kept(self):
+        lines = ["epoch 1", "epoch 2", "done"]
+        self.assertEqual(collapse_repeats(lines), lines)
+
+
+class TestCondenseOutput(unittest.TestCase):
+
+    def test_short_output_is_unchanged(self):
+        self.assertEqual(condense_output("accuracy: 0.9\n", 100), "accuracy: 0.9\n")
+        self.assertIsNone(condense_output(None, 100))
+        self.assertEqual(condense_output("", 100), "")
+
+    def test_progress_bar_keeps_its_final_state(self):
+        condensed = condense_output(training_log(), 10000)
+        self.assertIn("100%|##########| 100/100", condensed)
+        self.assertNotIn("50%|", condensed)
+        self.assertIn("[... 498 similar lines ...]", condensed)
+
+    def test_budget_keeps_traceback_tail_and_final_metrics(self):
+        log = training_log() + "Test accuracy: 0.8734\nF1: 0.81\n"
+        # in the order the sandbox writes them
+        log += "[CODE EXECUTION ERROR]: shapes not aligned\nTraceback (most recent call last):\n"
+        log += "".join(f'  File "run.py", line {i}, in f{i}\n    g{i}()\n' for i in range(30))
+        log += "ValueError: shapes (3,4) and (5,6) not aligned\n"
+        condensed = condense_output(log, 300)
+        self.assertLessEqual(count_tokens(condensed), 300)
+        self.assertIn("Traceback (most recent call last):", condensed)
+        self.assertIn("ValueError: shapes (3,4) and (5,6) not aligned", condensed)
+        self.assertIn("[CODE EXECUTION ERROR]", condensed)
+        self.assertIn("Test accuracy: 0.8734", condensed)
+        self.assertIn("Loading dataset", condensed)
+        self.assertIn("lines omitted", condensed)
+        # lines are kept in their original order
+        self.assertLess(condensed.index("Loading dataset"), condensed.index("Test accuracy"))
+        self.assertLess(condensed.index("Test accuracy"), condensed.index("ValueError"))
+
+    def test_error_report_before_a_long_traceback_is_kept(self):
+        log = "".join(f"batch {i}: {'token ' * (i % 9)}prediction={i * 7 % 13}\n" for i in range(80))
+        log += "[CODE EXECUTION ERROR]: index 13 is out of bounds for axis 0 with size 13\n"
+        log += "Traceback (most recent call last):\n"
+        log += "".join(f'  File "run.py", line {10 * i}, in layer_{i}\n    return layer_{i + 1}(x[{i}])\n' for i in range(15))
+        log += "IndexError: index 13 is out of bounds for axis 0 with size 13\n"
+        for consumer in ("feedback", "history", "reward"):
+            condensed = condense_for(consumer, log)
+            self.assertIn("[CODE EXECUTION ERROR]: index 13 is out of bounds", condensed)
+            self.assertIn("IndexError: index 13", condensed)
+            self.assertLess(condensed.index("[CODE EXECUTION ERROR]"), condensed.index("Traceback"))
+
+    def test_deterministic(self):
+        log = training_log(2000)
+        self.assertEqual(condense_output(log, 200), condense_output(log, 200))
+
+    def test_long_lines_are_clipped(self):
+        condensed = condense_output("x" * 5000 + "\naccuracy 0.5", 150)
+        self.assertIn("characters ...]", condensed)
+        self.assertIn("accuracy 0.5", condensed)
+
+    def test_condense_for_uses_consumer_budget(self):
+        log = training_log(3000)
+        for consumer, budget in OUTPUT_BUDGETS.items():
+            self.assertLessEqual(count_tokens(condense_for(consumer, log)), budget)
+        with self.assertRaises(KeyError):
+            condense_for("unknown", log)
+
+
+if __name__ == "__main__":
+    unittest.main()
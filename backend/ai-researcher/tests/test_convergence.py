@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Add parent directory to path to import convergence
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from convergence import ConvergenceMonitor
+
+
+class TestConvergenceMonitor(unittest.TestCase):
+
+    def run_loop(self, monitor, scores):
+        steps = 0
+        for score in scores:
+            steps += 1
+            if monitor.update(score):
+                break
+        return steps
+
+    def test_stops_after_patience_steps_without_improvement(self):
+        monitor = ConvergenceMonitor("mle-solver", max_steps=10, patience=2)
+        monitor.start(0.5)
+        with patch("logger.get_logger") as get_logger:
+            steps = self.run_loop(monitor, [0.6, 0.6, 0.6, 0.9, 0.9])
+        self.assertEqual(steps, 3)
+        self.assertEqual(monitor.best_score, 0.6)
+        get_logger.return_value.solver_converged.assert_called_once_with("mle-solver", 3, 7, 0.6)
+
+    def test_improvement_resets_patience(self):
+        monitor = ConvergenceMonitor("paper-solver", max_steps=6, patience=2)
+        monitor.start(5.0)
+        with patch("logger.get_logger") as get_logger:
+            steps = self.run_loop(monitor, [5.0, 6.0, 6.0, 7.0, 7.0, 7.5])
+        self.assertEqual(steps, 6)
+        self.assertFalse(monitor.converged)
+        get_logger.return_value.solver_converged.assert_not_called()
+
+    def test_min_delta(self):
+        monitor = ConvergenceMonitor("mle-solver", max_steps=10, patience=2, min_delta=0.05)
+        monitor.start(0.5)
+        with patch("logger.get_logger"):
+            self.assertEqual(self.run_loop(monitor, [0.52, 0.54, 0.7]), 2)
+
+    def test_failed_steps_count_as_stale(self):
+        monitor = ConvergenceMonitor("mle-solver", max_steps=10, patience=1)
+        monitor.start(None)
+        with patch("logger.get_logger"):
+            self.assertEqual(self.run_loop(monitor, [None, 0.5]), 1)
+
+    def test_disabled(self):
+        monitor = ConvergenceMonitor("mle-solver", max_steps=4, patience=None)
+        monitor.start(0.5)
+        self.assertEqual(self.run_loop(monitor, [0.5] * 4), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import random
+import copy
+import sys
+import os
+
+# Add parent directory to path to import document
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import document
+from document import Document
+
+
+class TestDocument(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = [f"line {i}" for i in range(1000)]
+        self.doc = Document(self.lines)
+
+    def test_reads_like_a_list(self):
+        self.assertEqual(len(self.doc), 1000)
+        self.assertEqual(self.doc[0], "line 0")
+        self.assertEqual(self.doc[-1], "line 999")
+        self.assertEqual(self.doc[10:13], ["line 10", "line 11", "line 12"])
+        self.assertEqual(list(self.doc), self.lines)
+        self.assertEqual("\n".join(self.doc), "\n".join(self.lines))
+        self.assertEqual(self.doc, self.lines)
+        self.assertEqual(repr(Document(["a", "b"])), repr(["a", "b"]))
+        with self.assertRaises(IndexError):
+            self.doc[1000]
+
+    def test_from_text_and_coerce(self):
+        text = "a\nb\n\nc"
+        doc = Document.from_text(text)
+        self.assertEqual(list(doc), ["a", "b", "", "c"])
+        self.assertEqual(doc.text, text)
+        self.assertIs(Document.coerce(doc), doc)
+        self.assertEqual(Document.coerce(["x", "y"]).text, "x\ny")
+        self.assertEqual(len(Document.coerce("")), 0)
+
+    def test_replace_range_matches_list_edit_and_keeps_old_version(self):
+        edited = self.doc.replace_range(100, 103, ["new a", "new b"])
+        expected = self.lines[:100] + ["new a", "new b"] + self.lines[103:]
+        self.assertEqual(list(edited), expected)
+        self.assertEqual(edited.text, "\n".join(expected))
+        self.assertEqual(list(self.doc), self.lines)
+
+    def test_random_edits_against_a_list(self):
+        rng = random.Random(0)
+        doc, lines = self.doc, list(self.lines)
+        for step in range(300):
+            start = rng.randint(0, len(lines))
+            end = rng.randint(start, min(len(lines), start + 20))
+            new = [f"edit {step}.{i}" for i in range(rng.randint(0, 30))]
+            doc = doc.replace_range(start, end, new)
+            lines[start:end] = new
+        self.assertEqual(list(doc), lines)
+        self.assertEqual(len(doc), len(lines))
+        # balanced: height stays logarithmic in the number of leaves
+        self.assertLess(doc._root.height, 20)
+
+    def test_edit_shares_untouched_leaves(self):
+        edited = self.doc.replace_range(500, 501, ["changed"])
+        old_leaves = {id(leaf) for leaf in document._leaves(self.doc._root)}
+        new_leaves = list(document._leaves(edited._root))
+        shared = sum(id(leaf) in old_leaves for leaf in new_leaves)
+        self.assertGreaterEqual(shared, len(new_leaves) - 3)
+
+    def test_replace_range_rejects_out_of_range(self):
+        with self.assertRaises(IndexError):
+            self.doc.replace_range(999, 1001, ["x"])
+        with self.assertRaises(IndexError):
+            self.doc.replace_range(-1, 2, ["x"])
+
+    def test_copy_is_free_and_digest_cached(self):
+        self.assertIs(copy.copy(self.doc), self.doc)
+        self.assertIs(copy.deepcopy(self.doc), self.doc)
+        self.assertEqual(self.doc.digest, Document(self.lines).digest)
+        self.assertNotEqual(self.doc.digest, self.doc.replace_range(0, 1, ["x"]).digest)
+
+    def test_diff_returns_minimal_hunks(self):
+        edited = self.doc.replace_range(10, 12, ["a"]).replace_range(800, 800, ["b", "c"])
+        hunks = self.doc.diff(edited)
+        # line 800 of the edited version is line 801 of the original
+        self.assertEqual(hunks, [(10, 12, ["a"]), (801, 801, ["b", "c"])])
+        self.assertEqual(list(self.doc.apply(hunks)), list(edited))
+        self.assertEqual(self.doc.diff(self.doc), [])
+        self.assertEqual(self.doc.diff(Document(self.lines)), [])
+
+    def test_diff_of_unrelated_documents(self):
+        other = Document(["line 0", "other", "line 999"])
+        self.assertEqual(list(self.doc.apply(self.doc.diff(other))), list(other))
+        self.assertEqual(list(Document().apply(Document().diff(other))), list(other))
+
+
+if __name__ == "__main__":
+    unittest.main()
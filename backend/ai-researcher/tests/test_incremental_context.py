@@ -0,0 +1,107 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Add parent directory to path to import incremental_context
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document import Document
+from incremental_context import CODE_OUTLINE, LATEX_OUTLINE, IncrementalContext, number_lines, outline, unified_diff
+from tools import count_tokens
+
+
+class TestUnifiedDiff(unittest.TestCase):
+
+    def test_numbers_removed_lines_in_old_and_kept_lines_in_new(self):
+        old = Document([f"line {i}" for i in range(10)])
+        new = old.replace_range(3, 5, ["new 3"])
+        self.assertEqual(unified_diff(old, new, context=1), [
+            "@@ -2,4 +2,3 @@",
+            " 2 |line 2",
+            "-3 |line 3",
+            "-4 |line 4",
+            "+3 |new 3",
+            " 4 |line 5",
+        ])
+
+    def test_separate_hunks_track_the_shift(self):
+        old = Document([f"line {i}" for i in range(40)])
+        new = old.replace_range(2, 2, ["a", "b"]).replace_range(32, 33, ["c"])
+        diff = unified_diff(old, new, context=0)
+        self.assertEqual(diff[0], "@@ -2,0 +2,2 @@")
+        self.assertIn("@@ -30,1 +32,1 @@", diff)
+        self.assertIn("-30 |line 30", diff)
+        self.assertIn("+32 |c", diff)
+
+    def test_identical_documents_have_no_hunks(self):
+        doc = Document(["a", "b"])
+        self.assertEqual(unified_diff(doc, Document(["a", "b"])), [])
+
+
+class TestOutline(unittest.TestCase):
+
+    def test_code_and_latex_outlines(self):
+        code = Document(["import numpy as np", "# Load data", "x = 1", "for i in range(3):", "    print(i)"])
+        self.assertEqual(outline(code, CODE_OUTLINE), ["1 |# Load data", "3 |for i in range(3):"])
+        paper = Document(["\\title{T}", "text", "\\section{Intro}", "\\begin{figure}[h]"])
+        self.assertEqual(outline(paper, LATEX_OUTLINE), ["0 |\\title{T}", "2 |\\section{Intro}", "3 |\\begin{figure}[h]"])
+
+    def test_long_outline_is_elided(self):
+        paper = Document([f"\\section{{S{i}}}" for i in range(5)])
+        self.assertEqual(outline(paper, LATEX_OUTLINE, limit=2)[-1], "... 3 more")
+
+
+@patch("logger.get_logger")
+class TestIncrementalContext(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = Document([f"x{i} = {i}  # a longer line so the listing costs tokens" for i in range(200)])
+        self.context = IncrementalContext("code", CODE_OUTLINE, "mlesolver")
+
+    def test_first_turn_sends_the_listing(self, get_logger):
+        note = self.context.render(self.doc)
+        self.assertIn("exactly the listing", note)
+        self.assertEqual(self.context.listing(), number_lines(self.doc))
+        self.assertEqual(self.context.full_sends, 1)
+
+    def test_later_turns_send_a_diff_and_count_the_cached_prefix(self, get_logger):
+        self.context.render(self.doc)
+        edited = self.doc.replace_range(50, 51, ["y = 2"])
+        changes = self.context.render(edited)
+        self.assertIn("+50 |y = 2", changes)
+        self.assertIn("Outline of your current code (200 lines)", changes)
+        # the listing stays the reference one
+        self.assertEqual(self.context.listing(), number_lines(self.doc))
+        self.assertEqual((self.context.full_sends, self.context.diff_sends), (1, 1))
+        # the unchanged listing is counted, not the listing minus the diff
+        self.assertEqual(self.context.cached_prefix_tokens, count_tokens(number_lines(self.doc)))
+        get_logger.return_value.metric.assert_any_call("mlesolver_prompt_cached_prefix_tokens", self.context.cached_prefix_tokens, "tokens")
+
+    def test_resync_resends_the_listing(self, get_logger):
+        self.context.render(self.doc)
+        edited = self.doc.replace_range(0, 1, ["y = 2"])
+        self.context.resync()
+        self.assertIn("exactly the listing", self.context.render(edited))
+        self.assertEqual(self.context.listing(), number_lines(edited))
+        self.assertEqual(self.context.full_sends, 2)
+
+    def test_large_change_resends_the_listing(self, get_logger):
+        self.context.render(self.doc)
+        rewritten = Document([f"z{i} = {i}" for i in range(200)])
+        self.assertIn("exactly the listing", self.context.render(rewritten))
+        self.assertEqual(self.context.listing(), number_lines(rewritten))
+
+    def test_describe_history_versions(self, get_logger):
+        self.assertEqual(self.context.describe(self.doc), repr(self.doc))
+        self.context.render(self.doc)
+        self.assertIn("identical", self.context.describe(list(self.doc)))
+        described = self.context.describe(self.doc.replace_range(3, 4, ["y = 2"]))
+        self.assertIn("+3 |y = 2", described)
+        self.assertGreater(self.context.history_tokens_saved, 0)
+        # a short version is cheaper in full than as a diff
+        self.assertEqual(self.context.describe(["a"]), repr(["a"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
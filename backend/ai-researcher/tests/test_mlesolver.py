@@ -0,0 +1,121 @@
+import unittest
+from unittest.mock import patch
+import tempfile
+import types
+import time
+import sys
+import os
+
+# Add parent directory to path to import mlesolver
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+import sandbox
+from result_cache import ResultCache
+
+# mlesolver pulls in the model clients through inference and common_imports
+_common_imports = types.ModuleType("common_imports")
+exec("import os, sys, json, time, re, logging, warnings, random", _common_imports.__dict__)
+_inference = types.ModuleType("inference")
+_inference.query_model = None
+with patch.dict(sys.modules, {"common_imports": _common_imports, "inference": _inference}):
+    import mlesolver
+
+# both candidates read data.txt and write submission.csv, each while the other is running
+PROGRAMS = {
+    "best": "import time\nwith open('submission.csv', 'w') as f:\n    time.sleep(1)\n    f.write(open('data.txt').read() + 'best')\nprint('best')",
+    "worse": "import time\nwith open('submission.csv', 'w') as f:\n    time.sleep(1)\n    f.write(open('data.txt').read() + 'worse')\nwith open('worse.txt', 'w') as f:\n    f.write('worse')\nprint('worse')",
+}
+
+
+class TestPopulationFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        with open("data.txt", "w") as f:
+            f.write("data ")
+        self.cache = ResultCache(os.path.join(self.tmp.name, "cache.db"))
+        self.names = iter(PROGRAMS)
+        self.patchers = [patch.object(tools, "get_result_cache", return_value=self.cache),
+                         patch.object(tools, "USE_SANDBOX_POOL", False),
+                         patch.object(tools, "_report_run_stats"),
+                         patch.object(mlesolver, "query_model", self.query_model),
+                         patch.object(mlesolver, "get_score", lambda plan, code, *args, **kwargs: (1.0 if "best" in code else 0.5, "ok", True)),
+                         patch.object(mlesolver.MLESolver, "system_prompt", return_value="")]
+        for patcher in self.patchers:
+            patcher.start()
+        self.solver = mlesolver.MLESolver.__new__(mlesolver.MLESolver)
+        self.solver.__dict__.update(
+            supress_print=True, dataset_code="data = 1", plan="", llm_str="model", model="model", openai_api_key=None,
+            commands=[mlesolver.Replace()], code_lines=str(), clear_figures=True, prev_code_ret=None, should_execute_code=False,
+            code_context=None, repair_stats={"local": 0, "llm": 0}, prev_run_stats=dict(), candidate_root=None)
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        os.chdir(self.cwd)
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def query_model(self, **kwargs):
+        return f"```REPLACE\n{PROGRAMS[next(self.names)]}\n```"
+
+    def test_candidates_run_concurrently_in_their_own_directories(self):
+        start = time.monotonic()
+        candidates = self.solver.evaluate_candidates("prompt", [str(), str()])
+        self.assertLess(time.monotonic() - start, 1.9)
+        by_output = {_cand["prev_code_ret"].strip(): _cand for _cand in candidates}
+        # every candidate read the inputs and saw only its own files
+        self.assertNotEqual(by_output["best"]["run"].path, by_output["worse"]["run"].path)
+        self.assertEqual(by_output["best"]["run"].files, {"submission.csv"})
+        self.assertEqual(by_output["worse"]["run"].files, {"submission.csv", "worse.txt"})
+        with open(os.path.join(by_output["worse"]["run"].path, "submission.csv")) as f:
+            self.assertEqual(f.read(), "data worse")
+        # only the chosen candidate's files reach the working directory
+        self.assertFalse(os.path.exists("submission.csv"))
+        mlesolver.keep_candidate_files(by_output["best"])
+        with open("submission.csv") as f:
+            self.assertEqual(f.read(), "data best")
+        self.assertFalse(os.path.exists("worse.txt"))
+        # the cache holds each program with its own files, and restores them on a hit
+        self.assertEqual(len(self.cache), 2)
+        os.remove(os.path.join(by_output["worse"]["run"].path, "submission.csv"))
+        with sandbox.working_directory(by_output["worse"]["run"].path):
+            tools.execute_code(PROGRAMS["worse"], prelude="data = 1", incremental=True, use_cache=True, MAX_LEN=mlesolver.CAPTURE_LIMIT)
+        with open(os.path.join(by_output["worse"]["run"].path, "submission.csv")) as f:
+            self.assertEqual(f.read(), "data worse")
+
+    def test_repair_stats_are_merged(self):
+        def process_command(solver, model_resp):
+            solver.repair_stats["llm"] += 1
+            if "best" in model_resp: solver.repair_stats["local"] += 1
+            return "ok", None, None, False, None
+        with patch.object(mlesolver.MLESolver, "process_command", process_command), patch("logger.get_logger") as get_logger:
+            self.solver.evaluate_candidates("prompt", [str(), str()])
+        self.assertEqual(self.solver.repair_stats, {"local": 1, "llm": 2})
+        get_logger.return_value.metric.assert_called_with("code_repair_local_rate", 1 / 3, "ratio")
+
+
+@patch("logger.get_logger")
+class TestGetScore(unittest.TestCase):
+
+    def test_reward_prompt_asks_for_the_json_score(self, get_logger):
+        queries = []
+
+        def query_model(**kwargs):
+            queries.append(kwargs)
+            return '{"score": 0.75}'
+        with patch.object(mlesolver, "query_model", query_model), patch.object(mlesolver, "cached_score", return_value=None), \
+                patch.object(mlesolver, "store_score"):
+            score, _, is_valid = mlesolver.get_score("plan", "code", "output", REWARD_MODEL_LLM="deepseek-chat")
+        self.assertEqual((score, is_valid), (0.75, True))
+        # the prompt names JSON and the fields of the schema sent along with it
+        self.assertIn('{"score": <float between 0 and 1>}', queries[0]["system_prompt"])
+        self.assertNotIn("```SCORE", queries[0]["system_prompt"])
+        self.assertIs(queries[0]["json_schema"], mlesolver.SCORE_SCHEMA)
+
+
+if __name__ == "__main__":
+    unittest.main()
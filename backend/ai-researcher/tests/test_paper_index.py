@@ -0,0 +1,89 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add parent directory to path to import paper_index
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from paper_index import PaperIndex, record_keys
+
+
+def paper(title, summary, **fields):
+    record = {"title": title, "summary": summary}
+    record.update(fields)
+    return record
+
+
+class TestPaperIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PaperIndex(":memory:")
+        self.index.add_records([
+            paper("Graph Neural Networks for Molecules", "message passing on molecular graphs", arxiv_id="2401.00001v1"),
+            paper("Vision Transformers", "attention for image classification", arxiv_id="2401.00002v1", doi="10.1/VIT"),
+            paper("Protein Folding with Attention", "attention based structure prediction"),
+        ], source="arxiv")
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_record_keys(self):
+        self.assertEqual(record_keys({"doi": "10.1/X", "arxiv_id": "2401.1v3", "title": "A  Title!"}),
+                         ["doi:10.1/x", "arxiv:2401.1", "title:a title"])
+        self.assertEqual(record_keys({}), [])
+
+    def test_search_ranks_title_matches_first(self):
+        results = self.index.search("attention", require_all=False)
+        self.assertEqual([r["title"] for r in results][0], "Protein Folding with Attention")
+        self.assertEqual(len(results), 2)
+
+    def test_search_requires_all_terms(self):
+        self.assertEqual(len(self.index.search("attention image")), 1)
+        self.assertEqual(len(self.index.search("attention quantum")), 0)
+        self.assertEqual(self.index.search("!!"), [])
+
+    def test_duplicates_are_merged(self):
+        self.index.add_records([paper("Vision transformers", "a much longer abstract about attention for images",
+                                      doi="10.1/vit", citations=40)], source="semantic_scholar")
+        self.assertEqual(len(self.index), 3)
+        result = self.index.search("vision")[0]
+        self.assertEqual(result["citations"], 40)
+        self.assertEqual(result["arxiv_id"], "2401.00002v1")
+        self.assertEqual(result["sources"], ["arxiv", "semantic_scholar"])
+        self.assertEqual(len(self.index.search("longer abstract")), 1)
+
+    def test_search_by_source(self):
+        self.index.add_records([paper("Attention in web pages", "attention blog post")], source="firecrawl")
+        self.assertEqual(len(self.index.search("attention", require_all=False)), 3)
+        results = self.index.search("attention", require_all=False, sources=["arxiv", "semantic_scholar"])
+        self.assertEqual(len(results), 2)
+        self.assertNotIn("Attention in web pages", [r["title"] for r in results])
+        self.assertEqual(self.index.search("attention", sources=[]), [])
+
+    def test_full_text_is_searchable(self):
+        self.index.add_full_text("2401.00001v1", "we evaluate on the qm9 benchmark", budget=1000)
+        self.assertEqual(self.index.search("qm9")[0]["arxiv_id"], "2401.00001v1")
+        self.assertTrue(self.index.search("qm9")[0]["has_full_text"])
+
+    def test_full_text_respects_budget(self):
+        self.index.add_full_text("2401.00001v1", "a" * 100, budget=100)
+        self.assertEqual(self.index.get_full_text("2401.00001", 50), "a" * 50)
+        self.assertIsNone(self.index.get_full_text("2401.00001v1", 200))
+        self.index.add_full_text("2401.00002v1", "short", budget=100)
+        self.assertEqual(self.index.get_full_text("2401.00002v1", 200), "short")
+        self.assertIsNone(self.index.get_full_text("2401.99999v1", 200))
+
+    def test_persists_across_connections(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index.db")
+            index = PaperIndex(path)
+            index.add_records([paper("Sparse Autoencoders", "dictionary learning")])
+            index.close()
+            index = PaperIndex(path)
+            self.assertEqual(len(index.search("sparse autoencoders")), 1)
+            index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
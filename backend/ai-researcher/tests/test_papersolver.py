@@ -0,0 +1,116 @@
+import unittest
+from unittest.mock import ANY, patch
+import tempfile
+import threading
+import types
+import sys
+import os
+
+# Add parent directory to path to import papersolver
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+
+# papersolver pulls in the model clients through inference and common_imports
+_common_imports = types.ModuleType("common_imports")
+exec("import os, sys, json, time, re, logging, warnings, random", _common_imports.__dict__)
+_inference = types.ModuleType("inference")
+_inference.query_model = None
+with patch.dict(sys.modules, {"common_imports": _common_imports, "inference": _inference}):
+    import papersolver
+
+SCAFFOLD = ("\\documentclass{article}\n\\begin{document}\n"
+            + "\n".join(f"\\section{{{_section}}}\n[{_section.upper()} HERE]" for _section in papersolver.PAPER_SECTIONS)
+            + "\n\\end{document}")
+
+
+class FakeArxivSearch:
+    instances = 0
+
+    def __init__(self):
+        FakeArxivSearch.instances += 1
+
+    def find_papers_by_str(self, query, N=10):
+        return "Title: Prior work\narXiv paper ID: 2301.00001v1"
+
+
+@patch("logger.get_logger")
+class TestInitialReport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.lock = threading.Lock()
+        FakeArxivSearch.instances = 0
+        self.scaffolds = 0
+        self.drafts = []
+        self.compiles = []
+        self.patchers = [patch.object(papersolver, "query_model", self.query_model),
+                         patch.object(papersolver, "compile_latex", self.compile_latex),
+                         patch.object(papersolver, "ArxivSearch", FakeArxivSearch)]
+        for patcher in self.patchers:
+            patcher.start()
+        self.solver = papersolver.PaperSolver("model", plan="plan", topic="topic", compile_pdf=False, save_loc=self.tmp.name)
+        self.solver.supress_print = True
+        # as set up by initial_solve
+        self.solver.commands = [papersolver.PaperReplace(self.tmp.name)]
+        self.solver.model = "model"
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.tmp.cleanup()
+
+    def query_model(self, model_str, prompt, system_prompt, **kwargs):
+        if "research paper finder" in system_prompt:
+            return "query"
+        with self.lock:
+            if "scaffolding" in system_prompt:
+                self.scaffolds += 1
+                # the first scaffold forgets the placeholders
+                return f"```REPLACE\n{SCAFFOLD if self.scaffolds > 1 else SCAFFOLD.split('[')[0]}\n```"
+            section = system_prompt.split("generate latex for the following ")[1].split(".")[0]
+            self.drafts.append(section)
+            # the first results draft compiles on its own but breaks the merged paper
+            broken = section == "results" and self.drafts.count("results") == 1
+        return f"```REPLACE\nText of {section}.{' BROKEN' if broken else ''}\n```"
+
+    def compile_latex(self, latex, save_loc, compile=True):
+        with self.lock:
+            self.compiles.append(latex)
+        if "BROKEN" in latex and latex.count("Text of") > 1:
+            return "[CODE EXECUTION ERROR]: Undefined control sequence"
+        return "Compilation successful"
+
+    def test_drafts_land_in_their_placeholders(self, get_logger):
+        latex_lines, _, _ = self.solver.gen_initial_report()
+        paper = "\n".join(latex_lines)
+        for section in papersolver.PAPER_SECTIONS:
+            self.assertIn(f"\\section{{{section}}}\nText of {section}.", paper)
+        self.assertNotIn("HERE]", paper)
+        self.assertNotIn("BROKEN", paper)
+        self.assertEqual(self.solver.paper_lines.text, paper)
+        # citing sections were drafted with their related work
+        self.assertEqual(sorted(self.solver.section_related_work), sorted(papersolver.CITING_SECTIONS))
+        # the concurrent searches share one client, so its request spacing applies across them
+        self.assertEqual(FakeArxivSearch.instances, 1)
+        get_logger.return_value.metric.assert_any_call("papersolver_initial_draft_time", ANY, "seconds")
+
+    def test_scaffold_without_placeholders_is_retried(self, get_logger):
+        self.solver.gen_initial_report()
+        self.assertEqual(self.scaffolds, 2)
+        # the scaffold missing its placeholders never reached the compiler
+        self.assertTrue(all("[ABSTRACT HERE]" in _latex or "Text of" in _latex for _latex in self.compiles))
+
+    def test_draft_breaking_the_merged_paper_is_redrafted_against_it(self, get_logger):
+        self.solver.gen_initial_report()
+        self.assertEqual(self.drafts.count("results"), 2)
+        self.assertEqual(len(self.drafts), len(papersolver.PAPER_SECTIONS) + 1)
+        # the redraft was compiled into the paper merged so far, not into the bare scaffold
+        redraft = next(_latex for _latex in self.compiles if "Text of results." in _latex and "BROKEN" not in _latex)
+        for section in papersolver.PAPER_SECTIONS[:papersolver.PAPER_SECTIONS.index("results")]:
+            self.assertIn(f"Text of {section}.", redraft)
+        self.assertIn("[DISCUSSION HERE]", redraft)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+import threading
+
+# Add parent directory to path to import pdf_extract
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_extract
+from pdf_extract import extract_text, PdfExtractionError, PdfExtractionTimeout
+from benchmarks.bench_pdf_extract import write_synthetic_pdf
+
+
+class TestPdfExtract(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.tmp.name, "paper.pdf")
+        write_synthetic_pdf(cls.path, num_pages=30)
+
+    @classmethod
+    def tearDownClass(cls):
+        pdf_extract.shutdown_pool()
+        cls.tmp.cleanup()
+
+    def test_page_markers(self):
+        text = extract_text(self.path, page_markers=True)
+        self.assertTrue(text.startswith("--- Page 1 ---"))
+        self.assertIn("--- Page 30 ---", text)
+
+    def test_budget_stops_early(self):
+        with patch.object(pdf_extract, "_format_page", wraps=pdf_extract._format_page) as fmt:
+            text = extract_text(self.path, max_chars=2000, parallel=False)
+        self.assertEqual(len(text), 2000)
+        self.assertLess(fmt.call_count, 30)
+
+    def test_parallel_matches_serial(self):
+        serial = extract_text(self.path, page_markers=True, parallel=False)
+        with patch.object(pdf_extract.os, "cpu_count", return_value=2), patch.object(pdf_extract, "MAX_WORKERS", 2):
+            pooled = extract_text(self.path, page_markers=True)
+        self.assertEqual(serial, pooled)
+
+    def test_bytes_source(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        self.assertEqual(extract_text(data, max_chars=500), extract_text(self.path, max_chars=500))
+
+    def test_timeout(self):
+        with self.assertRaises(PdfExtractionTimeout):
+            extract_text(self.path, timeout=0)
+
+    def test_invalid_pdf(self):
+        with self.assertRaises(PdfExtractionError):
+            extract_text(b"not a pdf")
+
+
+class TestSharedPool(unittest.TestCase):
+
+    def tearDown(self):
+        pdf_extract.shutdown_pool()
+
+    def test_concurrent_callers_share_one_pool(self):
+        pools = []
+        threads = [threading.Thread(target=lambda: pools.append(pdf_extract._acquire_pool(2))) for _ in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(len(set(map(id, pools))), 1)
+        for pool in pools:
+            pdf_extract._release_pool(pool)
+
+    def test_timeout_retires_the_pool_without_breaking_other_callers(self):
+        other = pdf_extract._acquire_pool(2)
+        timed_out = pdf_extract._acquire_pool(2)
+        pdf_extract._release_pool(timed_out, discard=True)
+        # the other caller keeps using the retired pool, new work gets a fresh one
+        self.assertEqual(other.apply_async(abs, (-3,)).get(timeout=30), 3)
+        fresh = pdf_extract._acquire_pool(2)
+        self.assertIsNot(fresh, other)
+        pdf_extract._release_pool(fresh)
+        # the last caller terminates the retired pool
+        pdf_extract._release_pool(other)
+        with self.assertRaises(ValueError):
+            other.apply_async(abs, (-3,))
+        self.assertEqual(fresh.apply_async(abs, (-4,)).get(timeout=30), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
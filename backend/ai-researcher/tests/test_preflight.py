@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Add parent directory to path to import preflight
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+from preflight import check_program, find_issues
+
+PRELUDE = "from datasets import load_dataset\nds = load_dataset('imdb')\ntrain_texts = ds['train']['text']\n"
+
+
+class TestPreflight(unittest.TestCase):
+
+    def kinds(self, code, prelude=PRELUDE):
+        return [(issue.line, issue.kind) for issue in find_issues(code, prelude)]
+
+    def test_valid_program_passes(self):
+        code = ("import numpy as np\n"
+                "lengths = np.array([len(t) for t in train_texts])\n"
+                "def summarize(values, scale=1):\n"
+                "    return values.mean() * scale\n"
+                "for i, value in enumerate(lengths[:3]):\n"
+                "    print(i, summarize(lengths), value)\n"
+                "with open('out.txt', 'w') as f:\n"
+                "    f.write(str(lengths.max()))\n")
+        self.assertIsNone(check_program(code, PRELUDE))
+
+    def test_syntax_error(self):
+        report = check_program("x = 1\nfor i in range(3)\n    print(i)\n")
+        self.assertTrue(report.startswith("[CODE EXECUTION ERROR]"))
+        self.assertIn("line 2:18: SyntaxError: expected ':'", report)
+        self.assertIn("    for i in range(3)\n                     ^", report)
+
+    def test_forbidden_calls(self):
+        self.assertEqual(self.kinds("import sys\nprint(1)\nsys.exit(0)\nexit()"),
+                         [(3, "ForbiddenCall"), (4, "ForbiddenCall")])
+        self.assertEqual(self.kinds("def exit_code():\n    return 0\nprint(exit_code())"), [])
+
+    def test_undefined_names(self):
+        report = check_program("model = 1\nprint(modle, train_texts, remove_figures())", "from utils import *\n" + PRELUDE)
+        self.assertIn("line 2:7: NameError: name 'modle' is not defined", report)
+        self.assertIn("    print(modle, train_texts, remove_figures())\n          ^^^^^", report)
+        self.assertNotIn("name 'train_texts'", report)
+        self.assertNotIn("name 'remove_figures'", report)
+
+    def test_names_bound_later_or_in_any_scope(self):
+        self.assertEqual(self.kinds("def f():\n    return helper()\ndef helper():\n    return [y for y in range(2)]\nprint(f())"), [])
+        self.assertEqual(self.kinds("try:\n    print(maybe_defined)\nexcept NameError:\n    pass"), [])
+
+    def test_dynamic_programs_skip_name_checks(self):
+        self.assertEqual(self.kinds("globals()['x'] = 1\nprint(x)"), [])
+        self.assertEqual(self.kinds("from numpy import *\nprint(array([1]))"), [])
+        self.assertEqual(self.kinds("print(whatever)", prelude="from sklearn.metrics import *\n"), [])
+
+    def test_execute_code_rejects_without_running(self):
+        with patch.object(tools, "get_sandbox_pool") as pool, patch.object(tools, "_execute_code_process") as process:
+            output, stats = tools.execute_code("print(undefined_thing)", return_stats=True)
+        pool.assert_not_called()
+        process.assert_not_called()
+        self.assertIn("NameError: name 'undefined_thing' is not defined", output)
+        self.assertEqual(stats, {"status": "rejected"})
+
+
+if __name__ == "__main__":
+    unittest.main()
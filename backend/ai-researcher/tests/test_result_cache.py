@@ -0,0 +1,146 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+import threading
+import time
+
+# Add parent directory to path to import result_cache
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+from result_cache import ResultCache, is_cacheable, seed_marker, directory_state, changed_files
+
+
+class TestCacheability(unittest.TestCase):
+
+    def test_plain_program(self):
+        self.assertTrue(is_cacheable("import numpy as np\nprint(np.arange(3).sum())"))
+
+    def test_clock_is_not_cacheable(self):
+        self.assertFalse(is_cacheable("import time\nstart = time.time()\nprint(1)"))
+        self.assertFalse(is_cacheable("from datetime import datetime\nprint(datetime.now())"))
+
+    def test_randomness_needs_a_seed(self):
+        self.assertFalse(is_cacheable("import random\nprint(random.random())"))
+        self.assertTrue(is_cacheable("import random\nrandom.seed(0)\nprint(random.random())"))
+        self.assertFalse(is_cacheable("X_train, X_test = train_test_split(X)"))
+        self.assertTrue(is_cacheable("X_train, X_test = train_test_split(X, random_state=42)"))
+
+    def test_seed_marker(self):
+        self.assertEqual(seed_marker("np.random.seed( 1 )\ntorch.manual_seed(2)"), "np.random.seed(1)|torch.manual_seed(2)")
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(os.path.join(self.tmp.name, "cache.db"), max_bytes=1000, max_entries=3)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def test_key_depends_on_program_and_options(self):
+        key = self.cache.key("print(1)", limits=None)
+        self.assertEqual(key, self.cache.key("print(1)", limits=None))
+        self.assertNotEqual(key, self.cache.key("print(2)", limits=None))
+        self.assertNotEqual(key, self.cache.key("print(1)", limits={"cpu": 5}))
+
+    def test_round_trip_restores_files(self):
+        self.cache.put("k", "output\n", {"wall_time": 1.0}, {"Figure_1.png": b"png"})
+        out_dir = os.path.join(self.tmp.name, "out")
+        os.mkdir(out_dir)
+        self.assertEqual(self.cache.get("k", out_dir), ("output\n", {"wall_time": 1.0}))
+        with open(os.path.join(out_dir, "Figure_1.png"), "rb") as f:
+            self.assertEqual(f.read(), b"png")
+        self.assertIsNone(self.cache.get("missing"))
+        self.assertEqual(self.cache.hit_rate(), 0.5)
+
+    def test_least_recently_used_is_evicted(self):
+        for key in ("a", "b", "c"):
+            self.cache.put(key, key, {})
+        self.cache.get("a", self.tmp.name)
+        self.cache.put("d", "d", {})
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("a", self.tmp.name))
+
+    def test_size_bound(self):
+        self.cache.put("small", "x" * 400, {})
+        self.cache.put("large", "y" * 700, {})
+        self.assertIsNone(self.cache.get("small"))
+        self.cache.put("huge", "z" * 2000, {})
+        self.assertIsNone(self.cache.get("huge"))
+
+    def test_changed_files(self):
+        before = directory_state(self.tmp.name)
+        with open(os.path.join(self.tmp.name, "submission.csv"), "w") as f:
+            f.write("id,label\n")
+        self.assertEqual(changed_files(before, self.tmp.name), {"submission.csv": b"id,label\n"})
+        self.assertIsNone(changed_files(before, self.tmp.name, max_bytes=3))
+
+
+class TestExecuteCodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.cache = ResultCache(os.path.join(self.tmp.name, "cache.db"))
+        self.patchers = [patch.object(tools, "get_result_cache", return_value=self.cache),
+                         patch.object(tools, "USE_SANDBOX_POOL", False),
+                         patch.object(tools, "_report_run_stats")]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        os.chdir(self.cwd)
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def test_identical_program_is_not_rerun(self):
+        code = "with open('runs.txt', 'a') as f:\n    f.write('x')\nprint('done')"
+        first = tools.execute_code(code, timeout=60, use_cache=True, return_stats=True)
+        second = tools.execute_code(code, timeout=60, use_cache=True, return_stats=True)
+        self.assertEqual(first[0], second[0])
+        self.assertTrue(second[1]["cached"])
+        with open("runs.txt") as f:
+            self.assertEqual(f.read(), "x")
+
+    def test_unseeded_program_always_runs(self):
+        code = "import random\nprint(random.random())"
+        first = tools.execute_code(code, timeout=60, use_cache=True)
+        self.assertNotEqual(first, tools.execute_code(code, timeout=60, use_cache=True))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_timeout_is_not_cached(self):
+        tools.execute_code("while True: pass", timeout=0.5, use_cache=True)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_failed_program_is_not_cached(self):
+        code = "with open('runs.txt', 'a') as f:\n    f.write('x')\nprint(1 / 0)"
+        tools.execute_code(code, timeout=60, use_cache=True)
+        self.assertIn("[CODE EXECUTION ERROR]", tools.execute_code(code, timeout=60, use_cache=True))
+        self.assertEqual(len(self.cache), 0)
+        with open("runs.txt") as f:
+            self.assertEqual(f.read(), "xx")
+
+    def test_overlapping_runs_are_not_cached(self):
+        slow = "import time\ntime.sleep(1)\nwith open('slow.txt', 'w') as f:\n    f.write('slow')"
+        thread = threading.Thread(target=tools.execute_code, args=(slow,), kwargs={"timeout": 60, "use_cache": True})
+        thread.start()
+        time.sleep(0.2)
+        tools.execute_code("with open('fast.txt', 'w') as f:\n    f.write('fast')", timeout=60, use_cache=True)
+        thread.join()
+        # neither run can tell which of the two files it wrote
+        self.assertEqual(len(self.cache), 0)
+        tools.execute_code(slow, timeout=60, use_cache=True)
+        self.assertEqual(len(self.cache), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,358 @@
+import unittest
+import sys
+import os
+import time
+import tempfile
+import threading
+
+# Add parent directory to path to import sandbox
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sandbox import SandboxPool, SandboxTimeout, SandboxCrash, split_cells, BoundedOutput, truncate_output, working_directory
+
+
+class TestSandboxPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SandboxPool(size=1, max_runs=3, preload=["json"])
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_output_is_captured(self):
+        self.assertEqual(self.pool.run("print('hello')\nprint(__name__)"), "hello\n__main__\n")
+
+    def test_exception_is_reported(self):
+        output = self.pool.run("print('before')\nraise ValueError('bad value')")
+        self.assertTrue(output.startswith("before\n[CODE EXECUTION ERROR]: bad value\n"))
+        self.assertIn("Traceback", output)
+
+    def test_namespace_is_fresh_and_worker_reused(self):
+        self.pool.run("x = 1\nimport os\nprint(os.getpid())")
+        output = self.pool.run("print('x' in globals())")
+        self.assertEqual(output, "False\n")
+        self.assertEqual(self.pool.stats["workers_started"], 1)
+
+    def test_program_state_does_not_leak(self):
+        self.pool.run("import json\njson.FOO = 1\nimport sys\nsys.modules['_leftover'] = 1")
+        output = self.pool.run("import json, sys\nprint(hasattr(json, 'FOO'), '_leftover' in sys.modules)")
+        self.assertEqual(output, "False False\n")
+        self.assertEqual(self.pool.stats["workers_started"], 1)
+
+    def test_open_figures_do_not_leak(self):
+        self.pool.run("import matplotlib\nmatplotlib.use('Agg')\nimport matplotlib.pyplot as plt\nplt.plot([1, 2])\nplt.plot([2, 1])")
+        output = self.pool.run("import matplotlib\nmatplotlib.use('Agg')\nimport matplotlib.pyplot as plt\nprint(len(plt.gca().lines))")
+        self.assertEqual(output, "0\n")
+
+    def test_worker_recycled_after_max_runs(self):
+        # programs run in children of the worker
+        pids = [self.pool.run("import os\nprint(os.getppid())") for _ in range(4)]
+        self.assertEqual(len(set(pids[:3])), 1)
+        self.assertNotEqual(pids[2], pids[3])
+        self.assertEqual(self.pool.stats["recycled"], 1)
+
+    def test_program_memory_is_not_kept_by_the_worker(self):
+        self.pool.max_rss_growth = 16 * 1024 * 1024
+        self.pool.run("blob = bytearray(64 * 1024 * 1024)\nimport sys\nsys.modules['_keep'] = blob")
+        self.assertEqual(self.pool.stats["recycled"], 0)
+
+    def test_timeout_kills_worker(self):
+        start = time.monotonic()
+        with self.assertRaises(SandboxTimeout):
+            self.pool.run("import time\ntime.sleep(10)", timeout=0.5)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(self.pool.run("print('recovered')"), "recovered\n")
+
+    def test_crash_is_reported(self):
+        with self.assertRaises(SandboxCrash):
+            self.pool.run("import os\nos._exit(3)")
+        self.assertEqual(self.pool.run("print('ok')"), "ok\n")
+
+    def test_system_exit_ends_program_only(self):
+        self.assertEqual(self.pool.run("print(1)\nraise SystemExit\nprint(2)"), "1\n")
+        self.assertEqual(self.pool.stats["workers_started"], 1)
+
+    def test_runs_in_callers_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                output = self.pool.run("import os\nprint(os.getcwd())")
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(output.strip(), os.path.realpath(tmp))
+
+    def test_runs_in_threads_working_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with working_directory(tmp):
+                output = self.pool.run("import os\nprint(os.getcwd())")
+            self.assertEqual(output.strip(), os.path.realpath(tmp))
+            # other threads still run in the process's directory
+            self.assertEqual(self.pool.run("import os\nprint(os.getcwd())").strip(), os.getcwd())
+
+
+PRELUDE = "import os\nprint('loading')\ndata = list(range(5))\nloaded_by = os.getpid()"
+
+
+class TestSandboxTemplates(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SandboxPool(size=2, preload=["json"])
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_prelude_runs_once(self):
+        first = self.pool.run("data.append(5)\nprint(sum(data))", prelude=PRELUDE)
+        second = self.pool.run("print(sum(data), loaded_by != os.getpid())", prelude=PRELUDE)
+        self.assertEqual(first, "loading\n15\n")
+        # the first run's mutation is not visible, every run gets a copy
+        self.assertEqual(second, "loading\n10 True\n")
+        self.assertEqual(self.pool.stats["template_loads"], 1)
+        self.assertEqual(self.pool.stats["template_hits"], 1)
+
+    def test_changed_prelude_reloads(self):
+        self.pool.run("print(data)", prelude=PRELUDE)
+        output = self.pool.run("print(data)", prelude="data = 'new'")
+        self.assertEqual(output, "new\n")
+        self.assertEqual(self.pool.stats["template_loads"], 2)
+
+    def test_failing_prelude_is_reported(self):
+        output = self.pool.run("print('never')", prelude="raise RuntimeError('no data')")
+        self.assertTrue(output.startswith("[CODE EXECUTION ERROR]: no data"))
+        self.assertNotIn("never", output)
+        _, stats = self.pool.run("print('never')", prelude="raise RuntimeError('no data')", return_stats=True)
+        self.assertEqual(self.pool.stats["template_loads"], 2)
+        self.assertEqual(stats["status"], "prelude_error")
+
+    def test_program_error_in_child(self):
+        output = self.pool.run("print(missing_name)", prelude=PRELUDE)
+        self.assertTrue(output.startswith("loading\n[CODE EXECUTION ERROR]: name 'missing_name' is not defined"))
+
+    def test_child_timeout_keeps_template(self):
+        with self.assertRaises(SandboxTimeout):
+            self.pool.run("import time\ntime.sleep(10)", timeout=0.5, prelude=PRELUDE)
+        self.assertEqual(self.pool.run("print(len(data))", prelude=PRELUDE), "loading\n5\n")
+        self.assertEqual(self.pool.stats["template_loads"], 1)
+
+    def test_prelude_timeout(self):
+        with self.assertRaises(SandboxTimeout):
+            self.pool.run("pass", timeout=0.5, prelude="import time\ntime.sleep(10)")
+
+    def test_concurrent_runs_share_one_prelude_load(self):
+        slow = "import time\ntime.sleep(1)\ndata = 3"
+        outputs = []
+        threads = [threading.Thread(target=lambda: outputs.append(self.pool.run("print(data)", prelude=slow))) for _ in range(2)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(outputs, ["3\n", "3\n"])
+        self.assertEqual(self.pool.stats["template_loads"], 1)
+        self.assertEqual(self.pool.stats["template_hits"], 1)
+
+    def test_loading_prelude_does_not_block_other_templates(self):
+        self.pool.run("pass", prelude=PRELUDE)
+        loading = threading.Thread(target=self.pool.run, args=("pass",), kwargs={"prelude": "import time\ntime.sleep(3)"})
+        loading.start()
+        time.sleep(0.3)
+        start = time.monotonic()
+        self.assertEqual(self.pool.run("print(len(data))", prelude=PRELUDE), "loading\n5\n")
+        self.assertLess(time.monotonic() - start, 2)
+        loading.join()
+
+
+PROGRAM = """import os
+trace = []
+
+# train
+trace.append(os.getpid())
+model = sum(data)
+
+# evaluate
+print('score', model * 2, len(trace))
+"""
+
+
+class TestIncrementalExecution(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SandboxPool(size=2, preload=["json"])
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def run_program(self, code, **kwargs):
+        return self.pool.run(code, prelude=PRELUDE, incremental=True, **kwargs)
+
+    def test_split_cells(self):
+        cells = split_cells(PROGRAM)
+        self.assertEqual([offset for offset, _ in cells], [0, 3, 7])
+        self.assertTrue(cells[1][1].startswith("# train"))
+        self.assertEqual(split_cells("a = 1\n# %%\nb = 2"), [(0, "a = 1"), (1, "# %%\nb = 2")])
+        self.assertEqual(split_cells("def f(:\n\nx = 1"), [(0, "def f(:\n\nx = 1")])
+
+    def test_resumes_from_first_changed_cell(self):
+        first = self.run_program(PROGRAM)
+        self.assertEqual(first, "loading\nscore 20 1\n")
+        edited = self.run_program(PROGRAM.replace("model * 2", "model * 3"))
+        self.assertEqual(edited, "loading\nscore 30 1\n")
+        self.assertEqual(self.pool.stats["snapshot_hits"], 1)
+        self.assertEqual(self.pool.stats["cells_skipped"], 2)
+
+    def test_snapshots_are_not_shared_across_directories(self):
+        program = "open('cell.txt', 'w').write('x')\n# %%\nprint(open('cell.txt').read())"
+        with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+            with working_directory(first):
+                self.run_program(program)
+            with working_directory(second):
+                output = self.run_program(program)
+        # the cell writing the file ran again in the second directory
+        self.assertEqual(output, "loading\nx\n")
+        self.assertEqual(self.pool.stats["snapshot_hits"], 0)
+
+    def test_upstream_change_reruns_downstream(self):
+        self.run_program(PROGRAM)
+        output = self.run_program(PROGRAM.replace("sum(data)", "max(data)"))
+        self.assertEqual(output, "loading\nscore 8 1\n")
+        self.assertEqual(self.pool.stats["cells_skipped"], 1)
+
+    def test_snapshot_state_is_not_mutated(self):
+        self.run_program(PROGRAM)
+        self.run_program(PROGRAM.replace("len(trace))", "len(trace))\ntrace.append(1)"))
+        self.assertEqual(self.run_program(PROGRAM), "loading\nscore 20 1\n")
+
+    def test_error_line_numbers_match_program(self):
+        output = self.run_program(PROGRAM.replace("model * 2", "undefined_name"))
+        self.assertIn("undefined_name", output)
+        self.assertIn('File "<string>", line 9', output)
+
+    def test_timeout_keeps_earlier_snapshots(self):
+        self.run_program(PROGRAM)
+        with self.assertRaises(SandboxTimeout):
+            self.run_program(PROGRAM.replace("print(", "import time\ntime.sleep(10)\nprint("), timeout=0.5)
+        self.assertEqual(self.run_program(PROGRAM.replace("model * 2", "model")), "loading\nscore 10 1\n")
+
+
+CHATTY = "for i in range(200000):\n    print('line', i)\n"
+
+
+class TestBoundedOutput(unittest.TestCase):
+
+    def test_short_output_is_unchanged(self):
+        self.assertEqual(truncate_output("abc\n", 10), "abc\n")
+
+    def test_head_and_tail_are_kept(self):
+        output = BoundedOutput(10)
+        for chunk in ["0123", "4567", "89ab", "cdef"]:
+            output.write(chunk)
+        self.assertEqual(output.truncated, 6)
+        self.assertEqual(output.getvalue(), "01234\n... [6 characters of output truncated] ...\nbcdef")
+
+    def test_error_line_survives_truncation(self):
+        text = "x" * 100 + "[CODE EXECUTION ERROR]: boom\n" + "y" * 100
+        result = truncate_output(text, 20)
+        self.assertIn("[CODE EXECUTION ERROR]: boom", result)
+        self.assertTrue(result.endswith("y" * 10))
+
+    def test_split_utf8_bytes(self):
+        output = BoundedOutput(100)
+        data = "héllo".encode()
+        output.write_bytes(data[:2])
+        output.write_bytes(data[2:])
+        self.assertEqual(output.getvalue(), "héllo")
+
+
+class TestStreamingOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SandboxPool(size=1, preload=["json"])
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def check_bounded(self, output, limit, head="line 0\n"):
+        self.assertLess(len(output), limit + 100)
+        self.assertTrue(output.startswith(head))
+        self.assertTrue(output.endswith("line 199999\n"))
+        self.assertIn("characters of output truncated", output)
+
+    def test_chatty_program_is_bounded(self):
+        self.check_bounded(self.pool.run(CHATTY, timeout=30, max_output=1000), 1000)
+
+    def test_chatty_program_with_prelude(self):
+        for incremental in (False, True):
+            output = self.pool.run(CHATTY, timeout=30, prelude=PRELUDE, incremental=incremental, max_output=1000)
+            self.check_bounded(output, 1000, head="loading\nline 0\n")
+
+    def test_error_after_long_output(self):
+        output = self.pool.run(CHATTY + "raise ValueError('late failure')", timeout=30, max_output=500)
+        self.assertIn("[CODE EXECUTION ERROR]: late failure", output)
+
+    def test_snapshot_keeps_earlier_output(self):
+        code = "print('first')\n\nprint('second')\n"
+        self.pool.run(code, prelude=PRELUDE, incremental=True)
+        output = self.pool.run(code.replace("second", "third"), prelude=PRELUDE, incremental=True)
+        self.assertEqual(output, "loading\nfirst\nthird\n")
+        self.assertEqual(self.pool.stats["snapshot_hits"], 1)
+
+
+class TestResourceLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = SandboxPool(size=1, preload=["json"], limits={})
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_stats_are_reported(self):
+        output, stats = self.pool.run("print(sum(i * i for i in range(10 ** 6)))", timeout=30, return_stats=True)
+        self.assertEqual(output, "333332833333500000\n")
+        self.assertGreater(stats["cpu_user"], 0)
+        self.assertGreater(stats["peak_rss"], 0)
+        self.assertGreaterEqual(stats["wall_time"], stats["cpu_user"] * 0.5)
+        self.assertEqual(stats["children"], 0)
+
+    def test_stats_with_snapshots(self):
+        code = "a = sum(range(10 ** 6))\n\nb = sum(range(10 ** 6))\n\nprint(a == b)"
+        output, stats = self.pool.run(code, timeout=30, prelude=PRELUDE, incremental=True, return_stats=True)
+        self.assertEqual(output, "loading\nTrue\n")
+        self.assertGreater(stats["cpu_user"], 0)
+
+    def test_cpu_limit(self):
+        for prelude in (None, PRELUDE):
+            output = self.pool.run("while True: pass", timeout=30, prelude=prelude, limits={"cpu": 1})
+            self.assertIn("[CODE EXECUTION ERROR]: CPU time limit exceeded", output)
+        self.assertEqual(self.pool.run("print('next run')", timeout=30), "next run\n")
+
+    def test_memory_limit(self):
+        code = "block = bytearray(2 * 1024 ** 3)\nprint('allocated')"
+        output = self.pool.run(code, timeout=30, limits={"memory": 1024 ** 3})
+        self.assertIn("[CODE EXECUTION ERROR]", output)
+        self.assertIn("MemoryError", output)
+        # the limit is lifted again for the next run in the same worker
+        self.assertEqual(self.pool.run("block = bytearray(64 * 1024 ** 2)\nprint('ok')", timeout=30), "ok\n")
+
+    def test_thread_limit(self):
+        code = "import os\nprint(os.environ.get('OMP_NUM_THREADS'))"
+        self.assertEqual(self.pool.run(code, timeout=30, limits={"threads": 1}), "1\n")
+        self.assertEqual(self.pool.run(code, timeout=30), f"{os.environ.get('OMP_NUM_THREADS')}\n")
+
+    def test_cpu_pinning(self):
+        code = "import os\nprint(sorted(os.sched_getaffinity(0)), os.environ.get('OMP_NUM_THREADS'))"
+        cpu = min(os.sched_getaffinity(0))
+        for prelude in (None, PRELUDE):
+            output = self.pool.run(code, timeout=30, prelude=prelude, limits={"cpus": [cpu]})
+            self.assertTrue(output.endswith(f"[{cpu}] 1\n"))
+        self.assertEqual(self.pool.run("import os\nprint(len(os.sched_getaffinity(0)))", timeout=30),
+                         f"{len(os.sched_getaffinity(0))}\n")
+
+    def test_leftover_children_recycle_worker(self):
+        code = "import subprocess\nsubprocess.Popen(['sleep', '30'])"
+        _, stats = self.pool.run(code, timeout=30, return_stats=True)
+        self.assertEqual(stats["children"], 1)
+        self.assertEqual(self.pool.stats["recycled"], 1)
+        _, stats = self.pool.run("pass", timeout=30, return_stats=True)
+        self.assertEqual(stats["children"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import time
+import threading
+
+# Add parent directory to path to import scheduler
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+from scheduler import ExecutionScheduler, partition_cpus
+
+
+class TestPartition(unittest.TestCase):
+
+    def test_even_split(self):
+        self.assertEqual(partition_cpus(list(range(8)), 2), [[0, 1, 2, 3], [4, 5, 6, 7]])
+        self.assertEqual(partition_cpus(list(range(5)), 2), [[0, 1], [2, 3, 4]])
+
+    def test_more_slots_than_cpus(self):
+        self.assertEqual(partition_cpus([0, 1], 3), [[0], [1], [0]])
+
+
+class TestExecutionScheduler(unittest.TestCase):
+
+    def _run_queued(self, scheduler, priorities):
+        """Queue one waiter per priority behind a held slot and return the order they ran in."""
+        held = scheduler.acquire()
+        order, threads = [], []
+        for name, priority in priorities:
+            thread = threading.Thread(target=lambda n=name, p=priority: (
+                scheduler.release(scheduler.acquire(p)), order.append(n)))
+            thread.start()
+            threads.append(thread)
+            while scheduler.queue_length() < len(threads):
+                time.sleep(0.01)
+        scheduler.release(held)
+        for thread in threads:
+            thread.join(5)
+        return order
+
+    def test_slots_get_disjoint_cpus(self):
+        scheduler = ExecutionScheduler(slots=2, cpus=[0, 1, 2, 3])
+        first, second = scheduler.acquire(), scheduler.acquire()
+        self.assertEqual(sorted(first.cpus + second.cpus), [0, 1, 2, 3])
+        self.assertEqual(first.limits({"cpu": 5}), {"cpu": 5, "cpus": first.cpus})
+        self.assertIsNone(scheduler.acquire(timeout=0.05))
+        scheduler.release(first)
+        self.assertEqual(scheduler.acquire(timeout=1).cpus, first.cpus)
+
+    def test_fifo_order(self):
+        scheduler = ExecutionScheduler(slots=1, policy="fifo", cpus=[0])
+        self.assertEqual(self._run_queued(scheduler, [("a", 5), ("b", 1), ("c", 0)]), ["a", "b", "c"])
+
+    def test_priority_order(self):
+        scheduler = ExecutionScheduler(slots=1, policy="priority", cpus=[0])
+        self.assertEqual(self._run_queued(scheduler, [("a", 5), ("b", 1), ("c", 0)]), ["c", "b", "a"])
+
+    def test_queue_wait_is_measured(self):
+        scheduler = ExecutionScheduler(slots=1, cpus=[0])
+        held = scheduler.acquire()
+        threading.Timer(0.2, scheduler.release, args=(held,)).start()
+        with scheduler.slot() as slot:
+            self.assertGreaterEqual(slot.queue_wait, 0.15)
+        self.assertEqual(scheduler.stats["queued"], 1)
+
+
+class TestExecuteCodeScheduling(unittest.TestCase):
+
+    def test_queue_wait_is_reported_apart_from_run_time(self):
+        scheduler = ExecutionScheduler(slots=1, cpus=[min(os.sched_getaffinity(0))])
+        held = scheduler.acquire()
+        threading.Timer(0.5, scheduler.release, args=(held,)).start()
+        with patch.object(tools, "get_scheduler", return_value=scheduler), \
+                patch.object(tools, "USE_SANDBOX_POOL", False), patch.object(tools, "_report_run_stats"):
+            output, stats = tools.execute_code("import os\nprint(len(os.sched_getaffinity(0)))", timeout=60,
+                                               return_stats=True)
+        self.assertEqual(output, "1\n")
+        self.assertGreaterEqual(stats["queue_wait"], 0.4)
+        self.assertIn("queued", tools.format_run_stats(stats))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+
+# Add parent directory to path to import score_cache
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import score_cache
+from score_cache import ScoreCache, cached_score, store_score
+
+
+class TestScoreCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "scores.db")
+        self.cache = ScoreCache(self.path, max_entries=2)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def test_key_covers_every_input(self):
+        key = ScoreCache.key("model", "plan", "code", "output")
+        self.assertEqual(key, ScoreCache.key("model", "plan", "code", "output"))
+        for other in (ScoreCache.key("other", "plan", "code", "output"), ScoreCache.key("model", "plan 2", "code", "output"),
+                      ScoreCache.key("model", "plan", "code 2", "output"), ScoreCache.key("model", "plan", "code", "output 2"),
+                      ScoreCache.key("model", "plan", "code", "output", reviewer="harsh")):
+            self.assertNotEqual(key, other)
+
+    def test_scores_persist_across_instances(self):
+        self.cache.put("k", 0.75, "The performance of your submission is: 0.75")
+        self.cache.close()
+        self.cache = ScoreCache(self.path)
+        self.assertEqual(self.cache.get("k"), (0.75, "The performance of your submission is: 0.75"))
+        self.assertIsNone(self.cache.get("missing"))
+        self.assertEqual(self.cache.hit_rate(), 0.5)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put("a", 0.1, "")
+        self.cache.put("b", 0.2, "")
+        self.cache.get("a")
+        self.cache.put("c", 0.3, "")
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), (0.1, ""))
+
+    def test_shared_cache_reports_hit_rate(self):
+        with patch.object(score_cache, "get_score_cache", return_value=self.cache), \
+                patch("logger.get_logger") as get_logger:
+            self.assertIsNone(cached_score("k"))
+            store_score("k", 0.5, "message")
+            self.assertEqual(cached_score("k"), (0.5, "message"))
+        get_logger.return_value.metric.assert_called_with("reward_score_cache_hit_rate", 0.5, "ratio")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+from unittest.mock import patch
+import json
+import types
+import sys
+import os
+
+# Add parent directory to path to import section_review
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import score_cache
+from score_cache import ScoreCache
+from section_review import SectionReviewer, split_sections
+from structured_output import weighted_score
+
+PAPER = "\n".join([
+    "\\documentclass{article}",
+    "\\title{Research Report: T}",
+    "\\begin{document}",
+    "\\begin{abstract}",
+    "We study things.",
+    "\\end{abstract}",
+    "\\section{Introduction}",
+    "Things matter.",
+    "\\section*{Methods}",
+    "We do things.",
+    "\\subsection{Details}",
+    "Carefully.",
+    "\\section{Results}",
+    "It works.",
+    "\\end{document}",
+])
+
+SECTION_REVIEW = {"Summary": "Fine.", "Weaknesses": ["short"], "Soundness": 3, "Presentation": 2, "Contribution": 3, "Clarity": 4}
+COHERENCE_REVIEW = {"Weaknesses": [], "Originality": 2, "Quality": 3, "Significance": 2, "Overall": 6, "Confidence": 4, "Decision": "Accept"}
+
+
+class TestSplitSections(unittest.TestCase):
+
+    def test_abstract_and_sections_without_preamble(self):
+        sections = split_sections(PAPER)
+        self.assertEqual([_title for _title, _ in sections], ["Abstract", "Introduction", "Methods", "Results"])
+        self.assertTrue(sections[0][1].startswith("\\begin{abstract}"))
+        # subsections belong to their section
+        self.assertIn("Carefully.", sections[2][1])
+        self.assertNotIn("documentclass", "".join(_text for _, _text in sections))
+
+    def test_no_sections(self):
+        self.assertEqual(split_sections("just text"), [])
+
+
+@patch("logger.get_logger")
+class TestSectionReviewer(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ScoreCache(":memory:")
+        self.queries = []
+
+        def query_model(**kwargs):
+            self.queries.append(kwargs)
+            if kwargs["json_schema"]["name"] == "coherence_review":
+                return json.dumps(COHERENCE_REVIEW)
+            return json.dumps(SECTION_REVIEW)
+        self.inference = types.SimpleNamespace(query_model=query_model)
+        self.reviewer = SectionReviewer("plan", "model")
+
+    def score(self, latex):
+        with patch.object(score_cache, "get_score_cache", return_value=self.cache), \
+                patch.dict(sys.modules, {"inference": self.inference}):
+            return self.reviewer.get_score(latex)
+
+    def test_score_combines_section_and_coherence_ratings(self, get_logger):
+        score, feedback, is_valid = self.score(PAPER)
+        self.assertTrue(is_valid)
+        self.assertAlmostEqual(score, weighted_score({**SECTION_REVIEW, **COHERENCE_REVIEW}))
+        self.assertIn("Results: Fine.", feedback)
+        self.assertEqual(len(self.queries), 5)
+
+    def test_edit_re_reviews_only_the_changed_section(self, get_logger):
+        self.score(PAPER)
+        self.queries.clear()
+        self.score(PAPER.replace("It works.", "It works well."))
+        reviewed = [_query["prompt"] for _query in self.queries if _query["json_schema"]["name"] == "section_review"]
+        self.assertEqual(len(reviewed), 1)
+        self.assertIn("It works well.", reviewed[0])
+        self.assertEqual(len(self.queries), 2)
+        self.assertEqual((self.reviewer.sections_reviewed, self.reviewer.sections_reused), (5, 3))
+        get_logger.return_value.metric.assert_any_call("section_review_reuse_rate", 3 / 8, "ratio")
+
+    def test_unchanged_paper_needs_no_query(self, get_logger):
+        first = self.score(PAPER)
+        self.queries.clear()
+        self.assertEqual(self.score(PAPER), first)
+        self.assertEqual(self.queries, [])
+
+    def test_unparsable_review_is_invalid(self, get_logger):
+        self.inference.query_model = lambda **kwargs: "no review"
+        score, message, is_valid = self.score(PAPER)
+        self.assertIsNone(score)
+        self.assertFalse(is_valid)
+        self.assertIn("missing the ratings", message)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+from unittest.mock import patch
+import json
+import sys
+import os
+
+# Add parent directory to path to import structured_output
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import structured_output
+from structured_output import (COHERENCE_SCHEMA, REVIEW_RATINGS, REVIEW_SCHEMA, SCORE_SCHEMA, SECTION_RATINGS, SECTION_SCHEMA, parse_failure_rate, parse_json_object,
+                               parse_review, parse_score, weighted_score)
+
+RATINGS = {"Originality": 3, "Quality": 3, "Clarity": 2, "Significance": 3, "Soundness": 3,
+           "Presentation": 2, "Contribution": 3, "Overall": 6, "Confidence": 4}
+
+
+class TestSchemas(unittest.TestCase):
+
+    def test_schemas_are_strict(self):
+        for schema in (REVIEW_SCHEMA, SECTION_SCHEMA, COHERENCE_SCHEMA, SCORE_SCHEMA):
+            body = schema["schema"]
+            self.assertFalse(body["additionalProperties"])
+            self.assertEqual(body["required"], list(body["properties"]))
+        for name, maximum in REVIEW_RATINGS.items():
+            self.assertEqual(REVIEW_SCHEMA["schema"]["properties"][name]["enum"][-1], maximum)
+
+
+class TestParseJsonObject(unittest.TestCase):
+
+    def test_bare_fenced_and_embedded_objects(self):
+        self.assertEqual(parse_json_object('{"a": 1}'), {"a": 1})
+        self.assertEqual(parse_json_object('THOUGHT: fine\n```json\n{"a": 1}\n```'), {"a": 1})
+        self.assertEqual(parse_json_object('Here it is: {"a": {"b": "}"}} done'), {"a": {"b": "}"}})
+
+    def test_common_slips_are_repaired(self):
+        self.assertEqual(parse_json_object('{"a": 1, "b": [1, 2,],}'), {"a": 1, "b": [1, 2]})
+        self.assertEqual(parse_json_object("{'a': True, 'b': None}"), {"a": True, "b": None})
+        self.assertEqual(parse_json_object('{“a”: 1}'), {"a": 1})
+        self.assertEqual(parse_json_object('{"a": "line\nbreak"}'), {"a": "line\nbreak"})
+
+    def test_no_object(self):
+        self.assertIsNone(parse_json_object("no json here"))
+        self.assertIsNone(parse_json_object(None))
+
+
+@patch("logger.get_logger")
+class TestParseReview(unittest.TestCase):
+
+    def setUp(self):
+        structured_output._parse_counts.clear()
+
+    def test_structured_response(self, get_logger):
+        review = parse_review(json.dumps({**RATINGS, "Decision": "Reject"}))
+        self.assertEqual({_name: review[_name] for _name in RATINGS}, RATINGS)
+        self.assertEqual(review["Decision"], "Reject")
+
+    def test_loose_keys_and_values(self, get_logger):
+        text = "```json\n{'overall': '7 (Accept)', 'soundness': '3/4', 'Confidence': 9, " + \
+               ", ".join(f"'{_name}': {_value}" for _name, _value in RATINGS.items()
+                         if _name not in ("Overall", "Soundness", "Confidence")) + ",}\n```"
+        review = parse_review(text)
+        self.assertEqual((review["Overall"], review["Soundness"]), (7, 3))
+        # ratings are clipped to their scale
+        self.assertEqual(review["Confidence"], 5)
+
+    def test_ratings_outside_of_an_object(self, get_logger):
+        text = "\n".join(f"{_name}: {_value}" for _name, _value in RATINGS.items())
+        self.assertEqual(parse_review(text)["Overall"], 6)
+
+    def test_missing_ratings_fail_and_are_counted(self, get_logger):
+        parse_review(json.dumps(RATINGS))
+        with self.assertRaises(ValueError) as raised:
+            parse_review('{"Overall": 6}')
+        self.assertIn("Soundness", str(raised.exception))
+        self.assertEqual(parse_failure_rate("review"), 0.5)
+        get_logger.return_value.metric.assert_called_with("review_parse_failure_rate", 0.5, "ratio")
+
+    def test_subset_of_ratings(self, get_logger):
+        review = parse_review('{"Soundness": 3, "Presentation": 2, "Contribution": 3, "Clarity": 4}', SECTION_RATINGS, kind="section_review")
+        self.assertEqual(review["Clarity"], 4)
+        self.assertEqual(parse_failure_rate("section_review"), 0.0)
+
+
+class TestWeightedScore(unittest.TestCase):
+
+    def test_matches_the_review_formula(self):
+        self.assertAlmostEqual(weighted_score(REVIEW_RATINGS), 10.0)
+        self.assertAlmostEqual(weighted_score(RATINGS), (0.1 * 2 / 4 + 0.1 * 3 / 4 + 1.0 * 6 / 10 + 0.1 * 3 / 4 + 0.1 * 4 / 5 + 0.1 * 3 / 4
+                                                         + 0.1 * 3 / 4 + 0.4 * 3 / 4 + 0.2 * 2 / 4) / 2.2 * 10)
+
+
+@patch("logger.get_logger")
+class TestParseScore(unittest.TestCase):
+
+    def setUp(self):
+        structured_output._parse_counts.clear()
+
+    def test_score_formats(self, get_logger):
+        self.assertEqual(parse_score('{"score": 0.7}'), 0.7)
+        self.assertEqual(parse_score("Reasoning...\n```SCORE\n0.45\n```"), 0.45)
+        self.assertEqual(parse_score("Score: 0.8/1"), 0.8)
+        self.assertEqual(parse_score(" 0.3 "), 0.3)
+        self.assertEqual(parse_failure_rate("reward"), 0.0)
+
+    def test_no_score(self, get_logger):
+        with self.assertRaises(ValueError):
+            parse_score("I cannot grade this.")
+        self.assertEqual(parse_failure_rate("reward"), 1.0)
+        get_logger.return_value.metric.assert_called_with("reward_parse_failure_rate", 1.0, "ratio")
+
+
+if __name__ == "__main__":
+    unittest.main()
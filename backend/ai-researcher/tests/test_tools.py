@@ -0,0 +1,300 @@
+import unittest
+import sys
+import os
+import threading
+import time
+from unittest.mock import patch
+
+# Add parent directory to path to import tools
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools
+from tools import FirecrawlSearch, ArxivSearch, ArxivPrefetcher, FederatedSearch, LocalFirstSearch
+from paper_index import PaperIndex
+
+SUMMARY = (
+    "Title: A\nSummary: ...\nPublication Date: 2024-01-01\narXiv paper ID: 2401.00001v1\n\n"
+    "Title: B\nSummary: ...\nPublication Date: 2024-01-02\narXiv paper ID: 2401.00002v2\n"
+    "Title: C\nSummary: ...\narXiv paper ID: AgentRxiv:ID_3"
+)
+
+
+class FakeArxivSearch:
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def retrieve_full_paper_text(self, query, MAX_LEN=50000):
+        self.calls.append(query)
+        self.release.wait(5)
+        text = f"full text of {query}"
+        with ArxivSearch._full_text_lock:
+            ArxivSearch._full_text_cache[query] = (text, MAX_LEN)
+        return text
+
+
+class TestArxivPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        ArxivSearch._full_text_cache.clear()
+        self.search = FakeArxivSearch()
+        self.prefetcher = ArxivPrefetcher(self.search, max_workers=2)
+
+    def tearDown(self):
+        self.search.release.set()
+        self.prefetcher.shutdown()
+        ArxivSearch._full_text_cache.clear()
+
+    def test_parse_paper_ids_skips_agentrxiv(self):
+        self.assertEqual(ArxivPrefetcher.parse_paper_ids(SUMMARY), ["2401.00001v1", "2401.00002v2"])
+
+    def test_prefetched_text_is_a_hit(self):
+        self.search.release.set()
+        self.assertEqual(self.prefetcher.prefetch(SUMMARY), 2)
+        self.prefetcher.executor.shutdown(wait=True)
+        self.assertEqual(self.prefetcher.retrieve_full_paper_text("2401.00001v1"), "full text of 2401.00001v1")
+        stats = self.prefetcher.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["hit_rate"], 1.0)
+        self.assertEqual(len(self.search.calls), 2)
+
+    def test_in_flight_request_is_not_fetched_twice(self):
+        self.prefetcher.prefetch(SUMMARY)
+        threading.Timer(0.05, self.search.release.set).start()
+        self.assertEqual(self.prefetcher.retrieve_full_paper_text("2401.00002v2"), "full text of 2401.00002v2")
+        self.assertEqual(self.search.calls.count("2401.00002v2"), 1)
+        self.assertEqual(self.prefetcher.stats()["in_flight_hits"], 1)
+
+    def test_unknown_paper_is_a_miss(self):
+        self.search.release.set()
+        self.prefetcher.retrieve_full_paper_text("2401.99999v1")
+        self.assertEqual(self.prefetcher.stats()["misses"], 1)
+        self.assertEqual(self.prefetcher.stats()["hit_rate"], 0.0)
+
+    def test_cache_respects_max_len(self):
+        with ArxivSearch._full_text_lock:
+            ArxivSearch._full_text_cache["x"] = ("a" * 100, 100)
+        self.assertEqual(ArxivSearch.cached_full_text("x", 50), "a" * 50)
+        self.assertIsNone(ArxivSearch.cached_full_text("x", 200))
+
+
+class FakeArxivClient:
+    def __init__(self, requests):
+        self.requests = requests
+
+    def results(self, search):
+        self.requests.append(time.monotonic())
+        return iter([])
+
+
+class TestArxivRateLimit(unittest.TestCase):
+
+    def test_requests_are_spaced_across_searches(self):
+        requests = []
+        searches = [ArxivSearch() for _ in range(4)]
+        for search in searches:
+            search.sch_engine = FakeArxivClient(requests)
+        with patch.object(tools, "ARXIV_REQUEST_INTERVAL", 0.2), patch.object(tools, "_arxiv_next_request", 0.0):
+            threads = [threading.Thread(target=_search.search_records, args=("q",)) for _search in searches]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        requests.sort()
+        self.assertEqual(len(requests), 4)
+        self.assertTrue(all(_b - _a >= 0.19 for _a, _b in zip(requests, requests[1:])))
+
+
+class FakeBackend:
+    def __init__(self, records, delay=0.0):
+        self.records = records
+        self.delay = delay
+
+    def search_records(self, query, N=10, limit=None):
+        time.sleep(self.delay)
+        return self.records
+
+
+def paper(title, source, **fields):
+    record = {"title": title, "summary": f"{title} abstract", "published": None, "arxiv_id": None,
+              "doi": None, "url": None, "venue": None, "citations": None, "source": source}
+    record.update(fields)
+    return record
+
+
+class TestFederatedSearch(unittest.TestCase):
+
+    def make_search(self, arxiv, scholar, web, **kwargs):
+        return FederatedSearch(arxiv_search=arxiv, semantic_scholar=scholar, firecrawl=web, **kwargs)
+
+    def test_duplicates_are_merged(self):
+        arxiv = FakeBackend([paper("Deep Nets", "arxiv", arxiv_id="2401.00001v2"), paper("Other", "arxiv", arxiv_id="2401.00009v1")])
+        scholar = FakeBackend([paper("Deep nets!", "semantic_scholar", arxiv_id="2401.00001", doi="10.1/x", citations=12)])
+        web = FakeBackend([paper("Unrelated", "firecrawl", doi="10.1/X", url="https://doi.org/10.1/X")])
+        records = self.make_search(arxiv, scholar, web).search_records("deep nets")
+        self.assertEqual(len(records), 2)
+        top = records[0]
+        self.assertEqual(top["arxiv_id"], "2401.00001v2")
+        self.assertEqual(top["citations"], 12)
+        self.assertEqual(top["sources"], ["arxiv", "semantic_scholar", "firecrawl"])
+
+    def test_slow_backend_times_out(self):
+        arxiv = FakeBackend([paper("Fast", "arxiv", arxiv_id="2401.00001v1")])
+        scholar = FakeBackend([paper("Slow", "semantic_scholar")], delay=1.0)
+        search = self.make_search(arxiv, scholar, FakeBackend([]), timeouts={"semantic_scholar": 0.05})
+        start = time.monotonic()
+        records = search.search_records("q")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual([r["title"] for r in records], ["Fast"])
+        self.assertEqual(search.last_stats["backends"]["semantic_scholar"]["status"], "timeout")
+
+    def test_failing_backend_is_skipped(self):
+        class Broken:
+            def search_records(self, query, N=10, limit=None):
+                raise RuntimeError("boom")
+        search = self.make_search(FakeBackend([paper("A", "arxiv", arxiv_id="1")]), Broken(), FakeBackend([]))
+        self.assertEqual(len(search.search_records("q")), 1)
+        self.assertTrue(search.last_stats["backends"]["semantic_scholar"]["status"].startswith("error"))
+
+    def test_block_is_token_bounded(self):
+        arxiv = FakeBackend([paper(f"Paper {i}", "arxiv", arxiv_id=f"2401.{i:05d}v1", summary="word " * 200) for i in range(20)])
+        search = self.make_search(arxiv, FakeBackend([]), FakeBackend([]), max_tokens=600)
+        block = search.format_records(search.search_records("q"))
+        self.assertLessEqual(search.count_tokens(block), 600)
+        self.assertIn("arXiv paper ID: 2401.00000v1", block)
+        self.assertEqual(ArxivPrefetcher.parse_paper_ids(block)[0], "2401.00000v1")
+
+
+class FakeRemote:
+    def __init__(self):
+        self.queries = []
+
+    def find_papers_by_str(self, query, N=10):
+        self.queries.append(query)
+        return "remote results"
+
+
+class TestLocalFirstSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PaperIndex(":memory:")
+        self.index.add_records([paper(f"Diffusion models {i}", "arxiv", arxiv_id=f"2401.0000{i}v1",
+                                      summary="score based generative modeling") for i in range(3)])
+        self.remote = FakeRemote()
+        self.search = LocalFirstSearch(self.index, self.remote, min_local_results=3)
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_served_locally_when_recall_is_high(self):
+        block = self.search.find_papers_by_str("diffusion generative", N=5)
+        self.assertEqual(self.remote.queries, [])
+        self.assertEqual(len(ArxivPrefetcher.parse_paper_ids(block)), 3)
+        self.assertEqual(self.search.local_hits, 1)
+
+    def test_web_pages_are_not_papers(self):
+        self.index.add_records([paper(f"Graph neural networks {i}", "firecrawl") for i in range(3)])
+        self.assertEqual(self.search.find_papers_by_str("graph neural networks", N=5), "remote results")
+
+    def test_falls_back_to_remote(self):
+        self.assertEqual(self.search.find_papers_by_str("graph neural networks", N=5), "remote results")
+        self.assertEqual(self.remote.queries, ["graph neural networks"])
+        self.assertEqual(self.search.remote_queries, 1)
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        self.posts.append(json["query"])
+        if json["query"] == "broken":
+            return FakeResponse({"success": False, "error": "quota"})
+        items = [{"title": f"{json['query']} {i}", "description": "desc", "markdown": "x" * 1000,
+                  "url": f"https://arxiv.org/abs/2401.0000{i}v1"} for i in range(json["limit"])]
+        return FakeResponse({"success": True, "data": items})
+
+
+class TestFirecrawlSearch(unittest.TestCase):
+
+    def setUp(self):
+        FirecrawlSearch._cache.clear()
+        self.session = FakeSession()
+        self.patcher = patch.object(tools, "get_firecrawl_session", return_value=self.session)
+        self.patcher.start()
+        self.search = FirecrawlSearch()
+        self.search.api_key = "test"
+
+    def tearDown(self):
+        self.patcher.stop()
+        FirecrawlSearch._cache.clear()
+
+    def test_responses_are_cached(self):
+        first = self.search.search_web("graph networks", limit=2)
+        second = self.search.search_web("Graph  networks", limit=2)
+        self.assertEqual(first, second)
+        self.assertEqual(self.session.posts, ["graph networks"])
+        self.search.search_web("graph networks", limit=3)
+        self.assertEqual(len(self.session.posts), 2)
+
+    def test_cache_expires(self):
+        self.search.search_web("q", limit=1)
+        with patch.object(tools, "FIRECRAWL_CACHE_TTL", -1):
+            FirecrawlSearch._cache.clear()
+            self.search.search_web("q", limit=1)
+        self.search.search_web("q", limit=1)
+        self.assertEqual(len(self.session.posts), 3)
+
+    def test_search_many(self):
+        self.search.search_web("cached", limit=2)
+        results = self.search.search_many(["cached", "fresh", "fresh", "broken"], limit=2)
+        self.assertEqual(list(results), ["cached", "fresh", "broken"])
+        self.assertEqual(results["fresh"][0]["snippet"], "x" * tools.FIRECRAWL_SNIPPET_LEN + "...")
+        self.assertEqual(results["fresh"][1]["arxiv_id"], "2401.00001v1")
+        self.assertEqual(results["broken"], "Firecrawl Error: quota")
+        self.assertEqual(self.session.posts.count("cached"), 1)
+        self.assertEqual(self.session.posts.count("fresh"), 1)
+
+
+class TestExecuteCodeProcess(unittest.TestCase):
+
+    def test_large_output_is_streamed_and_bounded(self):
+        output, stats = tools._execute_code_process("for i in range(300000):\n    print('line', i)\n", 60, 1000)
+        self.assertLess(len(output), 1100)
+        self.assertTrue(output.startswith("line 0\n"))
+        self.assertTrue(output.endswith("line 299999\n"))
+        self.assertGreater(stats["cpu_user"], 0)
+
+    def test_timeout(self):
+        with self.assertRaises(tools.SandboxTimeout):
+            tools._execute_code_process("import time\nprint('start')\ntime.sleep(10)", 0.5, 1000)
+
+    def test_execute_code_stats(self):
+        with patch.object(tools, "USE_SANDBOX_POOL", False), patch.object(tools, "_report_run_stats") as report:
+            output, stats = tools.execute_code("print(sum(range(10)))", timeout=60, return_stats=True)
+        self.assertEqual(output, "45\n")
+        self.assertEqual(set(stats), {"wall_time", "cpu_user", "cpu_system", "peak_rss", "children", "queue_wait"})
+        report.assert_called_once_with(stats)
+        self.assertIn("peak memory", tools.format_run_stats(stats))
+
+    def test_execute_code_timeout_stats(self):
+        with patch.object(tools, "USE_SANDBOX_POOL", False), patch.object(tools, "_report_run_stats"):
+            output, stats = tools.execute_code("import time\ntime.sleep(10)", timeout=0.5, return_stats=True)
+        self.assertIn("exceeded the timeout limit", output)
+        self.assertEqual(stats["status"], "timeout")
+        self.assertIn("stopped at the timeout", tools.format_run_stats(stats))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+import threading
+
+# Add parent directory to path to import utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datasets
+import utils
+from utils import load_dataset_cached
+
+
+class TestLoadDatasetCached(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp.name, "cache")
+        self.csv = os.path.join(self.tmp.name, "data.csv")
+        with open(self.csv, "w") as f:
+            f.write("text,label\n" + "".join(f"row {i},{i % 2}\n" for i in range(100)))
+        utils._loaded_datasets.clear()
+        self.loads = 0
+        self.load_dataset = datasets.load_dataset
+
+    def tearDown(self):
+        utils._loaded_datasets.clear()
+        self.tmp.cleanup()
+
+    def _counting_load(self, *args, **kwargs):
+        self.loads += 1
+        return self.load_dataset(*args, **kwargs)
+
+    def test_dataset_is_memory_mapped_from_the_shared_cache(self):
+        with patch.object(datasets, "load_dataset", side_effect=self._counting_load):
+            first = load_dataset_cached("csv", split="train", data_files=self.csv, cache_dir=self.cache_dir)
+            utils._loaded_datasets.clear()
+            second = load_dataset_cached("csv", split="train", data_files=self.csv, cache_dir=self.cache_dir)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(second["label"], first["label"])
+        self.assertTrue(all(f["filename"].startswith(self.cache_dir) for f in second.cache_files))
+
+    def test_key_includes_split_and_arguments(self):
+        with patch.object(datasets, "load_dataset", side_effect=self._counting_load):
+            load_dataset_cached("csv", split="train", data_files=self.csv, cache_dir=self.cache_dir)
+            whole = load_dataset_cached("csv", data_files=self.csv, cache_dir=self.cache_dir)
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(whole["train"].num_rows, 100)
+
+    def test_concurrent_callers_prepare_once(self):
+        results = []
+        with patch.object(datasets, "load_dataset", side_effect=self._counting_load):
+            threads = [threading.Thread(target=lambda: results.append(load_dataset_cached(
+                "csv", split="train", data_files=self.csv, cache_dir=self.cache_dir))) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(60)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual([ds.num_rows for ds in results], [100] * 3)
+        # one complete copy, no partial copies left behind
+        self.assertEqual(len([name for name in os.listdir(self.cache_dir) if not name.endswith(".lock")]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,8 +7,19 @@ import io, sys
 import traceback
 import matplotlib
 import numpy as np
+import tempfile
+import threading
+import sqlite3
+import requests
 import multiprocessing
-from pypdf import PdfReader
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from pdf_extract import extract_text, PdfExtractionError
+from paper_index import normalize_title, record_keys
+from preflight import check_program
+from result_cache import get_result_cache, is_cacheable, directory_state, changed_files
+from scheduler import get_scheduler
+from sandbox import get_sandbox_pool, run_directory, run_code_to_pipe, OutputPipe, SandboxTimeout, SandboxCrash, ERROR_MARKER
 from datasets import load_dataset
 from psutil._common import bytes2human
 from datasets import load_dataset_builder
@@ -16,6 +27,24 @@ from semanticscholar import SemanticScholar
 from sklearn.metrics.pairwise import linear_kernel
 from sklearn.feature_extraction.text import TfidfVectorizer
 
+PDF_EXTRACTION_TIMEOUT = 60
+FULL_TEXT_CACHE_SIZE = 64
+# run generated code in the warm sandbox pool instead of a fresh process per call
+USE_SANDBOX_POOL = os.getenv("SANDBOX_POOL", "true").lower() == "true"
+
+
+def index_records(paper_index, records, source=None):
+    """
+    Add search results to the local paper index, indexing failures never fail a search
+    @param paper_index: (PaperIndex) index, or None when indexing is disabled
+    @param records: (list(dict)) paper records
+    @param source: (str) source name
+    """
+    if paper_index is None or not records: return
+    try:
+        paper_index.add_records(records, source=source)
+    except Exception as e:
+        print(f"Paper index error: {e}")
 
 
 class HFDataSearch:
@@ -177,8 +206,36 @@ class HFDataSearch:
 
 
 class SemanticScholarSearch:
-    def __init__(self):
-        self.sch_engine = SemanticScholar(retry=False)
+    def __init__(self, timeout=30, paper_index=None):
+        self.sch_engine = SemanticScholar(timeout=timeout, retry=False)
+        self.paper_index = paper_index
+
+    def search_records(self, query, N=10):
+        """
+        Search Semantic Scholar and return structured results
+        @param query: (str) search query
+        @param N: (int) number of results
+        @return: (list(dict)) paper records
+        """
+        records = list()
+        results = self.sch_engine.search_paper(query, limit=N, min_citation_count=3, open_access_pdf=True)
+        # only the first page, iterating the results would page through everything
+        for paper in results.items[:N]:
+            external_ids = paper.externalIds or dict()
+            pdf = paper.openAccessPdf or dict()
+            records.append({
+                "title": paper.title,
+                "summary": paper.abstract,
+                "published": str(paper.publicationDate).split(" ")[0] if paper.publicationDate else (str(paper.year) if paper.year else None),
+                "arxiv_id": external_ids.get("ArXiv"),
+                "doi": external_ids.get("DOI"),
+                "url": pdf.get("url") or paper.url,
+                "venue": paper.venue,
+                "citations": paper.citationCount,
+                "source": "semantic_scholar",
+            })
+        index_records(self.paper_index, records)
+        return records
 
     def find_papers_by_str(self, query, N=10):
         paper_sums = list()
@@ -197,10 +254,36 @@ class SemanticScholarSearch:
         pass
 
 
+# seconds between two arXiv requests, arXiv asks clients for at most one request every 3 seconds
+ARXIV_REQUEST_INTERVAL = float(os.getenv("ARXIV_REQUEST_INTERVAL", "3.0"))
+
+_arxiv_next_request = 0.0
+_arxiv_request_lock = threading.Lock()
+
+
+def wait_for_arxiv():
+    """
+    Wait for this thread's turn to send an arXiv request. Requests from every ArxivSearch and thread in the process
+    are spaced ARXIV_REQUEST_INTERVAL apart, each arxiv.Client only spaces its own
+    """
+    global _arxiv_next_request
+    with _arxiv_request_lock:
+        now = time.monotonic()
+        wait = max(0.0, _arxiv_next_request - now)
+        _arxiv_next_request = now + wait + ARXIV_REQUEST_INTERVAL
+    if wait > 0: time.sleep(wait)
+
+
 class ArxivSearch:
-    def __init__(self):
+    # full texts shared by every ArxivSearch in the process, keyed by arXiv ID
+    _full_text_cache = OrderedDict()
+    _full_text_lock = threading.Lock()
+
+    def __init__(self, paper_index=None):
         # Construct the default API client.
         self.sch_engine = arxiv.Client()
+        # abstracts and full texts are added to the local paper index
+        self.paper_index = paper_index
         
     def _process_query(self, query: str) -> str:
         """Process query string to fit within MAX_QUERY_LENGTH while preserving as much information as possible"""
@@ -226,7 +309,13 @@ class ArxivSearch:
             
         return ' '.join(processed_query)
     
-    def find_papers_by_str(self, query, N=20):
+    def search_records(self, query, N=20):
+        """
+        Search arXiv abstracts and return structured results
+        @param query: (str) search query
+        @param N: (int) number of results
+        @return: (list(dict)) paper records, None if every retry failed
+        """
         processed_query = self._process_query(query)
         max_retries = 3
         retry_count = 0
@@ -238,19 +327,23 @@ class ArxivSearch:
                     max_results=N,
                     sort_by=arxiv.SortCriterion.Relevance)
 
-                paper_sums = list()
+                records = list()
+                wait_for_arxiv()
                 # `results` is a generator; you can iterate over its elements one by one...
                 for r in self.sch_engine.results(search):
-                    paperid = r.pdf_url.split("/")[-1]
-                    pubdate = str(r.published).split(" ")[0]
-                    paper_sum = f"Title: {r.title}\n"
-                    paper_sum += f"Summary: {r.summary}\n"
-                    paper_sum += f"Publication Date: {pubdate}\n"
-                    #paper_sum += f"Categories: {' '.join(r.categories)}\n"
-                    paper_sum += f"arXiv paper ID: {paperid}\n"
-                    paper_sums.append(paper_sum)
-                time.sleep(2.0)
-                return "\n".join(paper_sums)
+                    records.append({
+                        "title": r.title,
+                        "summary": r.summary,
+                        "published": str(r.published).split(" ")[0],
+                        "arxiv_id": r.pdf_url.split("/")[-1],
+                        "doi": r.doi,
+                        "url": r.entry_id,
+                        "venue": None,
+                        "citations": None,
+                        "source": "arxiv",
+                    })
+                index_records(self.paper_index, records)
+                return records
                 
             except Exception as e:
                 retry_count += 1
@@ -259,82 +352,556 @@ class ArxivSearch:
                     continue
         return None
 
+    def find_papers_by_str(self, query, N=20):
+        records = self.search_records(query, N)
+        if records is None:
+            return None
+        paper_sums = list()
+        for record in records:
+            paper_sum = f"Title: {record['title']}\n"
+            paper_sum += f"Summary: {record['summary']}\n"
+            paper_sum += f"Publication Date: {record['published']}\n"
+            paper_sum += f"arXiv paper ID: {record['arxiv_id']}\n"
+            paper_sums.append(paper_sum)
+        return "\n".join(paper_sums)
+
     def retrieve_full_paper_text(self, query, MAX_LEN=50000):
-        pdf_text = str()
+        cached = self.cached_full_text(query, MAX_LEN)
+        if cached is not None:
+            return cached
+        if self.paper_index is not None:
+            indexed = self.paper_index.get_full_text(query, MAX_LEN)
+            if indexed is not None:
+                self._cache_full_text(query, indexed, MAX_LEN)
+                return indexed
+        wait_for_arxiv()
         paper = next(arxiv.Client().results(arxiv.Search(id_list=[query])))
-        # Download the PDF to the PWD with a custom filename.
-        paper.download_pdf(filename="downloaded-paper.pdf")
-        # creating a pdf reader object
-        reader = PdfReader('downloaded-paper.pdf')
-        # Iterate over all the pages
-        for page_number, page in enumerate(reader.pages, start=1):
-            # Extract text from the page
+        # download to a private directory so concurrent fetches do not collide
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            wait_for_arxiv()
+            pdf_path = paper.download_pdf(dirpath=tmp_dir, filename="downloaded-paper.pdf")
+            # extraction stops as soon as MAX_LEN characters have been read
             try:
-                text = page.extract_text()
+                pdf_text = extract_text(pdf_path, max_chars=MAX_LEN, timeout=PDF_EXTRACTION_TIMEOUT, page_markers=True)
+            except PdfExtractionError:
+                pdf_text = None
+        if pdf_text is None:
+            return "EXTRACTION FAILED"
+        self._cache_full_text(query, pdf_text, MAX_LEN)
+        if self.paper_index is not None:
+            try:
+                self.paper_index.add_full_text(query, pdf_text, budget=MAX_LEN, title=paper.title, source="arxiv")
             except Exception as e:
-                os.remove("downloaded-paper.pdf")
-                time.sleep(2.0)
-                return "EXTRACTION FAILED"
+                print(f"Paper index error: {e}")
+        return pdf_text
+
+    @staticmethod
+    def _cache_full_text(query, text, MAX_LEN):
+        with ArxivSearch._full_text_lock:
+            ArxivSearch._full_text_cache[query] = (text, MAX_LEN)
+            ArxivSearch._full_text_cache.move_to_end(query)
+            while len(ArxivSearch._full_text_cache) > FULL_TEXT_CACHE_SIZE:
+                ArxivSearch._full_text_cache.popitem(last=False)
+
+    @staticmethod
+    def cached_full_text(query, MAX_LEN=50000):
+        """
+        Return a previously retrieved full text, or None if it was never fetched
+        (or was fetched with a smaller MAX_LEN than requested).
+        """
+        with ArxivSearch._full_text_lock:
+            entry = ArxivSearch._full_text_cache.get(query)
+            if entry is None: return None
+            text, max_len = entry
+            if max_len < MAX_LEN and len(text) >= max_len: return None
+            ArxivSearch._full_text_cache.move_to_end(query)
+        return text[:MAX_LEN]
+
+
+class ArxivPrefetcher:
+    """
+    Fetches the full texts of papers returned by a SUMMARY search in the
+    background, so the FULL_TEXT or ADD_PAPER command that usually follows
+    finds them in the ArxivSearch full text cache.
+    Exposes retrieve_full_paper_text so it can stand in for an ArxivSearch.
+    """
+    def __init__(self, arxiv_search=None, max_workers=2, max_papers=5):
+        self.arxiv_search = arxiv_search if arxiv_search is not None else ArxivSearch()
+        self.max_papers = max_papers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="arxiv-prefetch")
+        self.in_flight = dict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.in_flight_hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+    @staticmethod
+    def parse_paper_ids(summary_text):
+        """
+        Extract arXiv IDs from a find_papers_by_str response
+        @param summary_text: (str) SUMMARY response
+        @return: (list) arXiv IDs in result order
+        """
+        if not summary_text: return []
+        ids = re.findall(r"arXiv paper ID: ([^\s]+)", summary_text)
+        return [_id for _id in ids if not _id.startswith("AgentRxiv")]
+
+    def prefetch(self, summary_text):
+        """
+        Queue background retrieval of the papers listed in a SUMMARY response
+        @param summary_text: (str) SUMMARY response
+        @return: (int) number of papers queued
+        """
+        queued = 0
+        for paper_id in self.parse_paper_ids(summary_text)[:self.max_papers]:
+            with self.lock:
+                if paper_id in self.in_flight or ArxivSearch.cached_full_text(paper_id) is not None:
+                    continue
+                self.in_flight[paper_id] = self.executor.submit(self._fetch, paper_id)
+            queued += 1
+        self.prefetched += queued
+        return queued
+
+    def _fetch(self, paper_id):
+        try:
+            return self.arxiv_search.retrieve_full_paper_text(paper_id)
+        finally:
+            with self.lock:
+                self.in_flight.pop(paper_id, None)
+
+    def retrieve_full_paper_text(self, query, MAX_LEN=50000):
+        query = query.strip()
+        cached = ArxivSearch.cached_full_text(query, MAX_LEN)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        with self.lock:
+            future = self.in_flight.get(query)
+        if future is not None:
+            self.in_flight_hits += 1
+            try:
+                text = future.result()
+                if text != "EXTRACTION FAILED": return text[:MAX_LEN]
+            except Exception:
+                pass
+        else:
+            self.misses += 1
+        return self.arxiv_search.retrieve_full_paper_text(query, MAX_LEN)
+
+    def stats(self):
+        """
+        Prefetch statistics
+        @return: (dict) request counts and hit rate
+        """
+        requests = self.hits + self.in_flight_hits + self.misses
+        return {
+            "prefetched": self.prefetched,
+            "hits": self.hits,
+            "in_flight_hits": self.in_flight_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.in_flight_hits) / requests if requests else 0.0,
+        }
 
-            # Do something with the text (e.g., print it)
-            pdf_text += f"--- Page {page_number} ---"
-            pdf_text += text
-            pdf_text += "\n"
-        os.remove("downloaded-paper.pdf")
-        time.sleep(2.0)
-        return pdf_text[:MAX_LEN]
+    def report(self):
+        """Emit the hit rate as a metric"""
+        from logger import get_logger
+        stats = self.stats()
+        get_logger().metric("arxiv_prefetch_hit_rate", stats["hit_rate"])
+        get_logger().info("arXiv full text prefetch statistics", **stats)
+        return stats
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 
 # Set the non-interactive backend early in the module
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
-def worker_run_code(code_str, output_queue):
-    output_capture = io.StringIO()
-    sys.stdout = output_capture
+def worker_run_code(code_str, output_writer, stats_writer, limits, cwd=None):
+    if cwd is not None:
+        os.chdir(cwd)
+    stats_writer.send(run_code_to_pipe(code_str, output_writer, limits))
+
+def _execute_code_process(code_str, timeout, MAX_LEN, limits=None, cwd=None):
+    """
+    Run a program in a brand-new process, used when the warm sandbox pool is disabled
+    @param cwd: (str) directory the program runs in, defaults to the working directory
+    @return: (tuple) program output and resource usage of the run
+    """
+    # output is drained while the program runs, so it can neither fill the pipe nor grow without bound
+    pipe = OutputPipe(MAX_LEN)
+    stats_reader, stats_writer = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=worker_run_code, args=(code_str, pipe.writer, stats_writer, limits, cwd))
+    start = time.monotonic()
     try:
-        # Create a globals dictionary with __name__ set to "__main__"
-        globals_dict = {"__name__": "__main__"}
-        exec(code_str, globals_dict)
-    except Exception as e:
-        output_capture.write(f"[CODE EXECUTION ERROR]: {str(e)}\n")
-        traceback.print_exc(file=output_capture)
+        proc.start()
+        pipe.close_writer()
+        stats_writer.close()
+        finished = pipe.wait(proc.sentinel, start + timeout)
+        if not finished:
+            proc.terminate()  # Forcefully kill the process
+            proc.join()
+            raise SandboxTimeout(f"Code execution exceeded the timeout limit of {timeout} seconds")
+        proc.join()
+        stats = stats_reader.recv() if stats_reader.poll() else {}
+        return pipe.getvalue(), {"wall_time": time.monotonic() - start, **stats}
     finally:
-        sys.stdout = sys.__stdout__
-    output_queue.put(output_capture.getvalue())
+        pipe.close()
+        stats_reader.close()
+
+def format_run_stats(stats):
+    """
+    One-line summary of the resources a code run used
+    @param stats: (dict) resource usage returned by execute_code(return_stats=True)
+    @return: (str) summary, empty if nothing was measured
+    """
+    parts = []
+    if "wall_time" in stats: parts.append(f"wall time {stats['wall_time']:.1f}s")
+    if "cpu_user" in stats: parts.append(f"CPU time {stats['cpu_user']:.1f}s user / {stats['cpu_system']:.1f}s system")
+    if stats.get("peak_rss"): parts.append(f"peak memory {stats['peak_rss'] / 2 ** 20:.0f} MB")
+    if stats.get("children"): parts.append(f"{stats['children']} child processes left running")
+    if stats.get("status") == "timeout": parts.append("stopped at the timeout")
+    if stats.get("status") == "rejected": parts.append("not run, rejected by the pre-flight check")
+    if stats.get("status") == "prelude_error": parts.append("not run, the dataset code failed")
+    if stats.get("cached"): parts.append("result reused from an identical earlier run")
+    if stats.get("queue_wait", 0) >= 0.1: parts.append(f"queued {stats['queue_wait']:.1f}s for a free CPU slot")
+    return ", ".join(parts)
+
+def _report_run_stats(stats):
+    from logger import get_logger
+    logger = get_logger()
+    if stats.get("cached"):
+        logger.metric("code_run_cache_hit_rate", get_result_cache().hit_rate(), "ratio")
+        return
+    logger.metric("code_run_wall_time", stats["wall_time"], "seconds")
+    if "queue_wait" in stats:
+        logger.metric("code_run_queue_wait", stats["queue_wait"], "seconds")
+    if "cpu_user" in stats:
+        logger.metric("code_run_cpu_time", stats["cpu_user"] + stats["cpu_system"], "seconds")
+        logger.metric("code_run_peak_rss", stats["peak_rss"] / 2 ** 20, "MB")
+        logger.metric("code_run_children", stats["children"], "processes")
 
-def execute_code(code_str, timeout=600, MAX_LEN=1000):
+# runs in progress, by id, with their working directory and whether another run shared it meanwhile
+_directory_runs = {}
+_directory_runs_lock = threading.Lock()
+
+def _start_directory_run(directory):
+    """
+    Register a run in its working directory, parallel labs share it
+    @param directory: (str) directory the program runs in
+    @return: (dict) the run, its "overlapped" flag is set once another run writes to the same directory
+    """
+    run = {"directory": directory, "overlapped": False}
+    with _directory_runs_lock:
+        for other in _directory_runs.values():
+            if other["directory"] == run["directory"]:
+                other["overlapped"] = run["overlapped"] = True
+        _directory_runs[id(run)] = run
+    return run
+
+def _finish_directory_run(run):
+    with _directory_runs_lock:
+        _directory_runs.pop(id(run), None)
+
+def execute_code(code_str, timeout=600, MAX_LEN=1000, prelude=None, incremental=False, limits=None, return_stats=False,
+                 use_cache=False, priority=0):
+    """
+    Execute generated code in the sandbox
+    @param code_str: (str) program to run
+    @param timeout: (int) timeout in seconds
+    @param MAX_LEN: (int) characters of output returned, longer output keeps its head and tail
+    @param prelude: (str) code that runs first as part of the same program, e.g. the dataset code.
+                    It is executed once and later programs with the same prelude start from a copy of its namespace
+    @param incremental: (bool) snapshot the program after every top-level cell and resume later runs from
+                        the longest unchanged prefix of cells instead of re-running the whole program
+    @param limits: (dict) "memory" (address space in bytes), "cpu" (seconds) and "threads" limits of the run,
+                   defaults to the SANDBOX_MEMORY_LIMIT_MB, SANDBOX_CPU_LIMIT and SANDBOX_THREADS settings.
+                   The run is also pinned to the CPUs of its execution slot, which set its thread count by default
+    @param return_stats: (bool) also return the run's wall time, CPU time, peak memory, child process count and
+                         the time it waited for an execution slot
+    @param use_cache: (bool) reuse the result and output files of an identical earlier run. Programs that read
+                      the clock or use unseeded randomness always run, and runs that failed or overlapped another run in
+                      the same working directory are not stored
+    @param priority: (int) queue position while every execution slot is busy, lower values run first.
+                     Only used with SANDBOX_QUEUE_POLICY=priority
+    @return: (str) program output, or (tuple) output and resource usage with return_stats
+    """
     #code_str = code_str.replace("\\n", "\n")
-    code_str = "from utils import *\n" + code_str
-    if "load_dataset('pubmed" in code_str:
-        return "[CODE EXECUTION ERROR] pubmed Download took way too long. Program terminated"
-    if "exit(" in code_str:
-        return "[CODE EXECUTION ERROR] The exit() command is not allowed you must remove this."
-    output_queue = multiprocessing.Queue()
-    proc = multiprocessing.Process(target=worker_run_code, args=(code_str, output_queue))
-    proc.start()
-    proc.join(timeout)
-    if proc.is_alive():
-        proc.terminate()  # Forcefully kill the process
-        proc.join()
-        return (f"[CODE EXECUTION ERROR]: Code execution exceeded the timeout limit of {timeout} seconds. "
-                "You must reduce the time complexity of your code.")
+    full_code = "from utils import *\n" + (f"{prelude}\n" if prelude else "") + code_str
+    # syntax errors, exit() calls and undefined names are reported without starting a process
+    preflight_error = check_program(code_str, prelude="from utils import *\n" + (prelude or ""))
+    if "load_dataset('pubmed" in full_code:
+        output, stats = "[CODE EXECUTION ERROR] pubmed Download took way too long. Program terminated", {}
+    elif preflight_error is not None:
+        output, stats = preflight_error, {"status": "rejected"}
     else:
-        if not output_queue.empty(): output = output_queue.get()
-        else: output = ""
-        return output
+        cache_key = None
+        # the caller may have moved this thread's runs to their own directory, see sandbox.working_directory
+        directory = run_directory()
+        directory_run = _start_directory_run(directory)
+        try:
+            if use_cache and is_cacheable(full_code):
+                try:
+                    cache_key = get_result_cache().key(full_code, directory, limits=limits, MAX_LEN=MAX_LEN)
+                    cached = get_result_cache().get(cache_key, directory)
+                except (sqlite3.Error, OSError):
+                    cache_key, cached = None, None
+                if cached is not None:
+                    output, stats = cached
+                    stats = {**stats, "cached": True}
+                    _report_run_stats(stats)
+                    return (output, stats) if return_stats else output
+                directory_before = directory_state(directory)
+            # runs from every lab share the CPUs, each one is pinned to its slot's share of them
+            with get_scheduler().slot(priority) as slot:
+                run_limits = slot.limits(limits)
+                start = time.monotonic()
+                try:
+                    if not USE_SANDBOX_POOL:
+                        output, stats = _execute_code_process(full_code, timeout, MAX_LEN, run_limits, directory)
+                    # programs run in warm workers that already imported utils, numpy, sklearn, ...
+                    elif prelude or incremental:
+                        output, stats = get_sandbox_pool().run(
+                            code_str, timeout, prelude="from utils import *\n" + (prelude or ""), incremental=incremental,
+                            max_output=MAX_LEN, limits=run_limits, return_stats=True)
+                    else:
+                        output, stats = get_sandbox_pool().run(full_code, timeout, max_output=MAX_LEN, limits=run_limits,
+                                                               return_stats=True)
+                except SandboxTimeout:
+                    output = (f"[CODE EXECUTION ERROR]: Code execution exceeded the timeout limit of {timeout} seconds. "
+                              "You must reduce the time complexity of your code.")
+                    stats = {"wall_time": time.monotonic() - start, "status": "timeout"}
+                except SandboxCrash as e:
+                    output = f"[CODE EXECUTION ERROR]: {str(e)}"
+                    stats = {"wall_time": time.monotonic() - start, "status": "crash"}
+            if cache_key is not None and "status" not in stats and ERROR_MARKER not in output:
+                # timeouts, crashes and errors may depend on the machine or on other runs, not only on the program
+                files = changed_files(directory_before, directory)
+                # files written by an overlapping run can't be told apart from this run's own
+                if files is not None and not directory_run["overlapped"]:
+                    try:
+                        get_result_cache().put(cache_key, output, stats, files)
+                    except sqlite3.Error:
+                        pass
+        finally:
+            _finish_directory_run(directory_run)
+        # time spent waiting for a slot is not part of the run
+        stats = {**stats, "queue_wait": slot.queue_wait}
+        _report_run_stats(stats)
+    if return_stats:
+        return output, stats
+    return output
+
+
+class FirecrawlError(Exception):
+    """Raised when the Firecrawl API reports an unsuccessful request."""
+
+
+# Firecrawl responses are reused for this many seconds
+FIRECRAWL_CACHE_TTL = 3600
+FIRECRAWL_CACHE_SIZE = 256
+# page markdown is cut to a snippet before it is cached
+FIRECRAWL_SNIPPET_LEN = 500
+
+_firecrawl_session = None
+_firecrawl_session_lock = threading.Lock()
+
+
+def get_firecrawl_session():
+    """
+    Shared keep-alive session for Firecrawl requests
+    @return: (requests.Session) pooled session
+    """
+    global _firecrawl_session
+    with _firecrawl_session_lock:
+        if _firecrawl_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _firecrawl_session = session
+        return _firecrawl_session
 
 
 class FirecrawlSearch:
     """
     Tool for searching the web using Firecrawl API.
+    Requests share a pooled session and responses are cached per (query, limit)
+    for FIRECRAWL_CACHE_TTL seconds across every instance.
     """
-    def __init__(self):
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+    _stats = {"requests": 0, "cache_hits": 0, "cache_misses": 0, "request_time": 0.0}
+
+    def __init__(self, paper_index=None):
         self.api_key = os.getenv("FIRECRAWL_API_KEY")
+        self.paper_index = paper_index
         self.base_url = "https://api.firecrawl.dev/v1"
         if not self.api_key:
             print("Warning: FIRECRAWL_API_KEY not found. Web search will fail.")
 
+    @staticmethod
+    def _cache_key(query, limit):
+        return (" ".join(query.split()).lower(), limit)
+
+    @classmethod
+    def _cached(cls, key):
+        with cls._cache_lock:
+            entry = cls._cache.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                cls._stats["cache_misses"] += 1
+                return None
+            cls._cache.move_to_end(key)
+            cls._stats["cache_hits"] += 1
+            return entry[1]
+
+    @classmethod
+    def _store(cls, key, items):
+        with cls._cache_lock:
+            cls._cache[key] = (time.monotonic() + FIRECRAWL_CACHE_TTL, items)
+            cls._cache.move_to_end(key)
+            while len(cls._cache) > FIRECRAWL_CACHE_SIZE:
+                cls._cache.popitem(last=False)
+
+    @classmethod
+    def cache_stats(cls):
+        """
+        Cache and latency counters shared by every FirecrawlSearch
+        @return: (dict) requests, cache hits/misses, hit rate and mean request latency
+        """
+        with cls._cache_lock:
+            stats = dict(cls._stats)
+        lookups = stats["cache_hits"] + stats["cache_misses"]
+        stats["cache_hit_rate"] = stats["cache_hits"] / lookups if lookups else 0.0
+        stats["mean_request_latency"] = stats["request_time"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+    def _search(self, query, limit):
+        """
+        Run a search request and return the result items, with markdown already
+        cut to FIRECRAWL_SNIPPET_LEN characters.
+        Raises FirecrawlError if the API reports a failure.
+        """
+        key = self._cache_key(query, limit)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        url = f"{self.base_url}/search"
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = {
+            "query": query,
+            "limit": limit,
+            "scrapeOptions": {
+                "formats": ["markdown"]
+            }
+        }
+        
+        start = time.monotonic()
+        try:
+            response = get_firecrawl_session().post(url, headers=headers, json=payload, timeout=30)
+        finally:
+            with self._cache_lock:
+                self._stats["requests"] += 1
+                self._stats["request_time"] += time.monotonic() - start
+        response.raise_for_status()
+        data = response.json()
+        
+        if not data.get("success"):
+            raise FirecrawlError(data.get('error', 'Unknown error'))
+        items = list()
+        for item in data.get("data", []):
+            item = dict(item)
+            item["markdown"] = (item.get("markdown") or "")[:FIRECRAWL_SNIPPET_LEN]
+            items.append(item)
+        self._store(key, items)
+        return items
+
+    def search_records(self, query, limit=5):
+        """
+        Search the web and return structured results.
+        Returns an empty list when no API key is configured.
+        """
+        if not self.api_key:
+            return []
+        records = [self._to_record(item) for item in self._search(query, limit)]
+        index_records(self.paper_index, records)
+        return records
+
+    def search_many(self, queries, limit=5, max_workers=4):
+        """
+        Run several searches concurrently
+        @param queries: (list(str)) search queries, duplicates are searched once
+        @param limit: (int) results per query
+        @param max_workers: (int) concurrent requests
+        @return: (dict) query -> list of records with a truncated "snippet", or
+                 an error string for queries that failed
+        """
+        queries = list(dict.fromkeys(q.strip() for q in queries if q.strip()))
+        if not queries:
+            return dict()
+        if not self.api_key:
+            return {query: "Error: Firecrawl API key is missing." for query in queries}
+        before = self.cache_stats()
+        start = time.monotonic()
+        results = dict()
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(queries)), thread_name_prefix="firecrawl") as executor:
+            futures = {query: executor.submit(self._search, query, limit) for query in queries}
+            for query in queries:
+                try:
+                    records = list()
+                    for item in futures[query].result():
+                        record = self._to_record(item)
+                        record["snippet"] = item["markdown"] + "..."
+                        records.append(record)
+                    results[query] = records
+                except Exception as e:
+                    results[query] = f"Firecrawl Error: {str(e)}"
+        index_records(self.paper_index, [r for v in results.values() if isinstance(v, list) for r in v])
+        after = self.cache_stats()
+        hits = after["cache_hits"] - before["cache_hits"]
+        from logger import get_logger
+        get_logger().metric("firecrawl_search_many_latency", time.monotonic() - start, "seconds")
+        get_logger().metric("firecrawl_cache_hit_rate", hits / len(queries), "ratio")
+        get_logger().info("Firecrawl batch search", queries=len(queries), cache_hits=hits,
+                          requests=after["requests"] - before["requests"])
+        return results
+
+    @staticmethod
+    def _to_record(item):
+        link = item.get("url", "")
+        arxiv_match = re.search(r"arxiv\.org/(?:abs|pdf)/([^/?#\s]+?)(?:\.pdf)?(?:[?#]|$)", link)
+        doi_match = re.search(r"doi\.org/(10\.[^?#\s]+)", link)
+        return {
+            "title": item.get("title"),
+            "summary": item.get("description") or (item.get("markdown") or "")[:FIRECRAWL_SNIPPET_LEN],
+            "published": None,
+            "arxiv_id": arxiv_match.group(1) if arxiv_match else None,
+            "doi": doi_match.group(1) if doi_match else None,
+            "url": link,
+            "venue": None,
+            "citations": None,
+            "source": "firecrawl",
+        }
+
+    @staticmethod
+    def format_results(results):
+        formatted_results = []
+        for item in results:
+            title = item.get("title", "No Title")
+            desc = item.get("description", "No description")
+            link = item.get("url", "")
+            content = item.get("markdown", "") + "..." # markdown is truncated when cached
+            
+            entry = f"Title: {title}\nURL: {link}\nDescription: {desc}\nSnippet: {content}\n"
+            formatted_results.append(entry)
+        
+        return "\n---\n".join(formatted_results)
+
     def search_web(self, query, limit=5):
         """
         Search the web for the given query.
@@ -344,41 +911,216 @@ class FirecrawlSearch:
             return "Error: Firecrawl API key is missing."
 
         try:
-            url = f"{self.base_url}/search"
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "query": query,
-                "limit": limit,
-                "scrapeOptions": {
-                    "formats": ["markdown"]
-                }
-            }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            if not data.get("success"):
-                return f"Firecrawl Error: {data.get('error', 'Unknown error')}"
-            
-            results = data.get("data", [])
+            results = self._search(query, limit)
             if not results:
                 return "No results found."
+            index_records(self.paper_index, [self._to_record(item) for item in results])
+            return self.format_results(results)
 
-            formatted_results = []
-            for item in results:
-                title = item.get("title", "No Title")
-                desc = item.get("description", "No description")
-                link = item.get("url", "")
-                content = item.get("markdown", "")[:500] + "..." # Truncate markdown
-                
-                entry = f"Title: {title}\nURL: {link}\nDescription: {desc}\nSnippet: {content}\n"
-                formatted_results.append(entry)
-            
-            return "\n---\n".join(formatted_results)
-
+        except FirecrawlError as e:
+            return f"Firecrawl Error: {str(e)}"
         except Exception as e:
             return f"Error performing web search: {str(e)}"
+
+
+_TOKEN_ENCODING = None
+
+
+def count_tokens(text):
+    """
+    Count cl100k_base tokens, falling back to ~4 characters per token when the
+    encoding cannot be downloaded
+    """
+    global _TOKEN_ENCODING
+    if _TOKEN_ENCODING is None:
+        try:
+            _TOKEN_ENCODING = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _TOKEN_ENCODING = False
+    if _TOKEN_ENCODING is False:
+        return len(text) // 4 + 1
+    return len(_TOKEN_ENCODING.encode(text))
+
+
+def format_paper_records(records, max_tokens, max_summary_chars=1200):
+    """
+    Render paper records into a single summary block bounded by max_tokens
+    @param records: (list(dict)) paper records, best first
+    @param max_tokens: (int) token budget of the block
+    @param max_summary_chars: (int) summaries are truncated to this many characters
+    @return: (str) summary block
+    """
+    paper_sums = list()
+    used_tokens = 0
+    for record in records:
+        summary = (record.get("summary") or "").strip()
+        if len(summary) > max_summary_chars:
+            summary = summary[:max_summary_chars] + "..."
+        paper_sum = f"Title: {record.get('title')}\n"
+        paper_sum += f"Summary: {summary}\n"
+        if record.get("published"): paper_sum += f"Publication Date: {record['published']}\n"
+        if record.get("venue"): paper_sum += f"Venue: {record['venue']}\n"
+        if record.get("citations") is not None: paper_sum += f"Citations: {record['citations']}\n"
+        if record.get("arxiv_id"): paper_sum += f"arXiv paper ID: {record['arxiv_id']}\n"
+        if record.get("doi"): paper_sum += f"DOI: {record['doi']}\n"
+        if record.get("url") and not record.get("arxiv_id"): paper_sum += f"URL: {record['url']}\n"
+        paper_sum += f"Sources: {', '.join(record.get('sources', []))}\n"
+        tokens = count_tokens(paper_sum)
+        if used_tokens + tokens > max_tokens and paper_sums: break
+        paper_sums.append(paper_sum)
+        used_tokens += tokens
+    return "\n".join(paper_sums)
+
+
+class FederatedSearch:
+    """
+    Literature search that queries arXiv, Semantic Scholar and Firecrawl
+    concurrently, each with its own timeout, then merges duplicate papers by
+    DOI, arXiv ID or normalized title and renders a single ranked,
+    token-bounded summary block.
+    Exposes find_papers_by_str / retrieve_full_paper_text so it can stand in
+    for an ArxivSearch.
+    """
+    DEFAULT_TIMEOUTS = {"arxiv": 20.0, "semantic_scholar": 10.0, "firecrawl": 15.0}
+
+    def __init__(self, arxiv_search=None, semantic_scholar=None, firecrawl=None, timeouts=None, max_tokens=4000, max_summary_chars=1200):
+        self.backends = {
+            "arxiv": arxiv_search if arxiv_search is not None else ArxivSearch(),
+            "semantic_scholar": semantic_scholar if semantic_scholar is not None else SemanticScholarSearch(timeout=10),
+            "firecrawl": firecrawl if firecrawl is not None else FirecrawlSearch(),
+        }
+        self.timeouts = dict(self.DEFAULT_TIMEOUTS)
+        if timeouts is not None: self.timeouts.update(timeouts)
+        self.max_tokens = max_tokens
+        self.max_summary_chars = max_summary_chars
+        self.last_stats = dict()
+
+    count_tokens = staticmethod(count_tokens)
+
+    # identity keys used for de-duplication, shared with the local paper index
+    normalize_title = staticmethod(normalize_title)
+    record_keys = staticmethod(record_keys)
+
+    def _query_backend(self, name, query, N):
+        backend = self.backends[name]
+        if name == "firecrawl": return backend.search_records(query, limit=N)
+        return backend.search_records(query, N=N)
+
+    def search_records(self, query, N=10):
+        """
+        Query every backend concurrently and merge the results
+        @param query: (str) search query
+        @param N: (int) number of results requested from each backend
+        @return: (list(dict)) merged records, best first
+        """
+        start = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=len(self.backends), thread_name_prefix="federated-search")
+        futures = {name: executor.submit(self._query_backend, name, query, N) for name in self.backends}
+        results = dict()
+        stats = {"backends": dict()}
+        for name, future in futures.items():
+            # every backend's timeout is measured from the start of the search
+            remaining = max(0.0, start + self.timeouts.get(name, 15.0) - time.monotonic())
+            try:
+                results[name] = future.result(timeout=remaining) or list()
+                stats["backends"][name] = {"status": "ok", "results": len(results[name])}
+            except FutureTimeoutError:
+                stats["backends"][name] = {"status": "timeout", "results": 0}
+            except Exception as e:
+                stats["backends"][name] = {"status": f"error: {e}", "results": 0}
+        # do not wait on backends that timed out
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        merged = list()
+        key_index = dict()
+        for name, records in results.items():
+            for rank, record in enumerate(records):
+                keys = self.record_keys(record)
+                entry = next((key_index[key] for key in keys if key in key_index), None)
+                if entry is None:
+                    entry = {"record": dict(record), "sources": list(), "score": 0.0}
+                    merged.append(entry)
+                else:
+                    for field, value in record.items():
+                        current = entry["record"].get(field)
+                        if field == "summary" and value and len(value) > len(current or ""):
+                            entry["record"][field] = value
+                        elif current in (None, "") and value not in (None, ""):
+                            entry["record"][field] = value
+                if name not in entry["sources"]:
+                    entry["sources"].append(name)
+                # reciprocal rank fusion, papers found by several backends rise to the top
+                entry["score"] += 1.0 / (60 + rank)
+                for key in keys: key_index.setdefault(key, entry)
+        merged.sort(key=lambda e: (e["score"], e["record"].get("citations") or 0), reverse=True)
+
+        stats["raw_results"] = sum(len(r) for r in results.values())
+        stats["merged_results"] = len(merged)
+        stats["latency"] = time.monotonic() - start
+        self.last_stats = stats
+        records = list()
+        for entry in merged:
+            record = dict(entry["record"])
+            record["sources"] = entry["sources"]
+            records.append(record)
+        return records
+
+    def format_records(self, records):
+        return format_paper_records(records, self.max_tokens, self.max_summary_chars)
+
+    def find_papers_by_str(self, query, N=10):
+        records = self.search_records(query, N)
+        from logger import get_logger
+        get_logger().metric("federated_search_latency", self.last_stats["latency"], "seconds")
+        get_logger().info("Federated literature search", query=query, **{k: v for k, v in self.last_stats.items() if k != "latency"})
+        if not records:
+            return "No papers found."
+        return self.format_records(records)
+
+    def retrieve_full_paper_text(self, query, MAX_LEN=50000):
+        return self.backends["arxiv"].retrieve_full_paper_text(query, MAX_LEN)
+
+
+# sources whose index records are papers, Firecrawl web pages are indexed as well but are not
+PAPER_SOURCES = ("arxiv", "semantic_scholar")
+
+
+class LocalFirstSearch:
+    """
+    Answers SUMMARY queries from the local paper index and only goes to the
+    network when fewer than min_local_results indexed papers contain every
+    query term. Remote results are added to the index by the backends.
+    Only records from PAPER_SOURCES are returned as papers.
+    """
+    def __init__(self, paper_index, remote, min_local_results=3, max_tokens=4000, max_summary_chars=1200):
+        self.paper_index = paper_index
+        self.remote = remote
+        self.min_local_results = min_local_results
+        self.max_tokens = max_tokens
+        self.max_summary_chars = max_summary_chars
+        self.local_hits = 0
+        self.remote_queries = 0
+
+    def find_papers_by_str(self, query, N=10):
+        try:
+            records = self.paper_index.search(query, limit=N, sources=PAPER_SOURCES)
+        except Exception as e:
+            print(f"Paper index error: {e}")
+            records = list()
+        from logger import get_logger
+        if len(records) >= min(self.min_local_results, N):
+            self.local_hits += 1
+            get_logger().info("Literature search served from local paper index", query=query, results=len(records))
+            return format_paper_records(records, self.max_tokens, self.max_summary_chars)
+        self.remote_queries += 1
+        get_logger().info("Local paper index recall too low, searching remotely", query=query, local_results=len(records))
+        return self.remote.find_papers_by_str(query, N=N)
+
+    def retrieve_full_paper_text(self, query, MAX_LEN=50000):
+        return self.remote.retrieve_full_paper_text(query, MAX_LEN)
+
+    def report(self):
+        total = self.local_hits + self.remote_queries
+        if total == 0: return
+        from logger import get_logger
+        get_logger().metric("paper_index_local_hit_rate", self.local_hits / total, "ratio")
@@ -1,6 +1,8 @@
 import os, re
+import json
 import shutil
 import time
+import hashlib
 import tiktoken, openai
 import subprocess, string
 from openai import OpenAI
@@ -194,6 +196,46 @@ def save_to_file(location, filename, data):
         print(f"Error saving file {filename}: {e}")
 
 
+# Datasets materialized by load_dataset_cached, shared by every run and every lab on the machine
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "agent_lab_datasets"))
+_loaded_datasets = {}
+
+def load_dataset_cached(path, name=None, split=None, cache_dir=None, **kwargs):
+    """
+    Load a HuggingFace dataset like datasets.load_dataset, materialized once into a shared Arrow cache.
+    The first call downloads and prepares the dataset while holding a file lock and saves it to disk;
+    every later call, from any process, memory-maps the saved Arrow files instead of rebuilding them
+    @param path: (str) dataset name or path, as for datasets.load_dataset
+    @param name: (str) dataset configuration
+    @param split: (str) split to load, all splits when None
+    @param cache_dir: (str) directory of the shared cache, defaults to DATASET_CACHE_DIR
+    @param kwargs: other datasets.load_dataset arguments, part of the cache key
+    @return: (Dataset or DatasetDict) memory-mapped dataset
+    """
+    from filelock import FileLock
+    import datasets
+    cache_dir = cache_dir or DATASET_CACHE_DIR
+    material = json.dumps({"path": path, "name": name, "split": split, "kwargs": kwargs}, sort_keys=True, default=str)
+    key = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{path}-{name}-{split}")[:80] + "-" + hashlib.sha256(material.encode()).hexdigest()[:16]
+    target = os.path.join(cache_dir, key)
+    if key in _loaded_datasets and os.path.isdir(target):
+        return _loaded_datasets[key]
+    if not os.path.isdir(target):
+        os.makedirs(cache_dir, exist_ok=True)
+        with FileLock(target + ".lock"):
+            # another process may have saved it while we waited for the lock
+            if not os.path.isdir(target):
+                dataset = datasets.load_dataset(path, name, split=split, **kwargs)
+                partial = f"{target}.partial-{os.getpid()}"
+                try:
+                    dataset.save_to_disk(partial)
+                    # readers only ever see a complete copy
+                    os.rename(partial, target)
+                finally:
+                    shutil.rmtree(partial, ignore_errors=True)
+    _loaded_datasets[key] = datasets.load_from_disk(target, keep_in_memory=False)
+    return _loaded_datasets[key]
+
 def clip_tokens(messages, model="gpt-4", max_tokens=100000):
     enc = tiktoken.encoding_for_model(model)
     total_tokens = sum([len(enc.encode(message["content"])) for message in messages])